@@ -30,6 +30,12 @@ class ApiCacheAdmin(admin.ModelAdmin):
   pass
 
 
+@admin.register(GaView)
+class GaViewAdmin(admin.ModelAdmin):
+  list_display = ('id', 'name', 'property', 'account')
+  search_fields = ('id', 'name')
+
+
 @admin.register(GaParams)
 class GaParamsAdmin(admin.ModelAdmin):
   list_display = ('scope', 'start_date', 'end_date')
@@ -40,6 +46,12 @@ class CheckExecutionAdmin(admin.ModelAdmin):
   list_display = ('check_ref', 'status', 'success', 'created')
 
 
+@admin.register(WorkItem)
+class WorkItemAdmin(admin.ModelAdmin):
+  list_display = ('check_ref', 'suite_execution', 'status', 'lease_owner',
+    'lease_expires', 'attempts')
+
+
 class CheckExecutionInline(admin.TabularInline):
   model = CheckExecution
   fields = ('status', 'success', 'input_data_json', 'result_json')
@@ -64,6 +76,11 @@ class SuiteExecutionInline(admin.TabularInline):
   extra = 0
 
 
+class ScheduleInline(admin.TabularInline):
+  model = Schedule
+  extra = 0
+
+
 class GaParamsInline(admin.TabularInline):
   model = GaParams
   extra = 0
@@ -71,6 +88,7 @@ class GaParamsInline(admin.TabularInline):
 
 @admin.register(Suite)
 class SuiteAdmin(admin.ModelAdmin):
-  inlines = (GaParamsInline, CheckInline, SuiteExecutionInline,)
+  inlines = (GaParamsInline, ScheduleInline, CheckInline,
+    SuiteExecutionInline,)
   list_display = ('id', 'name',)
 
@@ -16,13 +16,21 @@
 """
 
 from dataclasses import asdict
+from datetime import datetime
 import json
+import logging
+import threading
+import traceback
+from typing import Dict
 
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
 from django.http.response import JsonResponse
 from django.shortcuts import get_object_or_404
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from dqm.api.encoders import DqmApiEncoder
+from dqm.estimator import estimate
 from dqm.helpers import analytics
 from dqm.models import (
   ApiCache,
@@ -30,11 +38,15 @@ from dqm.models import (
   Check,
   CheckExecution,
   GaParams,
+  Schedule,
   Suite,
   SuiteExecution,
 )
 
 
+logger = logging.getLogger(__name__)
+
+
 @csrf_exempt
 def app_settings(request):
   app_settings = AppSettings.load()
@@ -47,50 +59,48 @@ def app_settings(request):
 
 @csrf_exempt
 def cache(request):
+  """Cached GA accounts, refreshed in the background when older than
+  `API_CACHE_TTL_SECONDS`.
+  """
   cache = ApiCache.load()
+  started = cache.ga_accounts_stale and ApiCache.start_ga_accounts_refresh()
+  if started:
+    threading.Thread(target=refresh_ga_accounts, args=(started, True),
+      daemon=True).start()
+
   return JsonResponse({'cache': {
-    'gaAccounts': cache.ga_accounts
+    'gaAccounts': cache.ga_accounts,
+    'gaAccountsAge': cache.ga_accounts_age,
   }})
 
 
 @csrf_exempt
 def ga_accounts(request):
-  ga_accounts = analytics.get_accounts()
-
-  accounts = [{
-    'id': a['id'],
-    'name': a['name'],
-    'webProperties': [{
-      'id': p['id'],
-      'name': p['name'],
-      'accountId': p['accountId'],
-      'websiteUrl': p['websiteUrl'],
-      'views': [{
-        'id': v['id'],
-        'name': v['name'],
-        'accountId': v['accountId'],
-        'webPropertyId': v['webPropertyId'],
-        'websiteUrl': v['websiteUrl'],
-        'type': v['type'],
-        'eCommerceTracking': v['eCommerceTracking'],
-        'enhancedECommerceTracking': (v['enhancedECommerceTracking']
-          if 'enhancedECommerceTracking' in v else False),
-        'botFilteringEnabled': v['botFilteringEnabled'],
-        'excludeQueryParameters': (v['excludeQueryParameters']
-          if 'excludeQueryParameters' in v else False),
-        'siteSearchQueryParameters': (v['siteSearchQueryParameters']
-          if 'siteSearchQueryParameters' in v else False),
-        'stripSiteSearchQueryParameters': (v['stripSiteSearchQueryParameters']
-          if 'stripSiteSearchQueryParameters' in v else False),
-      } for v in p['views']]
-    } for p in a['webProperties']]
-  } for a in ga_accounts]
-
-  # Each time we fetch accounts data from the API, we update the cache.
-  ApiCache.load().update(
-    ga_accounts_json=json.dumps(accounts, cls=DqmApiEncoder))
-
-  return JsonResponse({'gaAccounts': accounts}, encoder=DqmApiEncoder)
+  """GA accounts, fetched from the API right away, unless a refresh is already
+  running: cached accounts are then returned.
+  """
+  started = ApiCache.start_ga_accounts_refresh()
+  if started:
+    refresh_ga_accounts(started)
+
+  cache = ApiCache.load()
+  return JsonResponse({'gaAccounts': cache.ga_accounts,
+    'gaAccountsAge': cache.ga_accounts_age}, encoder=DqmApiEncoder)
+
+
+def refresh_ga_accounts(started: datetime, background: bool = False) -> None:
+  """Refresh cached GA accounts (see `ApiCache.start_ga_accounts_refresh`).
+  """
+  accounts = None
+  try:
+    accounts = analytics.get_accounts()
+  except Exception:
+    logger.error(traceback.format_exc())
+  finally:
+    ApiCache.update_ga_accounts(accounts, started=started)
+    # Each thread has its own database connection.
+    if background:
+      connection.close()
 
 
 @csrf_exempt
@@ -118,16 +128,25 @@ def create_suite(request):
 
 
 def get_suite(request, suite_id):
+  summary = request.GET.get('summary') in ('1', 'true')
   suite = get_object_or_404(Suite.objects.prefetch_related('ga_params'),
     pk=suite_id)
   executions = SuiteExecution.objects.filter(suite=suite).prefetch_related(
     'check_executions__check_ref').order_by('-created')
+  # Payloads stored as deltas are rebuilt from previous executions.
+  CheckExecution.prefetch_previous(
+    ce for se in executions for ce in se.check_executions.all())
   checks = Check.objects.filter(suite_id=suite.id)
   check_metadata = Check.get_checks_metadata()
 
   result = {
     'id': suite.id,
     'name': suite.name,
+    'timeout': suite.timeout,
+    'failFast': suite.fail_fast,
+    'coalesceRuns': suite.coalesce_runs,
+    'detailRetentionDays': suite.detail_retention_days,
+    'summaryRetentionDays': suite.summary_retention_days,
     'created': suite.created,
     'updated': suite.updated,
     'gaParams': {
@@ -135,6 +154,15 @@ def get_suite(request, suite_id):
       'startDate': suite.ga_params.start_date,
       'endDate': suite.ga_params.end_date,
     },
+    'schedules': [{
+      'id': sc.id,
+      'cron': sc.cron,
+      'interval': sc.interval,
+      'jitter': sc.jitter,
+      'active': sc.active,
+      'nextRun': sc.next_run,
+      'lastRun': sc.last_run,
+    } for sc in suite.schedules.all()],
     'checks': [{
       'id': c.id,
       'name': c.name,
@@ -146,6 +174,7 @@ def get_suite(request, suite_id):
     } for c in checks],
     'executions': [{
       'id': se.id,
+      'status': se.get_status_display(),
       'success': se.success,
       'executed': se.executed,
       'checkExecutions': [{
@@ -154,9 +183,10 @@ def get_suite(request, suite_id):
         'name': ce.check_ref.name,
         'status': ce.get_status_display(),
         'success': ce.success,
+        'reused': ce.reused,
         'inputData': json.loads(ce.input_data_json) if ce.input_data_json
                       else {},
-        'result': json.loads(ce.result_json) if ce.result_json else {},
+        'result': ce.get_result(summary=summary),
       } for ce in se.check_executions.all()]
     } for se in executions]
   }
@@ -169,15 +199,62 @@ def update_suite(request, suite_id):
   s = get_object_or_404(Suite, pk=suite_id)
   ga = GaParams.objects.get(id=s.ga_params.id)
 
+  # Schedules and suite settings are validated before anything is updated.
+  if 'schedules' in payload:
+    if not isinstance(payload['schedules'], list) or not all(
+        isinstance(sc, dict) for sc in payload['schedules']):
+      return JsonResponse({'errors': {
+        'schedules': ['A list of schedules is expected.']}}, status=400)
+    schedules = [Schedule(suite=s,
+      cron=sc.get('cron'),
+      interval=sc.get('interval'),
+      jitter=sc.get('jitter', 300),
+      active=sc.get('active', True)) for sc in payload['schedules']]
+    try:
+      for schedule in schedules:
+        schedule.full_clean()
+    except ValidationError as e:
+      return JsonResponse({'errors': e.message_dict}, status=400)
+
+  if 'timeout' in payload:
+    s.timeout = payload['timeout'] or None
+  if 'failFast' in payload:
+    s.fail_fast = payload['failFast']
+  if 'coalesceRuns' in payload:
+    s.coalesce_runs = payload['coalesceRuns']
+  if 'detailRetentionDays' in payload:
+    s.detail_retention_days = payload['detailRetentionDays']
+  if 'summaryRetentionDays' in payload:
+    s.summary_retention_days = payload['summaryRetentionDays']
+  try:
+    # Suites created without a name are still valid.
+    s.full_clean(exclude=['name'])
+  except ValidationError as e:
+    return JsonResponse({'errors': e.message_dict}, status=400)
+
   if 'gaParams' in payload:
-    ga.scope_json = json.dumps(payload['gaParams']['scope'])
+    ga.set_scope(payload['gaParams']['scope'])
     ga.start_date = payload['gaParams']['startDate']
     ga.end_date = payload['gaParams']['endDate']
     ga.save()
 
+  s.save()
+
+  # Schedules are replaced as a whole.
+  if 'schedules' in payload:
+    with transaction.atomic():
+      s.schedules.all().delete()
+      for schedule in schedules:
+        schedule.save()
+
   suite = {
     'id': s.id,
     'name': s.name,
+    'timeout': s.timeout,
+    'failFast': s.fail_fast,
+    'coalesceRuns': s.coalesce_runs,
+    'detailRetentionDays': s.detail_retention_days,
+    'summaryRetentionDays': s.summary_retention_days,
     'gaParams': {
       'scope': s.ga_params.scope,
       'start_date': s.ga_params.start_date,
@@ -193,11 +270,20 @@ def update_suite(request, suite_id):
 
 
 def delete_suite(request, suite_id):
-  Suite.objects.filter(pk=suite_id).delete()
+  # The suite is purged in the background (see `janitor.purge_deleted_suites`).
+  for suite in Suite.objects.filter(pk=suite_id):
+    suite.soft_delete()
   return JsonResponse({'status': 'OK'}, encoder=DqmApiEncoder)
 
 
 def suites_list(request):
+  # Suites can be filtered by GA view, property or account in their scope.
+  suites = Suite.objects.all()
+  if {'viewId', 'webPropertyId', 'accountId'} & request.GET.keys():
+    suites = Suite.covering(view_id=request.GET.get('viewId'),
+      property_id=request.GET.get('webPropertyId'),
+      account_id=request.GET.get('accountId'))
+
   suites = [{
     'id': s.id,
     'name': s.name,
@@ -207,8 +293,7 @@ def suites_list(request):
       'id': se.id,
       'success': se.success,
     } for se in s.executions.all()],
-  } for s in Suite.objects.all().prefetch_related(
-              'executions').order_by('-created')]
+  } for s in suites.prefetch_related('executions').order_by('-created')]
 
   # Django would issue (n) db queries to deal with the last execution, so we
   # process it in raw Python...
@@ -297,14 +382,12 @@ def check(request, suite_id, check_id):
     return delete_check(request, suite_id, check_id)
 
 
-@csrf_exempt
-@require_http_methods(['POST'])
-def run_suite(request, suite_id):
-  suite = get_object_or_404(Suite.objects.select_related('ga_params'),
-                            pk=suite_id)
-  se = suite.execute()
-  result = {
+def suite_execution_result(se: SuiteExecution, summary: bool = False) -> Dict:
+  check_executions = se.check_executions.select_related('check_ref')
+  CheckExecution.prefetch_previous(check_executions)
+  return {
     'id': se.id,
+    'status': se.get_status_display(),
     'success': se.success,
     'executed': se.executed,
     'checkExecutions': [{
@@ -313,14 +396,90 @@ def run_suite(request, suite_id):
       'title': ce.check_ref.check_class.title,
       'status': ce.get_status_display(),
       'success': ce.success,
+      'reused': ce.reused,
       'inputData': json.loads(ce.input_data_json) if ce.input_data_json else {},
-      'result': json.loads(ce.result_json) if ce.result_json else {},
-    } for ce in se.check_executions.all()]
+      'result': ce.get_result(summary=summary),
+    } for ce in check_executions]
   }
 
+
+@csrf_exempt
+@require_http_methods(['POST'])
+def run_suite(request, suite_id):
+  suite = get_object_or_404(Suite.objects.select_related('ga_params'),
+                            pk=suite_id)
+  force = request.GET.get('force') in ('1', 'true')
+  # Defaults to the suite setting.
+  fail_fast = {'1': True, 'true': True, '0': False, 'false': False}.get(
+    request.GET.get('fail_fast'))
+  se = suite.execute(force=force, fail_fast=fail_fast)
+  summary = request.GET.get('summary') in ('1', 'true')
+  result = suite_execution_result(se, summary=summary)
+
+  return JsonResponse({'result': result}, encoder=DqmApiEncoder)
+
+
+@csrf_exempt
+@require_http_methods(['POST'])
+def resume_suite_execution(request, suite_id, suite_execution_id):
+  """Endpoint that executes again the missing or failed checks of an
+  execution.
+  """
+  se = get_object_or_404(SuiteExecution, pk=suite_execution_id,
+    suite_id=suite_id)
+  se = se.resume()
+  summary = request.GET.get('summary') in ('1', 'true')
+  result = suite_execution_result(se, summary=summary)
+
   return JsonResponse({'result': result}, encoder=DqmApiEncoder)
 
 
+@csrf_exempt
+@require_http_methods(['POST'])
+def cancel_suite_execution(request, suite_id, suite_execution_id):
+  """Endpoint that cancels a queued or running execution.
+  """
+  se = get_object_or_404(SuiteExecution, pk=suite_execution_id,
+    suite_id=suite_id)
+  se.cancel()
+  summary = request.GET.get('summary') in ('1', 'true')
+  result = suite_execution_result(se, summary=summary)
+
+  return JsonResponse({'result': result}, encoder=DqmApiEncoder)
+
+
+def estimate_suite(request, suite_id):
+  """Endpoint that estimates the cost of an execution of the suite, without
+  executing it (see `dqm.estimator`).
+  """
+  suite = get_object_or_404(Suite.objects.select_related('ga_params'),
+                            pk=suite_id)
+  count_rows = request.GET.get('rows') in ('1', 'true')
+  return JsonResponse({'estimate': estimate(suite, count_rows=count_rows)},
+    encoder=DqmApiEncoder)
+
+
+def check_execution_payload(request, check_execution_id):
+  """Endpoint that returns a chunk of a streamed result payload.
+  """
+  ce = get_object_or_404(CheckExecution, pk=check_execution_id)
+  try:
+    index = int(request.GET.get('chunk', 0))
+  except ValueError:
+    return JsonResponse({'errors': {'chunk': ['A chunk index is expected.']}},
+      status=400)
+  return JsonResponse({'payload': ce.get_payload_chunk(index=index)},
+    encoder=DqmApiEncoder)
+
+
+def check_execution_delta(request, check_execution_id):
+  """Endpoint that returns the problems added ("new since last run") and
+  resolved since the previous execution of the check on the same scope.
+  """
+  ce = get_object_or_404(CheckExecution, pk=check_execution_id)
+  return JsonResponse(ce.get_delta(), encoder=DqmApiEncoder)
+
+
 def stats_suites_executions(request):
   return JsonResponse({
     'result': SuiteExecution.get_stats()}, encoder=DqmApiEncoder)
@@ -13,13 +13,14 @@
 # limitations under the License.
 
 from abc import ABC
-from dataclasses import asdict, dataclass
+from dataclasses import asdict, dataclass, field, fields
 from datetime import date, datetime
 from distutils.util import strtobool
 from enum import Enum
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional
 
 from dqm import errors
+from dqm.helpers import analytics
 
 
 class DataType(Enum):
@@ -57,10 +58,89 @@ class ResultField:
   title: Optional[str] = None
 
 
+@dataclass
+class ReportRequest:
+  """A GA Reporting API report a check relies on.
+
+  Count-style checks, only interested in the number of distinct values of the
+  dimensions, should set `cardinality_only` so that rows are never fetched.
+  """
+  dimensions: List[str]
+  metrics: List[str]
+  cardinality_only: bool = False
+
+
+@dataclass
+class Dependency:
+  """A check the declaring check depends on, i.e. which is executed before it
+  (for the same scope) within a suite execution.
+
+  The declaring check is skipped if the execution of the prerequisite check
+  failed, or also if it detected problems when `require_success` is set.
+  Dependencies which are not `required` only order executions, e.g. to reuse
+  outputs of the prerequisite check.
+  """
+  check: str
+  required: bool = True
+  require_success: bool = False
+
+
 @dataclass
 class Result:
+  """The result of a check execution.
+
+  `total_problems` is set when the payload does not hold every detected problem
+  (see `Problems`), and `estimated` tells if this total has been extrapolated.
+  If it could not be (when failing fast on rows of unknown length),
+  `total_is_lower_bound` tells that this total is only a minimum.
+
+  `outputs` holds intermediate data declared in the check `outputs`, passed in
+  memory to dependent checks (see `Check.inputs`). It is not persisted.
+  """
   payload: List
   success: bool = False
+  total_problems: Optional[int] = None
+  estimated: bool = False
+  total_is_lower_bound: bool = False
+  outputs: Dict[str, Any] = field(default_factory=dict, repr=False)
+
+  def to_dict(self) -> Dict[str, Any]:
+    """Same as `asdict`, but without deep-copying the payload (which can be
+    huge), as the result is meant to be serialized right away.
+    """
+    return {f.name: getattr(self, f.name) for f in fields(self)
+            if f.name != 'outputs'}
+
+
+@dataclass
+class AggregatedResult(Result):
+  """A `Result` variant where problems are grouped by the value of the
+  `group_by` field (see `AggregatedProblems`).
+
+  The payload contains one item per group, sorted by decreasing count:
+  [
+    {
+      'group': 'e-mail',
+      'count': 1234,
+      'error': 0,  # Max overestimation of `count` (and `hits`).
+      'hits': 5678,  # Only if problems have a "hits" field.
+      'examples': [{'url': '/?e-mail=...', 'param': 'e-mail'}, ...],
+    },
+    # ...
+  ]
+  """
+  group_by: str = ''
+
+  @staticmethod
+  def summarize(result: Dict) -> Dict:
+    """Return the summary form of a (serialized) result, i.e. without examples.
+    Results which are not aggregated are returned untouched.
+    """
+    if not result.get('group_by'):
+      return result
+    return {**result, 'payload': [
+      {k: v for k, v in g.items() if k != 'examples'}
+      for g in result['payload']]}
 
 
 @dataclass
@@ -141,6 +221,192 @@ class Parameter:
     return self.cast(value) if value != None else self.cast(self.default)
 
 
+# Parameters to be added to checks relying on `Check.problems`, allowing users to
+# bound the number of problems recorded.
+PROBLEMS_PARAMETERS = [
+  Parameter(name='max_problems',
+    title='Max number of problems recorded (0 for no limit)',
+    data_type=DataType.INT,
+    default=1000),
+  Parameter(name='fail_fast',
+    title='Stop as soon as max number of problems is reached',
+    data_type=DataType.BOOLEAN,
+    default=False),
+]
+
+
+# Parameters to be added to checks declaring an `aggregate_by` field, allowing
+# users to get problems grouped by this field instead of a flat list.
+AGGREGATION_PARAMETERS = [
+  Parameter(name='aggregate',
+    title='Group problems instead of listing them',
+    data_type=DataType.BOOLEAN,
+    default=False),
+  Parameter(name='max_groups',
+    title='Max number of groups tracked',
+    data_type=DataType.INT,
+    default=100),
+  Parameter(name='top_k',
+    title='Number of examples kept per group',
+    data_type=DataType.INT,
+    default=5),
+]
+
+
+class Problems:
+  """Collect the problems detected by a check, with bounded memory.
+
+  At most `max_problems` problems are recorded (0 means no limit). Once the cap
+  is reached, the remaining problems are only counted... unless `fail_fast` is
+  set, in which case scanning stops and the total number of problems is
+  extrapolated from the share of rows scanned so far (or only known to be a
+  minimum, if the number of rows is unknown).
+
+  >>> problems = Problems(max_problems=2)
+  >>> for row in problems.scan(range(10)):
+  ...   problems.add({'row': row})
+  >>> problems.result()
+  Result(payload=[{'row': 0}, {'row': 1}], success=False, total_problems=10, estimated=False, total_is_lower_bound=False)
+  >>> problems = Problems(max_problems=2, fail_fast=True)
+  >>> for row in problems.scan(range(10)):
+  ...   problems.add({'row': row})
+  >>> problems.result()
+  Result(payload=[{'row': 0}, {'row': 1}], success=False, total_problems=10, estimated=True, total_is_lower_bound=False)
+  """
+  def __init__(self, max_problems: int = 0, fail_fast: bool = False) -> None:
+    # Failing fast without any cap means stopping at the first problem.
+    self.max_problems = max_problems or (1 if fail_fast else 0)
+    self.fail_fast = fail_fast
+    self.items: List[Dict] = []
+    self.total = 0
+    self.estimated = False
+    self.total_is_lower_bound = False
+
+  @property
+  def full(self) -> bool:
+    return bool(self.max_problems) and self.total >= self.max_problems
+
+  def add(self, problem: Dict) -> None:
+    self.total += 1
+    if not self.max_problems or len(self.items) < self.max_problems:
+      self.items.append(problem)
+
+  def scan(self, rows: Iterable) -> Iterator:
+    """Iterate over the rows to check, stopping early if failing fast.
+    """
+    scanned = 0
+    for row in rows:
+      if self.fail_fast and self.full:
+        if hasattr(rows, '__len__'):
+          self.total = round(self.total * len(rows) / scanned)
+          self.estimated = True
+        else:
+          self.total_is_lower_bound = True
+        return
+      scanned += 1
+      yield row
+
+  def result(self) -> Result:
+    return Result(
+      payload=self.items,
+      success=not self.total,
+      total_problems=self.total,
+      estimated=self.estimated,
+      total_is_lower_bound=self.total_is_lower_bound)
+
+
+class HeavyHitters:
+  """A "Space-Saving" sketch, keeping track of the most frequent keys of a
+  stream with at most `capacity` counters.
+
+  As long as there are less distinct keys than counters, counts are exact.
+  Otherwise, the least frequent key is evicted to make room for new ones, which
+  inherit its count (recorded as `error`, the max overestimation).
+
+  >>> hh = HeavyHitters(capacity=2)
+  >>> for key in 'aaaabbbc':
+  ...   _ = hh.add(key)
+  >>> [(c['key'], c['count'], c['error']) for c in hh.top()]
+  [('a', 4, 0), ('c', 4, 3)]
+  """
+  def __init__(self, capacity: int) -> None:
+    self.capacity = max(capacity, 1)
+    self.counters: Dict[Any, Dict] = {}
+
+  def add(self, key: Any, weight: int = 1) -> Dict:
+    """Count `key` and return its counter.
+    """
+    counter = self.counters.get(key)
+    if counter is None:
+      if len(self.counters) < self.capacity:
+        counter = {'key': key, 'count': 0, 'error': 0, 'weight': 0}
+      else:
+        evicted = self.counters.pop(min(self.counters,
+          key=lambda k: self.counters[k]['count']))
+        counter = {
+          'key': key,
+          'count': evicted['count'],
+          'error': evicted['count'],
+          'weight': evicted['weight'],
+        }
+      self.counters[key] = counter
+    counter['count'] += 1
+    counter['weight'] += weight
+    return counter
+
+  def top(self, k: Optional[int] = None) -> List[Dict]:
+    counters = sorted(self.counters.values(), key=lambda c: -c['count'])
+    return counters[:k] if k else counters
+
+
+class AggregatedProblems(Problems):
+  """Same as `Problems`, except that problems are not recorded one by one but
+  grouped by the value of their `group_by` field, so that memory (and storage)
+  depends on the number of groups, not on the number of problems.
+
+  For each group, the number of problems, the sum of their `hits_field` values
+  (if any) and up to `top_k` examples are kept. At most `max_groups` groups are
+  tracked (see `HeavyHitters`).
+  """
+  def __init__(self,
+    group_by: str,
+    hits_field: Optional[str] = None,
+    max_groups: int = 100,
+    top_k: int = 5,
+    max_problems: int = 0,
+    fail_fast: bool = False) -> None:
+    super().__init__(max_problems=max_problems, fail_fast=fail_fast)
+    self.group_by = group_by
+    self.hits_field = hits_field
+    self.top_k = top_k
+    self.groups = HeavyHitters(capacity=max_groups)
+
+  def add(self, problem: Dict) -> None:
+    self.total += 1
+    hits = int(problem[self.hits_field]) if self.hits_field else 0
+    counter = self.groups.add(problem[self.group_by], weight=hits)
+    examples = counter.setdefault('examples', [])
+    if len(examples) < self.top_k:
+      examples.append(problem)
+
+  def result(self) -> AggregatedResult:
+    payload = []
+    for c in self.groups.top():
+      group = {'group': c['key'], 'count': c['count'], 'error': c['error']}
+      if self.hits_field:
+        group['hits'] = c['weight']
+      group['examples'] = c['examples']
+      payload.append(group)
+
+    return AggregatedResult(
+      payload=payload,
+      success=not self.total,
+      total_problems=self.total,
+      estimated=self.estimated,
+      total_is_lower_bound=self.total_is_lower_bound,
+      group_by=self.group_by)
+
+
 class Check(ABC):
   """The base class for every check to inherit from.
   """
@@ -150,6 +416,21 @@ class Check(ABC):
   theme: Theme = Theme.Generic
   platform: Platform = Platform.Generic
   ga_level: GaLevel = GaLevel.View
+  estate_mode: bool = False
+  aggregate_by: Optional[str] = None
+  aggregate_hits: Optional[str] = None
+  report_requests: List[ReportRequest] = []
+  # To be increased whenever the logic of the check changes, so that previous
+  # results are not reused (see `CheckExecution.get_reusable`).
+  version: int = 1
+  # Maximum execution time in seconds, defaults to `CHECK_TIMEOUT` setting.
+  timeout: Optional[int] = None
+  depends_on: List[Dependency] = []
+  # Names of the `Result.outputs` made available to dependent checks, which
+  # get them in `inputs` when executed within the same process (otherwise, they
+  # should fall back to computing them).
+  outputs: List[str] = []
+  inputs: Dict[str, Any] = {}
   parameters: List[Parameter] = []
   result_fields: List[ResultField] = []
 
@@ -209,9 +490,55 @@ class Check(ABC):
 
     return valid
 
+  def fetch(self, report: ReportRequest, params: Dict) -> Any:
+    """Fetch a report for the view and date range of the given (validated)
+    parameters: only the number of rows if the report is `cardinality_only`
+    (see `analytics.get_row_count`), the rows otherwise.
+    """
+    fetch = (analytics.get_row_count if report.cardinality_only
+             else analytics.get_report_rows)
+    return fetch(view_id=params['viewId'],
+      start_date=params['startDate'],
+      end_date=params['endDate'],
+      dimensions=report.dimensions,
+      metrics=report.metrics)
+
+  def problems(self, params: Dict) -> Problems:
+    """Return a `Problems` collector configured from the `max_problems` and
+    `fail_fast` parameters (see `PROBLEMS_PARAMETERS`).
+
+    If the check declares an `aggregate_by` field and the `aggregate` parameter
+    is set, an `AggregatedProblems` collector is returned instead (see
+    `AGGREGATION_PARAMETERS`).
+    """
+    if self.aggregate_by and params.get('aggregate', False):
+      return AggregatedProblems(
+        group_by=self.aggregate_by,
+        hits_field=self.aggregate_hits,
+        max_groups=params.get('max_groups', 100),
+        top_k=params.get('top_k', 5),
+        max_problems=params.get('max_problems', 0),
+        fail_fast=params.get('fail_fast', False))
+
+    return Problems(
+      max_problems=params.get('max_problems', 0),
+      fail_fast=params.get('fail_fast', False))
+
   def run(self, params: List) -> Result:
     """This abstract method has to be overiden for each check class, and should
     contain all the testing logic, returning a populated `Result` object.
     """
     raise errors.CheckNotImplementedError(
       check_name=self.get_metadata()['name'])
+
+  def run_estate(self, params_list: List[Dict]) -> Result:
+    """This method has to be overiden by check classes declaring
+    `estate_mode = True`.
+
+    Instead of being executed once per scope (e.g. once per GA view), such
+    checks are given the parameters for all scopes at once, so that data can be
+    fetched in batch and evaluated in a single pass. The returned `Result`
+    payload is expected to be a per-scope table.
+    """
+    raise errors.EstateModeNotImplementedError(
+      check_name=self.get_metadata()['name'])
@@ -19,9 +19,9 @@ class CheckDummy(Check):
   """A simple no-op "dummy" check.
 
   >>> CheckDummy().run(params={})
-  Result(payload=[], success=True)
+  Result(payload=[], success=True, total_problems=None, estimated=False, total_is_lower_bound=False)
   >>> CheckDummy().run(params={'success': False, 'problems': 'Oops,Too bad'})
-  Result(payload=['Oops', 'Too bad'], success=False)
+  Result(payload=[{'problem': 'Oops'}, {'problem': 'Too bad'}], success=False, total_problems=None, estimated=False, total_is_lower_bound=False)
   """
   title = 'No op dummy check'
   description = """
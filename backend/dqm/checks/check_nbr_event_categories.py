@@ -12,11 +12,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from itertools import groupby
+
 from dqm.check_bricks import (
   Check,
   DataType,
   Parameter,
   Platform,
+  ReportRequest,
   Result,
   ResultField,
   Theme,
@@ -34,13 +37,27 @@ class CheckNbrEventCategories(Check):
   ""ga:totalEvents"" metric) returns 4 or less unique results
   THEN
   The view should be flagged as not measuring enough user actions
+
+  Only the number of event categories is fetched, never the categories
+  themselves. When executed in estate mode, counts are fetched for every view
+  (in parallel), and the threshold is evaluated for all views at once.
+
+  Every view is listed in the result, with its number of event categories,
+  failing views being flagged (and counted as problems).
   """
   title = '5 event categories'
   description = 'Detect if any view is measuring enough user actions.'
   platform = Platform.Ga
   theme = Theme.Trustful
+  estate_mode = True
+  report_requests = [
+    ReportRequest(dimensions=['ga:eventCategory'], metrics=['ga:totalEvents'],
+      cardinality_only=True),
+  ]
   parameters = [
     Parameter(name='viewId', data_type=DataType.STRING, delegate=True),
+    Parameter(name='accountId', data_type=DataType.STRING, default='',
+      delegate=True),
     Parameter(name='startDate', data_type=DataType.DATE, delegate=True),
     Parameter(name='endDate', data_type=DataType.DATE, delegate=True),
     Parameter(name='min_nbr_event_categories',
@@ -49,25 +66,54 @@ class CheckNbrEventCategories(Check):
       default=5),
   ]
   result_fields = [
+    ResultField(name='viewId', title='View Id', data_type=DataType.STRING),
     ResultField(name='nbr_event_categories',
       title='Number of event caterogies',
       data_type=DataType.INT),
+    ResultField(name='passed', title='Enough event categories',
+      data_type=DataType.BOOLEAN),
   ]
 
+  def _evaluate(self, params, nbr_event_categories):
+    return {
+      'viewId': params['viewId'],
+      'nbr_event_categories': nbr_event_categories,
+      'passed': nbr_event_categories >= params['min_nbr_event_categories'],
+    }
+
+  def _result(self, rows):
+    nbr_failed = sum(1 for r in rows if not r['passed'])
+    return Result(success=not nbr_failed, payload=rows,
+      total_problems=nbr_failed)
+
   def run(self, params):
     params = self.validate_values(params)
 
-    event_categories = analytics.get_event_categories(
-      view_id=params['viewId'],
-      start_date=params['startDate'],
-      end_date=params['endDate'])
+    nbr_event_categories = self.fetch(self.report_requests[0], params)
+
+    return self._result([self._evaluate(params, nbr_event_categories)])
+
+  def run_estate(self, params_list):
+    params_list = [self.validate_values(p) for p in params_list]
 
-    nbr_event_categories = len(event_categories)
+    def date_range(params):
+      return (params['startDate'], params['endDate'])
 
-    if nbr_event_categories < params['min_nbr_event_categories']:
-      errors = [{'nbr_event_categories': '{} (should be at least {})'.format(
-        nbr_event_categories, params['min_nbr_event_categories'])}]
-    else:
-      errors = []
+    # Counts are fetched once for all views sharing the same date range (which
+    # is always the case within a suite).
+    report = self.report_requests[0]
+    rows = []
+    for (start_date, end_date), group in groupby(
+        sorted(params_list, key=date_range), key=date_range):
+      group = list(group)
+      counts = analytics.get_row_counts(
+        view_ids=[p['viewId'] for p in group],
+        start_date=start_date,
+        end_date=end_date,
+        dimensions=report.dimensions,
+        metrics=report.metrics,
+        account_ids={p['viewId']: p['accountId'] for p in group
+                     if p['accountId']})
+      rows += [self._evaluate(p, counts[p['viewId']]) for p in group]
 
-    return Result(success=not errors, payload=errors)
\ No newline at end of file
+    return self._result(rows)
@@ -19,6 +19,7 @@ from dqm.check_bricks import (
   DataType,
   Parameter,
   Platform,
+  ReportRequest,
   Result,
   ResultField,
   Theme,
@@ -43,6 +44,9 @@ class CheckNoStagingTraffic(Check):
   description = 'Detect if data collection is coming from staging hostname.'
   platform = Platform.Ga
   theme = Theme.Trustful
+  report_requests = [
+    ReportRequest(dimensions=['ga:hostname'], metrics=['ga:hits']),
+  ]
   parameters = [
     Parameter(name='viewId', data_type=DataType.STRING, delegate=True),
     Parameter(name='startDate', data_type=DataType.DATE, delegate=True),
@@ -13,11 +13,14 @@
 # limitations under the License.
 
 from dqm.check_bricks import (
+  AGGREGATION_PARAMETERS,
   Check,
   DataType,
+  Dependency,
   Parameter,
   Platform,
-  Result,
+  PROBLEMS_PARAMETERS,
+  ReportRequest,
   ResultField,
   Theme,
 )
@@ -43,6 +46,10 @@ class CheckNonUsefulParameters(Check):
   """
   platform = Platform.Ga
   theme = Theme.Trustful
+  aggregate_by = 'param'
+  report_requests = [
+    ReportRequest(dimensions=['ga:pagePath'], metrics=['ga:hits']),
+  ]
   parameters = [
     Parameter(name='viewId', data_type=DataType.STRING, delegate=True),
     Parameter(name='startDate', data_type=DataType.DATE, delegate=True),
@@ -51,7 +58,10 @@ class CheckNonUsefulParameters(Check):
       title='Parameters blacklist',
       data_type=DataType.LIST,
       default=['msclkid', 'fbclid', 'token', 'vid', 'cid']),
+    *PROBLEMS_PARAMETERS,
+    *AGGREGATION_PARAMETERS,
   ]
+  depends_on = [Dependency(check='CheckPii', required=False)]
   result_fields = [
     ResultField(name='url', title='URL', data_type=DataType.STRING),
     ResultField(name='param', title='Parameter name', data_type=DataType.STRING)
@@ -61,19 +71,22 @@ class CheckNonUsefulParameters(Check):
     params = self.validate_values(params)
 
     black_list = params['blackList']
-    urls = analytics.get_url_parameters(
-      view_id=params['viewId'],
-      start_date=params['startDate'],
-      end_date=params['endDate'])
+    # URL parameters may have been fetched by `CheckPii` already.
+    urls = self.inputs.get('url_parameters')
+    if urls is None:
+      urls = analytics.get_url_parameters(
+        view_id=params['viewId'],
+        start_date=params['startDate'],
+        end_date=params['endDate'])
 
     # TODO: add "mt_*="
-    problems = []
-    for url in urls:
+    problems = self.problems(params)
+    for url in problems.scan(urls):
       for p in url['params']:
         if p in black_list:
-          problems.append({
+          problems.add({
             'url': url['url'],
             'param': p,
           })
 
-    return Result(success=not problems, payload=problems)
\ No newline at end of file
+    return problems.result()
\ No newline at end of file
@@ -13,11 +13,13 @@
 # limitations under the License.
 
 from dqm.check_bricks import (
+  AGGREGATION_PARAMETERS,
   Check,
   DataType,
   Parameter,
   Platform,
-  Result,
+  PROBLEMS_PARAMETERS,
+  ReportRequest,
   ResultField,
   Theme,
 )
@@ -44,13 +46,20 @@ class CheckPii(Check):
   """
   platform = Platform.Ga
   theme = Theme.Trustful
+  aggregate_by = 'param'
+  report_requests = [
+    ReportRequest(dimensions=['ga:pagePath'], metrics=['ga:hits']),
+  ]
   parameters = [
     Parameter(name='viewId', data_type=DataType.STRING, delegate=True),
     Parameter(name='startDate', data_type=DataType.DATE, delegate=True),
     Parameter(name='endDate', data_type=DataType.DATE, delegate=True),
     Parameter(name='blackList', title='PII to avoid', data_type=DataType.LIST,
       default=['e-mail', 'name', 'password']),
+    *PROBLEMS_PARAMETERS,
+    *AGGREGATION_PARAMETERS,
   ]
+  outputs = ['url_parameters']
   result_fields = [
     ResultField(name='url', title='URL', data_type=DataType.STRING),
     ResultField(name='param', title='Parameter name', data_type=DataType.STRING)
@@ -65,13 +74,16 @@ class CheckPii(Check):
       start_date=params['startDate'],
       end_date=params['endDate'])
 
-    problems = []
-    for url in urls:
+    problems = self.problems(params)
+    for url in problems.scan(urls):
       for p in url['params']:
         if p in black_list:
-          problems.append({
+          problems.add({
             'url': url['url'],
             'param': p,
           })
 
-    return Result(success=not problems, payload=problems)
+    # Reused by checks of URL parameters (see `CheckNonUsefulParameters`).
+    result = problems.result()
+    result.outputs = {'url_parameters': urls}
+    return result
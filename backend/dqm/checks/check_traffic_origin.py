@@ -13,11 +13,13 @@
 # limitations under the License.
 
 from dqm.check_bricks import (
+  AGGREGATION_PARAMETERS,
   Check,
   DataType,
   Parameter,
   Platform,
-  Result,
+  PROBLEMS_PARAMETERS,
+  ReportRequest,
   ResultField,
   Theme,
 )
@@ -41,6 +43,11 @@ class CheckTrafficOrigin(Check):
   description = 'Detect if traffic is referred from major adservers hostnames.'
   platform = Platform.Ga
   theme = Theme.Trustful
+  aggregate_by = 'referrer'
+  aggregate_hits = 'hits'
+  report_requests = [
+    ReportRequest(dimensions=['ga:fullReferrer'], metrics=['ga:hits']),
+  ]
   parameters = [
     Parameter(name='viewId', data_type=DataType.STRING, delegate=True),
     Parameter(name='startDate', data_type=DataType.DATE, delegate=True),
@@ -49,6 +56,8 @@ class CheckTrafficOrigin(Check):
       data_type=DataType.LIST,
       default=['stats.g.doubleclick.net', 'doubleclick.net',
         'googleads.g.doubleclick.net', 'tpc.googlesyndication.com', 'mail.']),
+    *PROBLEMS_PARAMETERS,
+    *AGGREGATION_PARAMETERS,
   ]
   result_fields = [
     ResultField(name='referrer', title='Referrer', data_type=DataType.STRING),
@@ -64,13 +73,13 @@ class CheckTrafficOrigin(Check):
       start_date=params['startDate'],
       end_date=params['endDate'])
 
-    problems = []
-    for ah in adservers_hostnames:
-      for r in referrers:
+    problems = self.problems(params)
+    for r in problems.scan(referrers):
+      for ah in adservers_hostnames:
         if ah in r[0]:
-          problems.append({
+          problems.add({
             'referrer': r[0],
             'hits': r[1],
           })
 
-    return Result(success=not problems, payload=problems)
\ No newline at end of file
+    return problems.result()
\ No newline at end of file
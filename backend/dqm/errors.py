@@ -31,6 +31,14 @@ class CheckNotImplementedError(NotImplementedError):
     return '[{}] Class has no run method'.format(self.check_name)
 
 
+class EstateModeNotImplementedError(NotImplementedError):
+  def __init__(self, check_name):
+      self.check_name = check_name
+
+  def __str__(self):
+    return '[{}] Class has no run_estate method'.format(self.check_name)
+
+
 class BadParametersError(RuntimeError):
   def __init__(self, check_name):
     self.check_name = check_name
@@ -92,3 +100,33 @@ class BadResultFielsError(RuntimeError):
   def __str__(self):
     return '[{}] Check result fields are not set correctly'.format(
       self.check_name)
+
+
+class BadCronExpressionError(ValueError):
+  def __init__(self, expression):
+    self.expression = expression
+
+  def __str__(self):
+    return 'Bad cron expression: "{}"'.format(self.expression)
+
+
+class CheckTimeoutError(RuntimeError):
+  def __init__(self, timeout):
+    self.timeout = timeout
+
+  def __str__(self):
+    return 'Check timed out after {}s'.format(self.timeout)
+
+
+class CheckCancelledError(RuntimeError):
+  def __str__(self):
+    return 'Check execution was cancelled'
+
+
+class DependencyCycleError(RuntimeError):
+  def __init__(self, check_names):
+    self.check_names = check_names
+
+  def __str__(self):
+    return 'Checks depend on each other: {}'.format(
+      ', '.join(self.check_names))
@@ -0,0 +1,134 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Dry-run planner estimating the cost of a suite execution before it starts.
+
+The scope is resolved the same way as when the suite is executed (see
+`Suite.get_work_items`), then:
+- GA API calls are counted from the report requests declared by checks (see
+  `check_bricks.ReportRequest`), deduplicated across checks and work items.
+- Durations are estimated from the durations of previous executions of each
+  check (see `CheckExecution.get_expected_durations`).
+- Optionally, rows are counted with cardinality-only requests (one API call
+  per deduplicated report request).
+"""
+
+from collections import Counter
+from datetime import datetime
+from itertools import groupby
+from typing import Dict, NamedTuple, Optional, Set
+
+from django.conf import settings
+from django.db import connection
+from dqm.helpers import analytics
+from dqm.models import CheckExecution, Priority, Suite, SuiteExecution
+
+
+class ReportKey(NamedTuple):
+  view_id: str
+  account_id: Optional[str]
+  start_date: str
+  end_date: str
+  dimensions: tuple
+  metrics: tuple
+  cardinality_only: bool
+
+
+def estimate(suite: Suite, count_rows: bool = False) -> Dict:
+  """Return the estimated cost of an execution of the suite, e.g.:
+  {
+    'workItems': 12,
+    'apiCalls': 8,
+    'apiCallsPerView': {'123456': 4, '123457': 4},
+    'quotaExceeded': False,
+    'rows': 5678,  # None unless `count_rows` is set.
+    'duration': 34.5,  # Sum of durations of work items, in seconds.
+    'wallClockDuration': 12.3,  # Given parallel execution.
+    'checks': [{'name': 'CheckPii', 'workItems': 2, 'reportRequests': 2,
+                'expectedDuration': 1.2}, ...],
+    'checksWithoutHistory': ['CheckTrafficOrigin'],
+  }
+  """
+  work_items = suite.get_work_items(
+    suite_execution=SuiteExecution(suite=suite, priority=Priority.Batch))
+  names = {i.check_ref.name for i in work_items}
+  durations = CheckExecution.get_expected_durations(check_names=names)
+
+  # Deduplicated report requests.
+  requests = set()
+  checks = {name: {'name': name, 'workItems': 0, 'reportRequests': 0,
+                   'expectedDuration': durations.get(name)}
+            for name in sorted(names)}
+  item_durations = []
+  for item in work_items:
+    check_class = item.check_ref.check_class
+    check = checks[item.check_ref.name]
+    check['workItems'] += 1
+    if check['expectedDuration'] is not None:
+      item_durations.append(check['expectedDuration'])
+
+    params_list = item.params if item.estate else [item.params]
+    for params in params_list:
+      if 'viewId' not in params:
+        continue
+      for r in check_class.report_requests:
+        check['reportRequests'] += 1
+        requests.add(ReportKey(params['viewId'], params.get('accountId'),
+          params['startDate'],
+          params['endDate'], tuple(r.dimensions), tuple(r.metrics),
+          r.cardinality_only))
+
+  calls_per_view = Counter(r.view_id for r in requests)
+  max_parallel = settings.SUITE_MAX_PARALLEL_CHECKS if (
+    connection.vendor != 'sqlite') else 1
+  total_duration = sum(item_durations)
+
+  return {
+    'workItems': len(work_items),
+    'apiCalls': len(requests),
+    'apiCallsPerView': dict(calls_per_view),
+    'quotaExceeded': len(requests) > settings.GA_QUOTA_REQUESTS_PER_DAY or any(
+      n > settings.GA_QUOTA_REQUESTS_PER_VIEW_PER_DAY
+      for n in calls_per_view.values()),
+    'rows': count_report_rows(requests) if count_rows else None,
+    'duration': total_duration,
+    'wallClockDuration': max([total_duration / max_parallel] + item_durations),
+    'checks': list(checks.values()),
+    'checksWithoutHistory': sorted(names - set(durations)),
+  }
+
+
+def count_report_rows(requests: Set[ReportKey]) -> int:
+  """Return the number of rows the given report requests would fetch.
+  Cardinality-only requests fetch a single row.
+  """
+  rows = sum(1 for r in requests if r.cardinality_only)
+
+  def report(r):
+    return r.start_date, r.end_date, r.dimensions, r.metrics
+
+  for (start_date, end_date, dimensions, metrics), group in groupby(
+      sorted((r for r in requests if not r.cardinality_only), key=report),
+      key=report):
+    group = list(group)
+    counts = analytics.get_row_counts(
+      view_ids=[r.view_id for r in group],
+      start_date=datetime.strptime(start_date, '%Y-%m-%d').date(),
+      end_date=datetime.strptime(end_date, '%Y-%m-%d').date(),
+      dimensions=list(dimensions),
+      metrics=list(metrics),
+      account_ids={r.view_id: r.account_id for r in group if r.account_id})
+    rows += sum(counts.values())
+
+  return rows
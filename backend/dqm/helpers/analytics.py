@@ -19,29 +19,60 @@ Useful resources:
 - https://ga-dev-tools.appspot.com/query-explorer/
 """
 
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
 from datetime import date
-from typing import Dict, List, Optional
+import json
+from typing import Any, Dict, List, Mapping, Optional
 from urllib.parse import parse_qs
 import urllib.parse as urlparse
 
 from apiclient.discovery import build
-from oauth2client.service_account import ServiceAccountCredentials
 
 from django.conf import settings
+from dqm.helpers.service_accounts import (ServiceAccount, current_account_id,
+  get_pool)
+from dqm.helpers.singleflight import SingleFlight, freeze
 
 
-SCOPES = ['https://www.googleapis.com/auth/analytics.readonly']
+# Reporting API requests in flight, by canonical request body.
+_report_requests = SingleFlight()
 
 
-def get_service(api: str, version: str) -> None:
+def get_service(api: str,
+  version: str,
+  service_account: ServiceAccount = None) -> None:
   """Build a service to access GA API.
 
   Requires a service account credentials files.
   See: https://developers.google.com/analytics/devguides/config/mgmt/v3/quickstart/service-py
+
+  If no service account is given, one is picked from the pool for the GA
+  account being checked (see `service_accounts`).
+  """
+  if not service_account:
+    service_account = get_pool().acquire(account_id=current_account_id.get())
+  return build(api, version, credentials=service_account.credentials)
+
+
+def batch_get(query: Dict[str, Any]) -> Mapping:
+  """Execute a GA Reporting API v4 request (`reports.batchGet`).
+
+  Concurrent identical requests (same canonical body) are coalesced into a
+  single HTTP call, whose decoded response is shared by all callers: it is thus
+  returned frozen (see `singleflight.freeze`). If the call fails, all callers
+  get the error.
+
+  Requests are made with a service account of the pool, which tracks quota
+  errors to route next requests to other service accounts.
   """
-  credentials = ServiceAccountCredentials.from_json_keyfile_name(
-    settings.SERVICE_ACCOUNT_FILE, SCOPES)
-  return build(api, version, credentials=credentials)
+  def execute():
+    with get_pool().use(account_id=current_account_id.get()) as account:
+      service = get_service('analyticsreporting', 'v4', service_account=account)
+      return freeze(service.reports().batchGet(body=query).execute())
+
+  key = json.dumps(query, sort_keys=True, default=str)
+  return _report_requests.do(key, execute)
 
 
 def get_accounts() -> List[Dict]:
@@ -68,9 +99,40 @@ def get_accounts() -> List[Dict]:
                  },
               ]
         #...
+
+  With several service accounts, the accounts granted to any of them are
+  listed, each one with the web properties and views granted to any of them.
   """
-  service = get_service('analytics', 'v3')
+  trees = []
+  for service_account in get_pool().service_accounts:
+    service = get_service('analytics', 'v3', service_account=service_account)
+    trees.append(get_account_tree(service))
+  return merge_account_trees(trees)
 
+
+def merge_account_trees(trees: List[List[Dict]]) -> List[Dict]:
+  """Merge account trees (see `get_account_tree`): accounts, web properties
+  and views are matched by id, and kept in the order they are first listed.
+  """
+  accounts = {}
+  properties = {}
+  for tree in trees:
+    for a in tree:
+      account = accounts.setdefault(a['id'], {**a, 'webProperties': []})
+      for p in a['webProperties']:
+        if p['id'] not in properties:
+          properties[p['id']] = {**p, 'views': []}
+          account['webProperties'].append(properties[p['id']])
+        views = properties[p['id']]['views']
+        view_ids = {v['id'] for v in views}
+        views.extend(v for v in p['views'] if v['id'] not in view_ids)
+  return list(accounts.values())
+
+
+def get_account_tree(service) -> List[Dict]:
+  """Accounts granted to the service account of the given service, with
+  their nested web properties and views (see `get_accounts`).
+  """
   try:
     accounts_data = service.management().accounts().list().execute()
     accounts = accounts_data['items']
@@ -116,7 +178,6 @@ def get_url_parameters(view_id,
   start_date: date,
   end_date: date) -> List[Dict[str, str]]:
 
-  service = get_service('analyticsreporting', 'v4')
   query = {
     'reportRequests': [{
       'viewId': view_id,
@@ -127,7 +188,7 @@ def get_url_parameters(view_id,
       'dimensions': [{'name': 'ga:pagePath'}]
     }]
   }
-  response = service.reports().batchGet(body=query).execute()
+  response = batch_get(query)
   try:
     urls_and_parameters = [{
       'url': url['dimensions'][0],
@@ -141,8 +202,6 @@ def get_url_parameters(view_id,
 
 
 def get_referrers(view_id, start_date: date, end_date: date):
-  service = get_service('analyticsreporting', 'v4')
-
   query = {
     'reportRequests': [{
       'viewId': view_id,
@@ -153,7 +212,7 @@ def get_referrers(view_id, start_date: date, end_date: date):
       'dimensions': [{'name': 'ga:fullReferrer'}]
     }]
   }
-  response = service.reports().batchGet(body=query).execute()
+  response = batch_get(query)
   try:
     data = [(r['dimensions'][0], int(r['metrics'][0]['values'][0]))
             for r in response['reports'][0]['data']['rows']]
@@ -177,8 +236,6 @@ def get_hostnames(view_id,
   start_date: date,
   end_date: date) -> List[Dict[str, str]]:
 
-  service = get_service('analyticsreporting', 'v4')
-
   query = {
     'reportRequests': [{
       'viewId': view_id,
@@ -189,7 +246,7 @@ def get_hostnames(view_id,
       'dimensions': [{'name': 'ga:hostname'}]
     }]
   }
-  response = service.reports().batchGet(body=query).execute()
+  response = batch_get(query)
 
   try:
     hosts = [{'host': r['dimensions'][0], 'hits': r['metrics'][0]['values'][0]}
@@ -200,31 +257,92 @@ def get_hostnames(view_id,
   return hosts
 
 
-def get_event_categories(view_id,
+def get_report_rows(view_id,
   start_date: date,
-  end_date: date) -> List[Dict[str, str]]:
+  end_date: date,
+  dimensions: List[str],
+  metrics: List[str]) -> List[Dict[str, str]]:
+  """Return the rows of a report, as values by dimension and metric name.
+
+  Example:
+  [
+    {'ga:eventCategory': 'video', 'ga:totalEvents': '12'},
+  ]
+  """
+  query = {
+    'reportRequests': [{
+      'viewId': view_id,
+      'dateRanges': [{
+        'startDate': start_date.strftime('%Y-%m-%d'),
+        'endDate': end_date.strftime('%Y-%m-%d')}],
+      'metrics': [{'expression': m} for m in metrics],
+      'dimensions': [{'name': d} for d in dimensions],
+    }]
+  }
+  response = batch_get(query)
 
-  service = get_service('analyticsreporting', 'v4')
+  return [{**dict(zip(dimensions, r['dimensions'])),
+           **dict(zip(metrics, r['metrics'][0]['values']))}
+          for r in response['reports'][0]['data'].get('rows', [])]
 
+
+def get_row_count(view_id,
+  start_date: date,
+  end_date: date,
+  dimensions: List[str],
+  metrics: List[str]) -> int:
+  """Return the number of rows of a report, i.e. the number of distinct values
+  of the given dimensions ("cardinality-only" request).
+
+  Only one row is requested (`pageSize`), the count is read from the report
+  `rowCount`, so that rows themselves are never transferred.
+  """
   query = {
     'reportRequests': [{
       'viewId': view_id,
       'dateRanges': [{
         'startDate': start_date.strftime('%Y-%m-%d'),
         'endDate': end_date.strftime('%Y-%m-%d')}],
-      'metrics': [{'expression': 'ga:totalEvents'}],
-      'dimensions': [{'name': 'ga:eventCategory'}]
+      'metrics': [{'expression': m} for m in metrics],
+      'dimensions': [{'name': d} for d in dimensions],
+      'pageSize': 1,
     }]
   }
-  response = service.reports().batchGet(body=query).execute()
-  items_count = int(response['reports'][0]['data']['totals'][0]['values'][0])
-
-  if items_count:
-    event_categories = [{
-      'host': r['dimensions'][0],
-      'hits': r['metrics'][0]['values'][0]}
-      for r in response['reports'][0]['data']['rows']]
-  else:
-    event_categories = []
+  response = batch_get(query)
+
+  return int(response['reports'][0]['data'].get('rowCount', 0))
+
+
+def get_row_counts(view_ids: List[str],
+  start_date: date,
+  end_date: date,
+  dimensions: List[str],
+  metrics: List[str],
+  account_ids: Mapping[str, str] = None) -> Dict[str, int]:
+  """Same as `get_row_count`, for many views at once.
+
+  Reporting API batches cannot mix views, so views are queried in parallel
+  (see `GA_MAX_PARALLEL_REQUESTS` setting). `account_ids` gives the GA account
+  of views, so that each view is queried with a service account granted it.
+
+  Example:
+  {
+    '123456': 12,
+    '654321': 3,
+  }
+  """
+  view_ids = list(dict.fromkeys(view_ids))
+
+  def count(view_id):
+    if account_ids and view_id in account_ids:
+      current_account_id.set(account_ids[view_id])
+    return get_row_count(view_id=view_id, start_date=start_date,
+      end_date=end_date, dimensions=dimensions, metrics=metrics)
+
+  # Each request runs within its own copy of the current context.
+  with ThreadPoolExecutor(
+      max_workers=settings.GA_MAX_PARALLEL_REQUESTS) as executor:
+    futures = [executor.submit(contextvars.copy_context().run, count, v)
+               for v in view_ids]
 
-  return event_categories
+  return {v: f.result() for v, f in zip(view_ids, futures)}
@@ -0,0 +1,109 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A minimal parser for standard (5 fields) cron expressions.
+
+Supported syntax for each field: `*`, `5`, `1-5`, `*/15`, `1-30/2`, and comma
+separated lists of those. Days of week go from 0 (sunday) to 6 (7 is also
+accepted for sunday).
+
+>>> from datetime import datetime
+>>> CronExpression('*/15 * * * *').next_after(datetime(2020, 1, 1, 10, 7))
+datetime.datetime(2020, 1, 1, 10, 15)
+>>> CronExpression('0 3 * * 1').next_after(datetime(2020, 1, 1, 10, 7))
+datetime.datetime(2020, 1, 6, 3, 0)
+"""
+
+from datetime import datetime, timedelta
+from typing import Set
+
+from dqm.errors import BadCronExpressionError
+
+
+# (min, max) values for each field.
+FIELDS_RANGES = [
+  (0, 59),  # minute
+  (0, 23),  # hour
+  (1, 31),  # day of month
+  (1, 12),  # month
+  (0, 7),  # day of week
+]
+
+
+def _parse_field(field: str, min_value: int, max_value: int) -> Set[int]:
+  values = set()
+  for part in field.split(','):
+    step = 1
+    if '/' in part:
+      part, step = part.split('/')
+      step = int(step)
+    if part == '*':
+      start, end = min_value, max_value
+    elif '-' in part:
+      start, end = [int(v) for v in part.split('-')]
+    else:
+      start = int(part)
+      end = max_value if step > 1 else start
+    if start < min_value or end > max_value or step < 1:
+      raise ValueError(field)
+    values.update(range(start, end + 1, step))
+  return values
+
+
+class CronExpression:
+
+  def __init__(self, expression: str) -> None:
+    self.expression = expression
+    fields = expression.split()
+    if len(fields) != 5:
+      raise BadCronExpressionError(expression)
+    try:
+      (self.minutes, self.hours, self.days, self.months,
+        self.weekdays) = [_parse_field(f, *r) for f, r in zip(fields,
+          FIELDS_RANGES)]
+    except ValueError:
+      raise BadCronExpressionError(expression)
+    if 7 in self.weekdays:
+      self.weekdays.add(0)
+    # As in standard cron, if both day fields are restricted, a day matches if
+    # any of them matches.
+    self.any_day = fields[2] != '*' and fields[4] != '*'
+
+  def _match_day(self, dt: datetime) -> bool:
+    match_day = dt.day in self.days
+    match_weekday = (dt.weekday() + 1) % 7 in self.weekdays
+    if self.any_day:
+      return match_day or match_weekday
+    return match_day and match_weekday
+
+  def next_after(self, dt: datetime) -> datetime:
+    """Return the first datetime matching the expression, strictly after `dt`.
+    """
+    dt = dt.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    limit = dt + timedelta(days=366 * 5)
+
+    while dt < limit:
+      if dt.month not in self.months:
+        dt = (dt.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(
+          day=1)
+      elif not self._match_day(dt):
+        dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+      elif dt.hour not in self.hours:
+        dt = dt.replace(minute=0) + timedelta(hours=1)
+      elif dt.minute not in self.minutes:
+        dt = dt + timedelta(minutes=1)
+      else:
+        return dt
+
+    raise BadCronExpressionError(self.expression)
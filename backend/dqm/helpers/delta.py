@@ -0,0 +1,60 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Differences between result payloads (lists of rows), as the rows added and
+the rows resolved (removed).
+
+Rows are compared by value, as multisets: the order of rows is not kept.
+
+>>> delta = diff([{'a': 1}, {'a': 2}], [{'a': 2}, {'a': 3}])
+>>> delta
+{'added': [{'a': 3}], 'resolved': [{'a': 1}]}
+>>> patch([{'a': 1}, {'a': 2}], delta)
+[{'a': 2}, {'a': 3}]
+"""
+
+from collections import Counter
+import json
+from typing import Dict, List
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+def get_key(row: Dict) -> str:
+  return json.dumps(row, cls=DjangoJSONEncoder, sort_keys=True)
+
+
+def remove(rows: List[Dict], removed: List[Dict]) -> List[Dict]:
+  """Rows, except (one occurrence of) the removed ones."""
+  counts = Counter(get_key(r) for r in removed)
+  kept = []
+  for row in rows:
+    key = get_key(row)
+    if counts[key]:
+      counts[key] -= 1
+    else:
+      kept.append(row)
+  return kept
+
+
+def diff(before: List[Dict], after: List[Dict]) -> Dict[str, List[Dict]]:
+  return {
+    'added': remove(after, before),
+    'resolved': remove(before, after),
+  }
+
+
+def patch(rows: List[Dict], delta: Dict[str, List[Dict]]) -> List[Dict]:
+  """Apply a delta (see `diff`) to rows."""
+  return remove(rows, delta['resolved']) + delta['added']
@@ -0,0 +1,237 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Pool of service accounts used to access GA APIs, so that API quotas (per
+project and service account) are spread across several identities.
+
+Service accounts are configured with the `SERVICE_ACCOUNTS` setting, each one
+optionally restricted to the GA accounts it has been granted access to, e.g.:
+[
+  {"file": "key-1.json", "accounts": ["123456", "234567"]},
+  {"file": "key-2.json"},
+]
+
+Requests are routed to the service accounts granted the GA account of the
+check being executed (see `current_account_id`), and to the unrestricted ones
+otherwise, in round-robin. Service accounts are put aside for a while when
+their quota is exceeded or after repeated errors.
+
+Health and quota usage are tracked per process, whereas access tokens are
+shared by all processes of a node (see `token_cache`) and refreshed in the
+background before they expire.
+"""
+
+from contextlib import contextmanager
+import contextvars
+from datetime import date, datetime, timedelta
+import logging
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from apiclient.errors import HttpError
+from oauth2client import transport
+from oauth2client.service_account import ServiceAccountCredentials
+
+from django.conf import settings
+from dqm.helpers.token_cache import TokenStore
+
+
+SCOPES = ['https://www.googleapis.com/auth/analytics.readonly']
+
+# GA account id of the check being executed, if any (see `models.Check`).
+current_account_id = contextvars.ContextVar('current_account_id',
+  default=None)
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceAccount:
+
+  def __init__(self,
+    key_file: str,
+    account_ids: Iterable[str] = None) -> None:
+    self.key_file = key_file
+    # GA accounts granted to the service account, any if None.
+    self.account_ids = set(account_ids) if account_ids is not None else None
+    self.day = date.today()
+    self.requests = 0
+    self.errors = 0
+    self.consecutive_errors = 0
+    self.unavailable_until = 0.0
+    self._credentials = None
+    self._refreshing = threading.Event()
+
+  def __repr__(self) -> str:
+    return 'ServiceAccount({})'.format(self.key_file)
+
+  @property
+  def credentials(self) -> ServiceAccountCredentials:
+    if not self._credentials:
+      credentials = ServiceAccountCredentials.from_json_keyfile_name(
+        self.key_file, SCOPES)
+      TokenStore(credentials, key=self.key_file)
+      self._credentials = credentials
+    self.refresh_ahead()
+    return self._credentials
+
+  def refresh_ahead(self) -> None:
+    """Refresh the access token in a background thread if it expires soon,
+    so that requests do not wait for the token endpoint.
+    """
+    credentials = self._credentials
+    if not credentials.access_token or not credentials.token_expiry:
+      return
+    margin = timedelta(seconds=settings.TOKEN_REFRESH_MARGIN_SECONDS)
+    if credentials.token_expiry - datetime.utcnow() > margin:
+      return
+    with _refresh_lock:
+      if self._refreshing.is_set():
+        return
+      self._refreshing.set()
+
+    def refresh():
+      try:
+        credentials.refresh(transport.get_http_object())
+      except Exception as e:
+        logger.warning('Access token refresh failed for {}: {}'.format(
+          self.key_file, e))
+      finally:
+        self._refreshing.clear()
+
+    threading.Thread(target=refresh, daemon=True).start()
+
+  @property
+  def quota_exhausted(self) -> bool:
+    if self.day != date.today():
+      self.day = date.today()
+      self.requests = 0
+    return self.requests >= settings.GA_QUOTA_REQUESTS_PER_DAY
+
+  @property
+  def healthy(self) -> bool:
+    return (time.monotonic() >= self.unavailable_until
+            and not self.quota_exhausted)
+
+  def set_unavailable(self, seconds: float) -> None:
+    self.unavailable_until = time.monotonic() + seconds
+    logger.warning('Service account {} unavailable for {}s'.format(
+      self.key_file, seconds))
+
+  def to_dict(self) -> Dict:
+    return {
+      'file': self.key_file,
+      'accounts': sorted(self.account_ids) if self.account_ids is not None
+                  else None,
+      'healthy': self.healthy,
+      'requests': self.requests,
+      'errors': self.errors,
+    }
+
+
+def is_quota_error(error: Exception) -> bool:
+  """Whether the error is a GA API "quota exceeded" or "rate limit" error.
+  """
+  if not isinstance(error, HttpError):
+    return False
+  content = error.content.decode(errors='ignore') if isinstance(
+    error.content, bytes) else str(error.content)
+  return error.resp.status == 429 or (error.resp.status == 403 and any(
+    reason in content for reason in ('rateLimitExceeded',
+      'userRateLimitExceeded', 'quotaExceeded', 'dailyLimitExceeded')))
+
+
+class ServiceAccountPool:
+
+  def __init__(self, service_accounts: List[ServiceAccount]) -> None:
+    self.service_accounts = service_accounts
+    self._lock = threading.Lock()
+    self._next = 0
+
+  @classmethod
+  def from_settings(cls) -> 'ServiceAccountPool':
+    configs = settings.SERVICE_ACCOUNTS or [
+      {'file': settings.SERVICE_ACCOUNT_FILE}]
+    return cls([ServiceAccount(key_file=c['file'],
+                               account_ids=c.get('accounts'))
+                for c in configs])
+
+  def candidates(self, account_id: Optional[str]) -> List[ServiceAccount]:
+    """Service accounts granted the given GA account, unrestricted service
+    accounts otherwise (or if no GA account is given).
+    """
+    granted = [sa for sa in self.service_accounts
+               if account_id and sa.account_ids and account_id in sa.account_ids]
+    return granted or [sa for sa in self.service_accounts
+                       if sa.account_ids is None] or self.service_accounts
+
+  def acquire(self, account_id: str = None) -> ServiceAccount:
+    """Pick a healthy service account for the given GA account, in
+    round-robin. If none is healthy, the one available the soonest is used.
+    """
+    with self._lock:
+      candidates = self.candidates(account_id)
+      healthy = [sa for sa in candidates if sa.healthy] or [
+        min(candidates, key=lambda sa: sa.unavailable_until)]
+      service_account = healthy[self._next % len(healthy)]
+      self._next += 1
+      service_account.requests += 1
+      return service_account
+
+  def report(self,
+    service_account: ServiceAccount,
+    error: Exception = None) -> None:
+    """Track the outcome of a request made with the service account.
+    """
+    with self._lock:
+      if not error:
+        service_account.consecutive_errors = 0
+        return
+
+      service_account.errors += 1
+      service_account.consecutive_errors += 1
+      if is_quota_error(error):
+        service_account.set_unavailable(settings.GA_QUOTA_BACKOFF_SECONDS)
+      elif (service_account.consecutive_errors >=
+            settings.SERVICE_ACCOUNT_MAX_ERRORS):
+        service_account.set_unavailable(settings.GA_QUOTA_BACKOFF_SECONDS)
+
+  @contextmanager
+  def use(self, account_id: str = None) -> ServiceAccount:
+    """Acquire a service account, and track the outcome of the requests made
+    within the block.
+    """
+    service_account = self.acquire(account_id=account_id)
+    try:
+      yield service_account
+    except Exception as e:
+      self.report(service_account, error=e)
+      raise
+    self.report(service_account)
+
+  def status(self) -> List[Dict]:
+    return [sa.to_dict() for sa in self.service_accounts]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+
+
+def get_pool() -> ServiceAccountPool:
+  global _pool
+  with _pool_lock:
+    if _pool is None:
+      _pool = ServiceAccountPool.from_settings()
+    return _pool
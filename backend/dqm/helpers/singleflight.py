@@ -0,0 +1,82 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Coalescing of concurrent identical calls within a process ("singleflight").
+"""
+
+import threading
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Hashable
+
+
+class _Call:
+
+  def __init__(self) -> None:
+    self.done = threading.Event()
+    self.result = None
+    self.error = None
+
+
+class SingleFlight:
+  """While a call for a given key is in flight, concurrent calls for the same
+  key wait for it and get its result (or its exception) instead of making their
+  own call.
+
+  >>> flight = SingleFlight()
+  >>> flight.do('key', lambda: 42)
+  42
+  """
+
+  def __init__(self) -> None:
+    self._lock = threading.Lock()
+    self._calls: Dict[Hashable, _Call] = {}
+
+  def do(self, key: Hashable, func: Callable[[], Any]) -> Any:
+    with self._lock:
+      call = self._calls.get(key)
+      leader = call is None
+      if leader:
+        call = self._calls[key] = _Call()
+
+    if not leader:
+      call.done.wait()
+      if call.error:
+        raise call.error
+      return call.result
+
+    try:
+      call.result = func()
+    except Exception as e:
+      call.error = e
+      raise
+    finally:
+      with self._lock:
+        del self._calls[key]
+      call.done.set()
+
+    return call.result
+
+
+def freeze(value: Any) -> Any:
+  """Return a read-only copy of a decoded JSON value (dictionaries become
+  read-only mappings, lists become tuples), safe to share between callers.
+
+  >>> freeze({'rows': [1, 2]})['rows']
+  (1, 2)
+  """
+  if isinstance(value, dict):
+    return MappingProxyType({k: freeze(v) for k, v in value.items()})
+  if isinstance(value, list):
+    return tuple(freeze(v) for v in value)
+  return value
@@ -0,0 +1,142 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Time-bounded and cancellable execution of check code.
+
+Python threads cannot be killed: the code is executed in a background (daemon)
+thread, and the caller stops waiting for it once the deadline passed or the
+execution was cancelled. The abandoned thread then runs to completion on its
+own, its result being discarded. It must thus not access the database.
+
+Background threads run in a copy of the caller's context, so that context
+variables (e.g. `service_accounts.current_account_id`) are preserved.
+"""
+
+import contextvars
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterator, Optional
+
+from dqm.errors import CheckCancelledError, CheckTimeoutError
+
+
+# How often cancellation is checked while waiting, in seconds.
+POLL_SECONDS = 1
+
+_END = object()
+
+
+def start_thread(target: Callable[[], None]) -> None:
+  """Run `target` in a daemon thread, within a copy of the current context.
+  """
+  context = contextvars.copy_context()
+  threading.Thread(target=context.run, args=(target,), daemon=True).start()
+
+
+class Deadline:
+  """A point in time (`timeout` seconds from now, or never if None), and an
+  optional event signaling a cancellation.
+  """
+
+  def __init__(self,
+    timeout: Optional[float] = None,
+    cancelled: threading.Event = None) -> None:
+    self.timeout = timeout
+    self.expires = time.monotonic() + timeout if timeout is not None else None
+    self.cancelled = cancelled or threading.Event()
+
+  def remaining(self) -> Optional[float]:
+    return (max(self.expires - time.monotonic(), 0)
+            if self.expires is not None else None)
+
+  def check(self) -> None:
+    """Raise `CheckCancelledError` or `CheckTimeoutError` if it is too late.
+    """
+    if self.cancelled.is_set():
+      raise CheckCancelledError()
+    if self.remaining() == 0:
+      raise CheckTimeoutError(timeout=self.timeout)
+
+  def wait(self, q: queue.Queue) -> Any:
+    """Wait for the next item of `q`, unless it is too late (see `check`).
+    """
+    while True:
+      self.check()
+      remaining = self.remaining()
+      try:
+        return q.get(timeout=min(remaining, POLL_SECONDS)
+                     if remaining is not None else POLL_SECONDS)
+      except queue.Empty:
+        pass
+
+  def call(self, func: Callable[[], Any]) -> Any:
+    """Return the result of `func()`, unless the deadline passes before.
+    """
+    self.check()
+    results = queue.Queue()
+
+    def target():
+      try:
+        results.put((func(), None))
+      except Exception as e:
+        results.put((None, e))
+
+    start_thread(target)
+    result, error = self.wait(results)
+    if error:
+      raise error
+    return result
+
+  def iterate(self, iterator: Iterator, buffer_size: int = 1000) -> Iterator:
+    """Yield the items of `iterator`, unless the deadline passes before the
+    end. At most `buffer_size` items are produced in advance, from the time
+    of the call.
+    """
+    self.check()
+    items = queue.Queue(maxsize=buffer_size)
+    abandoned = threading.Event()
+
+    def put(item):
+      while not abandoned.is_set():
+        try:
+          items.put(item, timeout=POLL_SECONDS)
+          return
+        except queue.Full:
+          pass
+
+    def target():
+      try:
+        for item in iterator:
+          put((item, None))
+          if abandoned.is_set():
+            return
+        put((_END, None))
+      except Exception as e:
+        put((None, e))
+
+    start_thread(target)
+    return self._consume(items, abandoned)
+
+  def _consume(self, items: queue.Queue, abandoned: threading.Event) -> Iterator:
+    try:
+      while True:
+        item, error = self.wait(items)
+        if error:
+          raise error
+        if item is _END:
+          return
+        yield item
+    finally:
+      abandoned.set()
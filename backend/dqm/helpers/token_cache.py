@@ -0,0 +1,112 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Cache of OAuth access tokens shared by all processes of a node.
+
+Access tokens of service accounts are stored in files (one per service
+account, in `TOKEN_CACHE_DIR`), locked while a token is read or refreshed: a
+process needing a token first adopts the one refreshed by another process, if
+still valid, and only requests a new one otherwise.
+
+See: oauth2client.client.Storage
+"""
+
+import copy
+from datetime import datetime
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Optional
+
+from oauth2client import client
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class TokenStore(client.Storage):
+  """Storage of the access token of the given credentials, which are then
+  refreshed through the store.
+
+  Only the access token and its expiry are stored, never the private key.
+  """
+
+  def __init__(self,
+    credentials: client.OAuth2Credentials,
+    key: str,
+    directory: str = None) -> None:
+    # The file lock is not reentrant within a process.
+    super().__init__(lock=threading.Lock())
+    directory = directory or settings.TOKEN_CACHE_DIR
+    os.makedirs(directory, exist_ok=True)
+    name = hashlib.sha256(key.encode()).hexdigest()
+    self.path = os.path.join(directory, '{}.json'.format(name))
+    self._lock_file = None
+    self.credentials = credentials
+    credentials.set_store(self)
+
+  def acquire_lock(self) -> None:
+    super().acquire_lock()
+    try:
+      self._lock_file = open(self.path + '.lock', 'a')
+      fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+    except:
+      super().release_lock()
+      raise
+
+  def release_lock(self) -> None:
+    try:
+      fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+      self._lock_file.close()
+    finally:
+      self._lock_file = None
+      super().release_lock()
+
+  def locked_get(self) -> Optional[client.OAuth2Credentials]:
+    try:
+      with open(self.path) as f:
+        data = json.load(f)
+      token_expiry = datetime.strptime(data['token_expiry'],
+        client.EXPIRY_FORMAT)
+    except (OSError, ValueError, KeyError, TypeError):
+      return None
+
+    credentials = copy.copy(self.credentials)
+    credentials.access_token = data['access_token']
+    credentials.token_expiry = token_expiry
+    credentials.invalid = False
+    return credentials
+
+  def locked_put(self, credentials: client.OAuth2Credentials) -> None:
+    if credentials.invalid or not credentials.token_expiry:
+      return
+    data = {
+      'access_token': credentials.access_token,
+      'token_expiry': credentials.token_expiry.strftime(client.EXPIRY_FORMAT),
+    }
+    tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+    with open(tmp_path, 'w') as f:
+      json.dump(data, f)
+    os.replace(tmp_path, self.path)
+
+  def locked_delete(self) -> None:
+    try:
+      os.remove(self.path)
+    except FileNotFoundError:
+      pass
@@ -0,0 +1,122 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Janitor taking care of orphaned suite executions, i.e. executions left in
+`Running` status because the process executing them died (e.g. App Engine
+instance recycled), and of deleted suites.
+
+Orphaned executions are queued again (status `Created`), so that the scheduler
+resumes them: only their missing or failed work items are executed. Executions
+which have not been split into work items cannot be resumed, they are marked as
+failed.
+
+Deleted suites (see `Suite.soft_delete`) are purged with deletes of at most
+`PURGE_BATCH_SIZE` rows, dependent rows first, without locking tables for
+long.
+"""
+
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import models
+from dqm.models import (
+  Check,
+  CheckExecution,
+  GaParams,
+  ResultChunk,
+  Schedule,
+  ScopeItem,
+  Status,
+  Suite,
+  SuiteExecution,
+  WorkItem,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+def requeue_orphaned_executions() -> List[SuiteExecution]:
+  requeued = []
+
+  for se in SuiteExecution.get_orphaned():
+    if se.work_items.exists():
+      se.reset_work_items()
+      se.status = Status.Created
+      requeued.append(se)
+    else:
+      se.status = Status.Failed
+      se.success = False
+    se.save()
+    logger.warning('Orphaned suite execution {} ({})'.format(se.id,
+      se.get_status_display()))
+
+  return requeued
+
+
+def get_purge_steps(
+  suite_id: int) -> List[Tuple[models.QuerySet, Optional[Dict[str, Any]]]]:
+  """Rows of a suite, in deletion order (rows referencing others first), each
+  with the values to update them with beforehand, if they are only updated.
+  """
+  return [
+    (WorkItem.depends_on.through.objects.filter(
+      from_workitem__suite_execution__suite_id=suite_id), None),
+    (WorkItem.objects.filter(suite_execution__suite_id=suite_id), None),
+    (ResultChunk.objects.filter(
+      check_execution__check_ref__suite_id=suite_id), None),
+    # Executions reference previous ones, which some databases (e.g. MySQL)
+    # would refuse to delete in a same batch.
+    (CheckExecution.objects.filter(check_ref__suite_id=suite_id,
+      previous__isnull=False), {'previous': None}),
+    (CheckExecution.objects.filter(check_ref__suite_id=suite_id), None),
+    (SuiteExecution.objects.filter(suite_id=suite_id), None),
+    (Schedule.objects.filter(suite_id=suite_id), None),
+    (Check.objects.filter(suite_id=suite_id), None),
+    (ScopeItem.objects.filter(ga_params__suite_id=suite_id), None),
+    (GaParams.objects.filter(suite_id=suite_id), None),
+    (Suite.all_objects.filter(pk=suite_id), None),
+  ]
+
+
+def purge_deleted_suites(max_batches: int = None) -> int:
+  """Delete the rows of deleted suites, in at most `max_batches` batches if
+  given (the purge then goes on at the next call). Returns the number of
+  deleted rows.
+  """
+  deleted = 0
+  batches = 0
+  for suite_id in Suite.all_objects.filter(
+      deleted__isnull=False).values_list('id', flat=True):
+    deleted_rows = 0
+    for queryset, values in get_purge_steps(suite_id):
+      while max_batches is None or batches < max_batches:
+        ids = list(queryset.values_list('pk', flat=True)[
+          :settings.PURGE_BATCH_SIZE])
+        if not ids:
+          break
+        # Dependent rows are deleted beforehand, so that batches do not
+        # cascade to many rows.
+        batch = queryset.model._base_manager.filter(pk__in=ids)
+        if values:
+          batch.update(**values)
+        else:
+          deleted_rows += batch.delete()[0]
+        batches += 1
+    if deleted_rows:
+      logger.info('Purged {} rows of deleted suite {}'.format(deleted_rows,
+        suite_id))
+    deleted += deleted_rows
+  return deleted
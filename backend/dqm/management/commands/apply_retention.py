@@ -0,0 +1,33 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compact and archive old executions (see `dqm.retention`).
+
+Usage:
+  python manage.py apply_retention
+"""
+
+from django.core.management.base import BaseCommand
+from dqm.retention import apply_retention
+
+
+class Command(BaseCommand):
+  help = 'Compact and archive old executions.'
+
+  def handle(self, *args, **options):
+    for suite_id, counts in apply_retention().items():
+      if any(counts.values()):
+        self.stdout.write(
+          'Suite {}: {} check executions compacted, {} executions archived'
+          .format(suite_id, counts['compacted'], counts['archived']))
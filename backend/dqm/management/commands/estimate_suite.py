@@ -0,0 +1,44 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Estimate the cost of an execution of a suite, without executing it (see
+`dqm.estimator`).
+
+Usage:
+  python manage.py estimate_suite SUITE_ID [--rows]
+"""
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from dqm.estimator import estimate
+from dqm.models import Suite
+
+
+class Command(BaseCommand):
+  help = 'Estimate the cost of an execution of a suite, without executing it.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('suite_id', type=int)
+    parser.add_argument('--rows', action='store_true',
+      help='Also count rows (one GA API call per report request).')
+
+  def handle(self, *args, **options):
+    try:
+      suite = Suite.objects.get(pk=options['suite_id'])
+    except Suite.DoesNotExist:
+      raise CommandError('Suite {} does not exist'.format(options['suite_id']))
+
+    self.stdout.write(json.dumps(estimate(suite, count_rows=options['rows']),
+      indent=2))
@@ -0,0 +1,39 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Queue orphaned suite executions again, to be resumed by the scheduler, and
+purge deleted suites.
+
+Note that the scheduler already does it at each tick, this command is meant
+for setups where it does not run.
+
+Usage:
+  python manage.py run_janitor
+"""
+
+from django.core.management.base import BaseCommand
+from dqm.janitor import purge_deleted_suites, requeue_orphaned_executions
+
+
+class Command(BaseCommand):
+  help = ('Queue orphaned suite executions again, to be resumed, and purge '
+          'deleted suites.')
+
+  def handle(self, *args, **options):
+    for se in requeue_orphaned_executions():
+      self.stdout.write('Queued suite "{}" (execution {})'.format(
+        se.suite, se.id))
+    deleted = purge_deleted_suites()
+    if deleted:
+      self.stdout.write('Purged {} rows of deleted suites'.format(deleted))
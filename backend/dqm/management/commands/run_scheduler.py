@@ -0,0 +1,45 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Start the scheduler, executing suites according to their schedules.
+
+Usage:
+  python manage.py run_scheduler [--once]
+"""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from dqm.scheduler import Scheduler
+
+
+class Command(BaseCommand):
+  help = 'Start the scheduler, executing suites according to their schedules.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--once', action='store_true',
+      help='Start due schedules, wait for them to finish, and exit.')
+
+  def handle(self, *args, **options):
+    scheduler = Scheduler()
+
+    while True:
+      for se in scheduler.tick():
+        self.stdout.write('Started suite "{}" (execution {})'.format(
+          se.suite, se.id))
+      if options['once']:
+        scheduler.shutdown(wait=True)
+        break
+      time.sleep(settings.SCHEDULER_TICK)
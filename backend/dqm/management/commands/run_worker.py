@@ -0,0 +1,37 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Start a worker, executing work items of suite executions.
+
+Usage:
+  python manage.py run_worker [--name NAME] [--burst]
+"""
+
+from django.core.management.base import BaseCommand
+from dqm.worker import Worker
+
+
+class Command(BaseCommand):
+  help = 'Start a worker, executing work items of suite executions.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--name',
+      help='Worker name, defaults to "<hostname>-<pid>".')
+    parser.add_argument('--burst', action='store_true',
+      help='Exit as soon as there is no work item left.')
+
+  def handle(self, *args, **options):
+    worker = Worker(name=options['name'])
+    self.stdout.write('Worker "{}" started'.format(worker.name))
+    worker.run(burst=options['burst'])
@@ -13,21 +13,47 @@
 # limitations under the License.
 
 from __future__ import annotations
-from dataclasses import asdict
-from datetime import date, timedelta
+from collections import defaultdict
+from collections.abc import Iterator
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import date, datetime, timedelta
+import hashlib
 import json
 import logging
+import random
+import threading
+import time
 import traceback
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from django.conf import settings
 
 from django.apps import apps
+from django.core.exceptions import ValidationError
 from django.core.serializers.json import DjangoJSONEncoder
-from django.db import models
+from django.core.validators import MinValueValidator
+from django.db import IntegrityError, connection, models, transaction
 from django.db.models.functions import Trunc
 from django.utils import timezone
 from dqm.apps import DqmConfig
-from dqm.check_bricks import Check as BaseCheck, GaLevel, Platform, Result
-from dqm.errors import CheckClassNotFoundError
+from dqm.check_bricks import (
+  AggregatedResult,
+  Check as BaseCheck,
+  GaLevel,
+  Platform,
+  Result,
+)
+from dqm.errors import (
+  BadCronExpressionError,
+  CheckCancelledError,
+  CheckClassNotFoundError,
+  CheckTimeoutError,
+  DependencyCycleError,
+)
+from dqm.helpers import delta
+from dqm.helpers.cron import CronExpression
+from dqm.helpers.service_accounts import current_account_id
+from dqm.helpers.timeout import Deadline
 
 
 logger = logging.getLogger(__name__)
@@ -38,6 +64,19 @@ class Status(models.IntegerChoices):
   Running = 1
   Done = 2
   Failed = 3
+  TimedOut = 4, 'TimedOut'
+  Cancelled = 5
+  Skipped = 6
+
+
+# Statuses of executions which are over.
+FINISHED_STATUSES = [Status.Done, Status.Failed, Status.TimedOut,
+  Status.Cancelled, Status.Skipped]
+
+
+class Priority(models.IntegerChoices):
+  Batch = 0
+  Interactive = 1
 
 
 class SingletonModel(models.Model):
@@ -65,66 +104,599 @@ class AppSettings(SingletonModel):
 
 
 class ApiCache(SingletonModel):
-  ga_accounts_json = models.TextField(null=True, blank=True)
+  """State of the cache of GA accounts, themselves stored as `GaAccount`,
+  `GaProperty` and `GaView` objects.
+  """
+  ga_accounts_updated = models.DateTimeField(null=True, blank=True)
+  # When the running refresh of GA accounts started, if any.
+  ga_accounts_refreshing = models.DateTimeField(null=True, blank=True)
+
+  @property
+  def ga_accounts(self) -> List[Dict]:
+    return GaAccount.get_tree()
 
   @property
-  def ga_accounts(self) -> List[Any]:
-    return json.loads(
-      self.ga_accounts_json) if self.ga_accounts_json else []
+  def ga_accounts_age(self) -> Optional[float]:
+    """Age of GA accounts data in seconds, None if never fetched."""
+    if not self.ga_accounts_updated:
+      return None
+    return (timezone.now() - self.ga_accounts_updated).total_seconds()
+
+  @property
+  def ga_accounts_stale(self) -> bool:
+    age = self.ga_accounts_age
+    return age is None or age > settings.API_CACHE_TTL_SECONDS
+
+  @classmethod
+  def start_ga_accounts_refresh(cls) -> Optional[datetime]:
+    """Mark a refresh of GA accounts as started, unless one is already
+    running (in any process). Refreshes running for longer than the cache TTL
+    are considered abandoned.
+
+    Returns the start of the refresh if the caller should refresh GA accounts
+    (to be given to `update_ga_accounts`), None otherwise.
+    """
+    cls.load()
+    now = timezone.now()
+    abandoned = now - timedelta(seconds=settings.API_CACHE_TTL_SECONDS)
+    started = cls.objects.filter(pk=1).filter(
+      models.Q(ga_accounts_refreshing__isnull=True)
+      | models.Q(ga_accounts_refreshing__lt=abandoned)).update(
+        ga_accounts_refreshing=now)
+    return now if started else None
+
+  @classmethod
+  def update_ga_accounts(cls,
+    accounts: Optional[List[Dict]],
+    started: datetime = None) -> None:
+    """Store the given GA accounts (as returned by `analytics.get_accounts`).
+    If `accounts` is None (failed refresh), the data is left as is.
+
+    The refresh which `started` at the given time is marked as over, unless
+    it was considered abandoned and another one started meanwhile.
+    """
+    if accounts is not None:
+      GaAccount.sync(accounts)
+      cls.update(ga_accounts_updated=timezone.now())
+    if started:
+      cls.objects.filter(pk=1, ga_accounts_refreshing=started).update(
+        ga_accounts_refreshing=None)
+
+
+def upsert_objects(model: models.Model, objs: List[models.Model]) -> int:
+  """Create or update the given (unsaved) objects of `model`, writing only
+  the rows that changed. Returns the number of rows written.
+  """
+  fields = [f.attname for f in model._meta.concrete_fields
+            if not f.primary_key]
+  existing = model.objects.in_bulk([o.pk for o in objs])
+  created = [o for o in objs if o.pk not in existing]
+  updated = [o for o in objs if o.pk in existing and any(
+    getattr(o, f) != getattr(existing[o.pk], f) for f in fields)]
+  model.objects.bulk_create(created, batch_size=500)
+  model.objects.bulk_update(updated, fields, batch_size=500)
+  return len(created) + len(updated)
+
+
+def delete_other_objects(model: models.Model, objs: List[models.Model]) -> int:
+  """Delete the objects of `model` other than the given ones. Returns the
+  number of rows deleted.
+  """
+  kept = {o.pk for o in objs}
+  deleted = [pk for pk in model.objects.values_list('pk', flat=True)
+             if pk not in kept]
+  for i in range(0, len(deleted), 500):
+    model.objects.filter(pk__in=deleted[i:i + 500]).delete()
+  return len(deleted)
+
+
+class GaAccount(models.Model):
+  id = models.CharField(max_length=32, primary_key=True)
+  name = models.CharField(max_length=255)
+
+  class Meta:
+    indexes = [models.Index(fields=['name'])]
+
+  def __str__(self) -> str:
+    return self.name
+
+  def to_dict(self) -> Dict:
+    return {'id': self.id, 'name': self.name}
+
+  @classmethod
+  def sync(cls, accounts: List[Dict]) -> int:
+    """Update stored accounts, properties and views from the given accounts
+    tree (see `analytics.get_accounts`). Returns the number of rows written.
+    """
+    properties = [p for a in accounts for p in a['webProperties']]
+    objs = [
+      (cls, [cls(id=a['id'], name=a['name']) for a in accounts]),
+      (GaProperty, [GaProperty.from_api(p) for p in properties]),
+      (GaView, [GaView.from_api(v) for p in properties for v in p['views']]),
+    ]
+    with transaction.atomic():
+      # Parents are created before their children, and deleted after them.
+      return (sum(upsert_objects(model, o) for model, o in objs)
+        + sum(delete_other_objects(model, o) for model, o in reversed(objs)))
+
+  @classmethod
+  def get_tree(cls) -> List[Dict]:
+    """Accounts, with their nested web properties and views, in API format.
+    """
+    views = defaultdict(list)
+    for v in GaView.objects.order_by('name'):
+      views[v.property_id].append(v.to_dict())
+    properties = defaultdict(list)
+    for p in GaProperty.objects.order_by('name'):
+      properties[p.account_id].append({**p.to_dict(), 'views': views[p.id]})
+    return [{**a.to_dict(), 'webProperties': properties[a.id]}
+            for a in cls.objects.order_by('name')]
+
+
+class GaProperty(models.Model):
+  id = models.CharField(max_length=32, primary_key=True)
+  account = models.ForeignKey(GaAccount, on_delete=models.CASCADE,
+    related_name='properties')
+  name = models.CharField(max_length=255)
+  website_url = models.CharField(max_length=2048, blank=True)
+
+  class Meta:
+    indexes = [models.Index(fields=['account', 'name'])]
+
+  def __str__(self) -> str:
+    return self.name
+
+  @classmethod
+  def from_api(cls, data: Dict) -> GaProperty:
+    return cls(id=data['id'], account_id=data['accountId'], name=data['name'],
+      website_url=data.get('websiteUrl') or '')
+
+  def to_dict(self) -> Dict:
+    return {
+      'id': self.id,
+      'name': self.name,
+      'accountId': self.account_id,
+      'websiteUrl': self.website_url,
+    }
+
+
+class GaView(models.Model):
+  id = models.CharField(max_length=32, primary_key=True)
+  account = models.ForeignKey(GaAccount, on_delete=models.CASCADE,
+    related_name='views')
+  property = models.ForeignKey(GaProperty, on_delete=models.CASCADE,
+    related_name='views')
+  name = models.CharField(max_length=255)
+  website_url = models.CharField(max_length=2048, blank=True)
+  type = models.CharField(max_length=32, blank=True)
+  e_commerce_tracking = models.BooleanField(default=False)
+  enhanced_e_commerce_tracking = models.BooleanField(default=False)
+  bot_filtering_enabled = models.BooleanField(default=False)
+  exclude_query_parameters = models.TextField(null=True, blank=True)
+  site_search_query_parameters = models.TextField(null=True, blank=True)
+  strip_site_search_query_parameters = models.BooleanField(default=False)
+
+  class Meta:
+    indexes = [models.Index(fields=['property', 'name'])]
+
+  def __str__(self) -> str:
+    return self.name
+
+  @classmethod
+  def from_api(cls, data: Dict) -> GaView:
+    return cls(id=data['id'], account_id=data['accountId'],
+      property_id=data['webPropertyId'], name=data['name'],
+      website_url=data.get('websiteUrl') or '',
+      type=data.get('type') or '',
+      e_commerce_tracking=data.get('eCommerceTracking', False),
+      enhanced_e_commerce_tracking=data.get('enhancedECommerceTracking', False),
+      bot_filtering_enabled=data.get('botFilteringEnabled', False),
+      exclude_query_parameters=data.get('excludeQueryParameters'),
+      site_search_query_parameters=data.get('siteSearchQueryParameters'),
+      strip_site_search_query_parameters=data.get(
+        'stripSiteSearchQueryParameters', False))
+
+  def to_dict(self) -> Dict:
+    return {
+      'id': self.id,
+      'name': self.name,
+      'accountId': self.account_id,
+      'webPropertyId': self.property_id,
+      'websiteUrl': self.website_url,
+      'type': self.type,
+      'eCommerceTracking': self.e_commerce_tracking,
+      'enhancedECommerceTracking': self.enhanced_e_commerce_tracking,
+      'botFilteringEnabled': self.bot_filtering_enabled,
+      'excludeQueryParameters': self.exclude_query_parameters or False,
+      'siteSearchQueryParameters': self.site_search_query_parameters or False,
+      'stripSiteSearchQueryParameters': self.strip_site_search_query_parameters,
+    }
+
+
+class SuiteManager(models.Manager):
+  """Suites which are not deleted (see `Suite.soft_delete`).
+  """
+
+  def get_queryset(self) -> models.QuerySet:
+    return super().get_queryset().filter(deleted__isnull=True)
 
 
 class Suite(models.Model):
   name = models.CharField(max_length=100)
+  # Maximum execution time in seconds: checks not finished by then are
+  # timed out.
+  timeout = models.PositiveIntegerField(null=True, blank=True,
+    validators=[MinValueValidator(1)])
+  # Whether executions stop at the first failed check (see `Suite.execute`).
+  fail_fast = models.BooleanField(default=False)
+  # Whether run requests made while the suite is running return the running
+  # execution instead of starting a new one.
+  coalesce_runs = models.BooleanField(default=True)
+  # Days during which results are kept in full, and executions are kept at
+  # all (see `dqm.retention`). Defaults to `RETENTION_DETAIL_DAYS` and
+  # `RETENTION_SUMMARY_DAYS`, 0 meaning forever.
+  detail_retention_days = models.PositiveIntegerField(null=True, blank=True,
+    validators=[MinValueValidator(0)])
+  summary_retention_days = models.PositiveIntegerField(null=True, blank=True,
+    validators=[MinValueValidator(0)])
+  # Deleted suites are purged in the background (see `dqm.janitor`).
+  deleted = models.DateTimeField(null=True, blank=True)
 
   created = models.DateTimeField(auto_now_add=True)
   updated = models.DateTimeField(auto_now=True)
 
+  objects = SuiteManager()
+  all_objects = models.Manager()
+
   def __str__(self) -> str:
     return self.name
 
-  def execute(self) -> SuiteExecution:
-    se = SuiteExecution.objects.create(suite=self, executed=timezone.now())
+  def clean(self) -> None:
+    # Executions cannot be deleted before their results are compacted (0
+    # meaning forever). Values which are not even integers are reported by
+    # `clean_fields`.
+    detail, summary = self.get_retention_days()
+    if not all(isinstance(days, int) for days in (detail, summary)):
+      return
+    if summary and (not detail or summary < detail):
+      raise ValidationError({'summary_retention_days': 'Executions should be '
+        'kept at least as long as their full results.'})
+
+  def soft_delete(self) -> None:
+    """Mark the suite as deleted, so that it is hidden and not executed
+    anymore. Its rows are actually deleted later on (see
+    `janitor.purge_deleted_suites`), as it can take long for suites with a
+    large history.
+    """
+    self.deleted = timezone.now()
+    self.save()
+    self.schedules.update(active=False)
+    for se in self.executions.exclude(status__in=FINISHED_STATUSES):
+      se.cancel()
+
+  def get_retention_days(self) -> Tuple[int, int]:
+    """Detail and summary retentions of executions, in days (0 if forever).
+    """
+    detail = (self.detail_retention_days
+              if self.detail_retention_days is not None
+              else settings.RETENTION_DETAIL_DAYS)
+    summary = (self.summary_retention_days
+               if self.summary_retention_days is not None
+               else settings.RETENTION_SUMMARY_DAYS)
+    return detail, summary
+
+  @property
+  def account_ids(self) -> Set[str]:
+    """GA accounts in the scope of the suite.
+    """
+    try:
+      return set(self.ga_params.get_scope_items().values_list('account_id',
+        flat=True))
+    except GaParams.DoesNotExist:
+      return set()
+
+  @classmethod
+  def covering(cls,
+    view_id: str = None,
+    property_id: str = None,
+    account_id: str = None) -> models.QuerySet:
+    """Suites whose scope includes the given GA view, property or account.
+    """
+    GaParams.backfill_scope_items()
+    lookups = {'view_id': view_id, 'property_id': property_id,
+               'account_id': account_id}
+    return cls.objects.filter(pk__in=ScopeItem.objects.filter(**{
+      k: v for k, v in lookups.items() if v is not None}).values(
+        'ga_params__suite'))
+
+  @staticmethod
+  def check_dependency_cycles(checks: List[Check]) -> None:
+    """Raise `DependencyCycleError` if checks depend on each other (see
+    `check_bricks.Dependency`).
+    """
+    names = {c.name for c in checks}
+    dependencies = {c.name: {d.check for d in c.check_class.depends_on} & names
+                    for c in checks}
+    while dependencies:
+      ready = {name for name, deps in dependencies.items() if not deps}
+      if not ready:
+        raise DependencyCycleError(check_names=sorted(dependencies))
+      dependencies = {name: deps - ready
+                      for name, deps in dependencies.items()
+                      if name not in ready}
+
+  def get_work_items(self, suite_execution: SuiteExecution) -> List[WorkItem]:
+    """Resolve the scope of every active check and return the (unsaved) work
+    items of the execution: one per active check and scope item (e.g. GA view),
+    or one per active check for checks supporting "estate mode" (executed once
+    for the whole scope).
+
+    Work items of fail-fast executions are ranked cheapest first, based on the
+    durations of previous executions of their checks.
+    """
+    work_items = []
+    checks = list(self.checks.filter(active=True))
+    self.check_dependency_cycles(checks)
+    # Scopes by GA level, resolved once for all checks.
+    ga_scopes = {}
 
-    for c in self.checks.filter(active=True):
+    for c in checks:
       check_class = c.check_class()
       check_metadata = check_class.get_metadata()
-      specific_params = {}
 
       # If Google Analytics related, we attach GA params
       if check_metadata['platform'] == Platform.Ga.value:
-        ga_scope = self.ga_params.scope
+        # Scope items are views, or their properties or accounts if the check
+        # is at 'property' or 'account' level.
+        ga_level = check_metadata['ga_level']
+        if ga_level not in ga_scopes:
+          ga_scopes[ga_level] = self.ga_params.get_scope(ga_level=ga_level)
+        ga_scope = ga_scopes[ga_level]
+
+        # Params are serialized in work items, so are dates.
+        params_list = [dict(scope_dict, **{
+          'startDate': self.ga_params.start_date.strftime('%Y-%m-%d'),
+          'endDate': self.ga_params.end_date.strftime('%Y-%m-%d')})
+          for scope_dict in ga_scope]
+
+        if check_class.estate_mode:
+          work_items.append(WorkItem(suite_execution=suite_execution,
+            check_ref=c, priority=suite_execution.priority, estate=True,
+            params_json=json.dumps(params_list, cls=DjangoJSONEncoder)))
+        else:
+          work_items += [WorkItem(suite_execution=suite_execution, check_ref=c,
+            priority=suite_execution.priority,
+            params_json=json.dumps(params, cls=DjangoJSONEncoder))
+            for params in params_list]
+      else:
+        work_items.append(WorkItem(suite_execution=suite_execution, check_ref=c,
+          priority=suite_execution.priority))
+
+    if suite_execution.fail_fast:
+      durations = CheckExecution.get_expected_durations(
+        check_names={c.name for c in checks})
+      ranked = sorted(work_items, key=lambda i: durations.get(
+        i.check_ref.name, float('inf')))
+      for rank, item in enumerate(ranked):
+        item.rank = rank
+
+    return work_items
+
+  def plan(self, suite_execution: SuiteExecution) -> List[WorkItem]:
+    """Split the execution into work items (see `get_work_items`).
+
+    Work items of checks declaring dependencies depend on the work items of
+    their prerequisite checks with an overlapping scope (e.g. a view and its
+    property), so that the execution forms a DAG.
+    """
+    work_items = self.get_work_items(suite_execution=suite_execution)
+    if not work_items:
+      return []
+
+    # Primary keys are not set by `bulk_create` on every database backend.
+    WorkItem.objects.bulk_create(work_items)
+    work_items = list(suite_execution.work_items.select_related(
+      'check_ref').order_by('id'))
+
+    items_by_check = {}
+    for item in work_items:
+      items_by_check.setdefault(item.check_ref.name, []).append(item)
+    links = [WorkItem.depends_on.through(from_workitem_id=item.id,
+                                         to_workitem_id=prerequisite.id)
+             for item in work_items
+             for dependency in item.check_ref.check_class.depends_on
+             for prerequisite in items_by_check.get(dependency.check, [])
+             if item.overlaps(prerequisite)]
+    WorkItem.depends_on.through.objects.bulk_create(links)
+
+    return work_items
+
+  def execute(self,
+    suite_execution: SuiteExecution = None,
+    preempt: Callable[[], bool] = None,
+    distributed: bool = False,
+    force: bool = False,
+    fail_fast: bool = None) -> SuiteExecution:
+    """Execute all active checks of the suite.
+
+    A `SuiteExecution` is created, unless an existing one (e.g. created by the
+    scheduler beforehand) is given. In the latter case, work items which have
+    already been executed are skipped, so that a preempted execution can be
+    resumed.
+
+    Independent work items are executed in parallel (except on SQLite), up to
+    `SUITE_MAX_PARALLEL_CHECKS` at a time, and work items are only started
+    once the ones they depend on are finished. Outputs of checks are passed to
+    dependent checks in memory.
+
+    If given, `preempt` is called before each work item: if it returns True,
+    the execution is put back in the queue (status `Created`) and this method
+    returns once running work items are finished.
+
+    If `distributed` is set, work items are only created, to be executed by
+    workers (see `dqm.worker`).
+
+    If the suite has a `timeout`, the execution deadline is set when it starts.
+
+    If the suite `coalesce_runs`, no execution is started while another one
+    is running: the running execution is returned instead, and the given one,
+    if any, is cancelled (see `SuiteExecution.save_or_coalesce`).
+
+    Unless `force` is set, results of previous check executions are reused when
+    their inputs did not change (see `CheckExecution.get_reusable`).
+
+    In fail-fast mode (`fail_fast`, defaults to the suite setting), cheapest
+    checks are executed first, and the execution stops as soon as a check
+    fails: remaining checks are cancelled, and this method returns without
+    waiting for running ones.
+    """
+    now = timezone.now()
+    if suite_execution:
+      se = suite_execution
+      se.executed = se.executed or now
+      se.status = Status.Running
+    else:
+      se = SuiteExecution(suite=self, executed=now, status=Status.Running,
+        force=force,
+        fail_fast=self.fail_fast if fail_fast is None else fail_fast)
+    if self.timeout and not se.deadline:
+      se.deadline = now + timedelta(seconds=self.timeout)
+
+    if self.coalesce_runs:
+      running = se.save_or_coalesce()
+      if running != se:
+        if suite_execution:
+          logger.info('Suite execution {} coalesced into {}'.format(se.id,
+            running.id))
+          se.cancel()
+        return running
+    else:
+      se.save()
+
+    if not se.work_items.exists():
+      work_items = self.plan(suite_execution=se)
+
+      # Suites without any active check are done right away.
+      if not work_items:
+        se.status = Status.Done
+        se.success = True
+        se.save()
+        return se
+
+    if distributed:
+      return se
+
+    owner = 'local-{}'.format(se.id)
+    outputs = {}
+    # SQLite does not support concurrent writes.
+    max_parallel = settings.SUITE_MAX_PARALLEL_CHECKS if (
+      connection.vendor != 'sqlite') else 1
+
+    def execute_work_item(work_item):
+      try:
+        work_item.execute(owner=owner, outputs=outputs)
+      finally:
+        connection.close()
+
+    # Work items are executed inline if they cannot be parallelized.
+    pool = ThreadPoolExecutor(max_workers=max_parallel) if (
+      max_parallel > 1) else None
+    running = set()
+    try:
+      while True:
+        if preempt and preempt():
+          wait(running)
+          se.status = Status.Created
+          se.save(update_fields=['status', 'updated'])
+          return se
+
+        se.expire_work_items()
+        work_item = WorkItem.claim(owner=owner, suite_execution=se) if (
+          len(running) < max_parallel) else None
+        if work_item and pool:
+          running.add(pool.submit(execute_work_item, work_item))
+        elif work_item:
+          work_item.execute(owner=owner, outputs=outputs)
+        elif running:
+          # Remaining work items may wait for running ones.
+          done, running = wait(running, return_when=FIRST_COMPLETED)
+          for future in done:
+            future.result()
+          # Running work items of stopped executions are abandoned.
+          se.refresh_from_db(fields=['status'])
+          if se.status in FINISHED_STATUSES:
+            break
+        else:
+          break
+    finally:
+      if pool:
+        pool.shutdown(wait=not running)
 
-        # Scope dict should be updated if check is at 'property' or 'account'
-        # level:
-        if check_metadata['ga_level'] == GaLevel.Property.value:
-          for item in ga_scope:
-            del item['viewId']
-          ga_scope = [dict(t) for t in {tuple(d.items()) for d in ga_scope}]
-        elif check_metadata['ga_level'] == GaLevel.Account.value:
-          ga_scope = [{'accountId': item} for item in list(
-            set([item['accountId'] for item in ga_scope]))]
+    # Finalize executions whose remaining work items were expired or cancelled.
+    se.update_after_check_execution()
+    return se
 
-        for scope_dict in ga_scope:
-          specific_params = dict(scope_dict, **{
-            'startDate': self.ga_params.start_date,
-            'endDate': self.ga_params.end_date})
 
-      c.execute(suite_execution=se, extra_params=specific_params)
+class Schedule(models.Model):
+  """A recurring execution of a suite, either following a cron expression (e.g.
+  "0 3 * * *") or every `interval` seconds.
 
-    return se
+  A random delay of up to `jitter` seconds is added to every run, so that
+  suites scheduled at the same time do not all start at once. Runs are started
+  by the scheduler (see `dqm.scheduler`).
+  """
+  suite = models.ForeignKey(Suite, on_delete=models.CASCADE,
+    related_name='schedules')
+  cron = models.CharField(max_length=100, null=True, blank=True)
+  interval = models.PositiveIntegerField(null=True, blank=True)
+  jitter = models.PositiveIntegerField(default=300)
+  active = models.BooleanField(default=True)
+  next_run = models.DateTimeField(null=True, blank=True)
+  last_run = models.DateTimeField(null=True, blank=True)
+
+  created = models.DateTimeField(auto_now_add=True)
+  updated = models.DateTimeField(auto_now=True)
+
+  def __str__(self) -> str:
+    return '{}, {}'.format(self.suite, self.cron or
+      'every {}s'.format(self.interval))
+
+  def compute_next_run(self, after: datetime) -> datetime:
+    if self.cron:
+      next_run = CronExpression(self.cron).next_after(after)
+    else:
+      next_run = after + timedelta(seconds=self.interval)
+    return next_run + timedelta(seconds=random.uniform(0, self.jitter))
+
+  def clean(self) -> None:
+    if bool(self.cron) == bool(self.interval):
+      raise ValidationError(
+        'Either a cron expression or an interval is required.')
+    if self.cron:
+      try:
+        CronExpression(str(self.cron)).next_after(timezone.now())
+      except BadCronExpressionError as e:
+        raise ValidationError({'cron': str(e)})
+
+  def save(self, *args, **kwargs) -> None:
+    if self.next_run is None:
+      self.next_run = self.compute_next_run(after=timezone.now())
+    super().save(*args, **kwargs)
 
 
 class GaParams(models.Model):
   """
-  >>> ga_params = GaParams.objects.create(
-        scope_json='[
-          {
-            "viewId":"123456",
-            "webPropertyId":"123456",
-            "accountId":"12346",
-          },
-        ]'
-      )
+  >>> ga_params = GaParams.objects.create(suite=suite)
+  >>> ga_params.set_scope([
+        {
+          "viewId":"123456",
+          "webPropertyId":"123456",
+          "accountId":"12346",
+        },
+      ])
+
+  The scope is stored as `ScopeItem` objects. Scopes stored in `scope_json`
+  (legacy) are moved to scope items when first accessed.
   """
   suite = models.OneToOneField(Suite, related_name='ga_params',
     on_delete=models.CASCADE)
@@ -143,56 +715,285 @@ class GaParams(models.Model):
     }
 
   @property
-  def scope(self) -> List[Any]:
-    return json.loads(self.scope_json) if self.scope_json else []
+  def scope(self) -> List[Dict]:
+    return [item.to_dict() for item in self.get_scope_items()]
 
   @property
   def views(self) -> List[str]:
-    return [s['viewId'] for s in json.loads(self.scope_json)]
+    return list(self.get_scope_items().values_list('view_id', flat=True))
+
+  def set_scope(self, scope: List[Dict]) -> None:
+    """Replace the scope with the given items (see `ScopeItem.to_dict`).
+    """
+    with transaction.atomic():
+      self.scope_items.all().delete()
+      ScopeItem.objects.bulk_create([ScopeItem(ga_params=self, position=i,
+        view_id=item.get('viewId') or '',
+        property_id=item.get('webPropertyId') or '',
+        account_id=item.get('accountId') or '')
+        for i, item in enumerate(scope)], batch_size=500)
+      if self.scope_json != '[]':
+        self.scope_json = '[]'
+        GaParams.objects.filter(pk=self.pk).update(scope_json='[]')
+
+  def get_scope_items(self) -> models.QuerySet:
+    if self.scope_json and self.scope_json != '[]':
+      self.set_scope(json.loads(self.scope_json))
+    return self.scope_items.all()
+
+  @classmethod
+  def backfill_scope_items(cls) -> None:
+    """Move all legacy scopes to scope items.
+    """
+    for ga_params in cls.objects.exclude(scope_json__in=['', '[]']):
+      ga_params.get_scope_items()
+
+  def get_scope(self, ga_level: str = GaLevel.View.value) -> List[Dict]:
+    """Scope at the given GA level: views, or their distinct properties or
+    accounts, in scope order.
+    """
+    if ga_level == GaLevel.Account.value:
+      fields = ['account_id']
+    elif ga_level == GaLevel.Property.value:
+      fields = ['property_id', 'account_id']
+    else:
+      fields = ['view_id', 'property_id', 'account_id']
+    rows = dict.fromkeys(self.get_scope_items().values_list(*fields))
+    return [ScopeItem(**dict(zip(fields, row))).to_dict(fields=fields)
+            for row in rows]
+
+
+class ScopeItem(models.Model):
+  """A GA view of the scope of a suite.
+  """
+  ga_params = models.ForeignKey(GaParams, on_delete=models.CASCADE,
+    related_name='scope_items')
+  position = models.PositiveIntegerField(default=0)
+  view_id = models.CharField(max_length=32, blank=True)
+  property_id = models.CharField(max_length=32, blank=True)
+  account_id = models.CharField(max_length=32, blank=True)
+
+  class Meta:
+    ordering = ['ga_params', 'position']
+    indexes = [
+      models.Index(fields=['view_id']),
+      models.Index(fields=['property_id']),
+      models.Index(fields=['account_id']),
+    ]
+
+  def to_dict(self, fields: Iterable[str] = None) -> Dict:
+    keys = {
+      'view_id': 'viewId',
+      'property_id': 'webPropertyId',
+      'account_id': 'accountId',
+    }
+    return {keys[f]: getattr(self, f) for f in fields or keys}
 
 
 class SuiteExecution(models.Model):
   suite = models.ForeignKey(Suite, on_delete=models.CASCADE,
     related_name='executions')
   status = models.IntegerField(choices=Status.choices, default=Status.Created)
+  priority = models.IntegerField(choices=Priority.choices,
+    default=Priority.Interactive)
   success = models.BooleanField(null=True, blank=True)
   executed = models.DateTimeField(null=True, blank=True)
+  deadline = models.DateTimeField(null=True, blank=True)
+  # Whether checks are executed even if previous results could be reused.
+  force = models.BooleanField(default=False)
+  fail_fast = models.BooleanField(default=False)
+  # Set to the suite id while the execution is running, if the suite coalesces
+  # runs: at most one execution of the suite can hold it.
+  run_lock = models.IntegerField(null=True, blank=True, unique=True)
 
   created = models.DateTimeField(auto_now_add=True)
   updated = models.DateTimeField(auto_now=True)
 
+  class Meta:
+    indexes = [
+      # Execution history of a suite (see `api.views.get_suite`).
+      models.Index(fields=['suite', '-created'],
+        name='suiteexec_suite_created'),
+      # Daily stats (see `get_stats`).
+      models.Index(fields=['executed', 'success'],
+        name='suiteexec_executed_success'),
+    ]
+
   def __str__(self) -> str:
     return '{}, {}'.format(self.suite, self.executed)
 
-  def update_after_check_execution(self, check_execution) -> None:
+  def save(self, *args, **kwargs) -> None:
+    if self.status in FINISHED_STATUSES:
+      self.run_lock = None
+    super().save(*args, **kwargs)
+
+  def save_or_coalesce(self) -> SuiteExecution:
+    """Save the execution, unless another execution of the suite is already
+    running: the latter is returned instead.
+
+    This relies on the uniqueness of `run_lock` in database, so that concurrent
+    requests (from any process) result in a single execution.
+    """
+    for attempt in range(2):
+      self.run_lock = self.suite_id
+      try:
+        with transaction.atomic():
+          self.save()
+        return self
+      except IntegrityError:
+        running = SuiteExecution.objects.filter(
+          run_lock=self.suite_id).first()
+        if running and running.status not in FINISHED_STATUSES:
+          return running
+        # The lock was released meanwhile, or not released by an execution
+        # updated in bulk.
+        SuiteExecution.objects.filter(run_lock=self.suite_id,
+          status__in=FINISHED_STATUSES).update(run_lock=None)
+
+    self.run_lock = None
+    self.save()
+    return self
+
+  @property
+  def overdue(self) -> bool:
+    return bool(self.deadline) and timezone.now() >= self.deadline
+
+  def update_after_check_execution(self,
+    check_execution: CheckExecution = None) -> None:
     """
     This method if called after every check execution.
 
     It updates the status of the SuiteExecution object so that it can reflect
     the actual status (even if checks a executed asynchronously).
+
+    Fail-fast executions are over as soon as a check failed: remaining work
+    items are cancelled.
     """
-    nbr_active_checks = self.suite.checks.filter(active=True).count()
-    check_executions = self.check_executions.all()
-    checks_finished = [ce.status == Status.Done for ce in check_executions]
-    results = [ce.success == True for ce in check_executions]
+    # The execution may have been cancelled meanwhile, by another process.
+    self.refresh_from_db(fields=['status'])
+    self.expire_work_items()
+    work_items = list(self.work_items.select_related('check_execution'))
+
+    if self.fail_fast and any(i.status in FINISHED_STATUSES
+        and i.status != Status.Skipped
+        and not (i.check_execution and i.check_execution.success)
+        for i in work_items):
+      if self.cancel_work_items():
+        work_items = list(self.work_items.select_related('check_execution'))
+
+    # Executions split into work items are done when all work items are...
+    if work_items:
+      done = all(i.status in FINISHED_STATUSES for i in work_items)
+      results = [i.check_execution is not None
+                 and i.check_execution.success == True for i in work_items
+                 if i.status != Status.Skipped]
+    # ...otherwise, when we have the same number of finished checks than the
+    # total number of active checks in the suite.
+    else:
+      check_executions = self.check_executions.all()
+      nbr_active_checks = self.suite.checks.filter(active=True).count()
+      done = len(check_executions) == nbr_active_checks
+      results = [ce.success == True for ce in check_executions]
 
-    # If we have the same number of finished checks than the total number of
-    # active checks in the suite, then we are done.
-    if len(checks_finished) == nbr_active_checks:
-      self.status = Status.Done
+    if done:
       self.success = all(results)
+
+    # Cancelled executions stay so, even if some checks were still running.
+    if self.status == Status.Cancelled:
+      pass
+    elif done and self.overdue and any(
+        i.status == Status.TimedOut for i in work_items):
+      self.status = Status.TimedOut
+    elif done:
+      self.status = Status.Done
     else:
       # ...else, we're still running, and success is still undefinied (None).
       self.status = Status.Running
 
     self.save()
 
+  def expire_work_items(self) -> int:
+    """Time out the work items not started yet, if the deadline passed.
+    Returns the number of items timed out.
+    """
+    if not self.overdue:
+      return 0
+    return self.work_items.filter(status=Status.Created).update(
+      status=Status.TimedOut)
+
+  def cancel(self) -> None:
+    """Cancel the execution: work items not started yet will not be, and
+    running ones are abandoned by their worker at its next heartbeat (see
+    `WorkItem.execute`).
+    """
+    if self.status in FINISHED_STATUSES:
+      return
+
+    self.cancel_work_items()
+    self.status = Status.Cancelled
+    self.success = False
+    self.save()
+
+  def cancel_work_items(self) -> int:
+    """Cancel the work items which are not finished, and return their number.
+    """
+    return self.work_items.exclude(status__in=FINISHED_STATUSES).update(
+      status=Status.Cancelled,
+      lease_owner=None,
+      lease_expires=None)
+
+  def resume(self, distributed: bool = False) -> SuiteExecution:
+    """Execute again the work items which are missing or failed (e.g. after a
+    crash), keeping the results of the completed ones.
+
+    Work items being executed by a live worker are left untouched. The
+    deadline, if any, starts over.
+    """
+    self.reset_work_items()
+    self.success = None
+    self.deadline = None
+    self.save()
+
+    return self.suite.execute(suite_execution=self, distributed=distributed)
+
+  def reset_work_items(self) -> int:
+    """Make unfinished and failed work items available again, except those
+    being executed by a live worker. Returns the number of items reset.
+    """
+    return self.work_items.exclude(status=Status.Done).exclude(
+      status=Status.Running, lease_expires__gte=timezone.now()).update(
+        status=Status.Created,
+        check_execution=None,
+        lease_owner=None,
+        lease_expires=None)
+
   @classmethod
-  def get_stats(cls) -> List:
-    query = SuiteExecution.objects.filter(
-      executed__gte=timezone.now()-timedelta(days=10)).annotate(
+  def get_orphaned(cls) -> models.QuerySet:
+    """Return running executions that nobody executes anymore: they have not
+    been updated for `JANITOR_ORPHAN_SECONDS`, and none of their work items is
+    leased nor left to claim (workers claim those, including items whose lease
+    expired).
+    """
+    now = timezone.now()
+    pending = WorkItem.objects.filter(models.Q(status=Status.Created)
+      | models.Q(status=Status.Running, lease_expires__gte=now)).values(
+        'suite_execution_id')
+    return cls.objects.filter(status=Status.Running, updated__lt=now -
+      timedelta(seconds=settings.JANITOR_ORPHAN_SECONDS)).exclude(
+        id__in=pending)
+
+  @classmethod
+  def get_stats_query(cls, since: datetime) -> models.QuerySet:
+    """Executions since the given time, annotated with their day (see
+    `get_stats`).
+    """
+    return cls.objects.filter(executed__gte=since).annotate(
       day=Trunc('executed', 'day', output_field=models.DateField()))
 
+  @classmethod
+  def get_stats(cls) -> List:
+    query = cls.get_stats_query(timezone.now() - timedelta(days=10))
+
     results = [['day', 'executions', 'successes', 'fails']]
     results = results + [[
       date(day.year, day.month, day.day),
@@ -274,36 +1075,141 @@ class Check(models.Model):
 
     return check_class
 
+  def get_input_hash(self, params: Any) -> str:
+    """Return a hash of everything the result of the check depends on: the
+    version of the check class and the resolved parameters (including scope and
+    date range).
+    """
+    inputs = json.dumps({
+      'check': self.name,
+      'version': self.check_class.version,
+      'params': params,
+    }, cls=DjangoJSONEncoder, sort_keys=True)
+    return hashlib.sha256(inputs.encode()).hexdigest()
+
+  def get_scope_hash(self, params: Any) -> str:
+    """Return a hash of the parameters of the check except its date range, to
+    find previous executions of the check on the same scope.
+    """
+    params_list = params if isinstance(params, list) else [params]
+    scope = json.dumps({
+      'check': self.name,
+      'params': [{k: v for k, v in p.items()
+                  if k not in ('startDate', 'endDate')} for p in params_list],
+    }, cls=DjangoJSONEncoder, sort_keys=True)
+    return hashlib.sha256(scope.encode()).hexdigest()
+
   def execute(self,
     suite_execution: SuiteExecution,
-    extra_params: Dict = None) -> CheckExecution:
+    extra_params: Dict = None,
+    extra_params_list: List[Dict] = None,
+    work_item: WorkItem = None,
+    deadline: Deadline = None,
+    inputs: Dict[str, Any] = None) -> CheckExecution:
     """Execute the check and return a CheckExecution object by execution the
     `run`method of the base check class of this check object.
 
+    If `extra_params_list` is given, the check is executed in "estate mode":
+    the `run_estate` method is called once with one set of parameters per scope
+    item.
+
+    The check is executed in the background, and abandoned if `deadline`
+    passes or is cancelled before the end (see `dqm.helpers.timeout`).
+
+    `inputs` are the outputs of prerequisite checks. The outputs of this check
+    are set in the `outputs` attribute of the returned CheckExecution.
+
+    The result of a previous execution is reused, unless the suite execution is
+    forced, if the inputs of the check did not change (see `get_input_hash`).
+
     A CheckExecution is created and persisted in database.
 
     Note that every `CheckExecution` is part of a `SuiteExecution`, the related
     `SuiteExecution`object is thus also updated in this method.
     """
 
+    if extra_params_list is not None:
+      params = [{**self.params, **p} for p in extra_params_list]
+    else:
+      params = {**self.params, **extra_params} if extra_params else self.params
     ce = CheckExecution.objects.create(suite_execution=suite_execution,
-      check_ref=self)
-    params = {**self.params, **extra_params} if extra_params else self.params
+      check_ref=self, input_hash=self.get_input_hash(params),
+      scope_hash=self.get_scope_hash(params))
+    ce.outputs = {}
+    deadline = deadline or Deadline(
+      timeout=self.check_class.timeout or settings.CHECK_TIMEOUT)
+    started = time.monotonic()
+    # GA API requests of the check are made with service accounts granted the
+    # checked account (see `service_accounts`). Estate-mode checks spanning
+    # several accounts set the account of each request themselves.
+    account_ids = {p.get('accountId') for p in (
+      params if isinstance(params, list) else [params])}
+    account_token = current_account_id.set(
+      account_ids.pop() if len(account_ids) == 1 else None)
 
     try:
-      result: Result = self.check_class().run(params=params)
+      previous = None if suite_execution.force else (
+        CheckExecution.get_reusable(input_hash=ce.input_hash, params=params))
+      if previous:
+        ce.reuse(previous)
+        return ce
+
+      check = self.check_class()
+      check.inputs = inputs or {}
+      if extra_params_list is not None:
+        result: Result = deadline.call(lambda: check.run_estate(
+          params_list=params))
+      else:
+        result: Result = deadline.call(lambda: check.run(params=params))
 
       ce.input_data_json = json.dumps(params, cls=DjangoJSONEncoder)
-      ce.result_json = json.dumps(asdict(result), cls=DjangoJSONEncoder)
+
+      # Checks can also yield result rows (or return a `Result` with a
+      # generator as payload): rows are then streamed to `ResultChunk` objects,
+      # and the check is successful if no rows were yielded.
+      if not isinstance(result, Result):
+        result = Result(payload=result)
+      ce.outputs = {k: v for k, v in result.outputs.items()
+                    if k in self.check_class.outputs}
+      if isinstance(result.payload, Iterator):
+        nbr_rows, nbr_chunks = ce.store_payload(rows=deadline.iterate(
+          result.payload, buffer_size=settings.RESULT_CHUNK_SIZE))
+        result.payload = []
+        result.success = not nbr_rows
+        if result.total_problems is None:
+          result.total_problems = nbr_rows
+        result_dict = {**result.to_dict(), 'streamed': True,
+                       'chunks': nbr_chunks}
+        ce.result_json = json.dumps(result_dict, cls=DjangoJSONEncoder)
+      else:
+        ce.store_result(result.to_dict())
+
       ce.status = Status.Done
-      ce.success = ce.result['success']
+      ce.success = result.success
+    except CheckTimeoutError as e:
+      logger.warning('{} ({})'.format(e, self.name))
+      ce.result_json = json.dumps({'exception': str(e)}, cls=DjangoJSONEncoder)
+      ce.status = Status.TimedOut
+    except CheckCancelledError as e:
+      ce.result_json = json.dumps({'exception': str(e)}, cls=DjangoJSONEncoder)
+      ce.status = Status.Cancelled
     except Exception as e:
       logger.error(traceback.format_exc())
       ce.result_json = json.dumps({'exception': str(e)}, cls=DjangoJSONEncoder)
       ce.status = Status.Failed
     finally:
+      current_account_id.reset(account_token)
+      # Durations of reused results would not tell anything about the check.
+      if not ce.reused:
+        ce.duration = time.monotonic() - started
       ce.save()
-      suite_execution.update_after_check_execution(check_execution=ce)
+      # Executions of items whose lease was lost are detached from the suite
+      # execution: the item is executed again by another worker, or cancelled.
+      if work_item and not work_item.finish(check_execution=ce):
+        ce.suite_execution = None
+        ce.save(update_fields=['suite_execution'])
+      else:
+        suite_execution.update_after_check_execution(check_execution=ce)
 
     return ce
 
@@ -316,23 +1222,269 @@ class CheckExecution(models.Model):
   success = models.BooleanField(null=True, blank=True)
   input_data_json = models.TextField(null=True, blank=True)
   result_json = models.TextField(null=True, blank=True)
+  # See `Check.get_input_hash`.
+  input_hash = models.CharField(max_length=64, null=True, blank=True,
+    db_index=True)
+  # Whether the result was copied from a previous execution.
+  reused = models.BooleanField(default=False)
+  # Execution time in seconds.
+  duration = models.FloatField(null=True, blank=True)
+  # Whether the result was replaced by its summary (see `dqm.retention`).
+  compacted = models.BooleanField(default=False)
+  # See `Check.get_scope_hash`.
+  scope_hash = models.CharField(max_length=64, null=True, blank=True,
+    db_index=True)
+  # Previous execution of the check on the same scope, and the problems added
+  # and resolved since then (see `store_result`).
+  previous = models.ForeignKey('self', on_delete=models.SET_NULL, null=True,
+    blank=True, related_name='+')
+  delta_json = models.TextField(null=True, blank=True)
+  # Number of deltas to apply to the last full payload to get the payload of
+  # this execution, 0 if the payload is stored in full.
+  delta_depth = models.PositiveIntegerField(default=0)
 
   created = models.DateTimeField(auto_now_add=True)
   updated = models.DateTimeField(auto_now=True)
 
+  class Meta:
+    indexes = [
+      # Daily stats (see `get_stats`).
+      models.Index(fields=['created', 'success'],
+        name='checkexec_created_success'),
+    ]
+
   def __str__(self) -> str:
     return '{} - {}'.format(self.check_ref, self.get_status_display())
 
+  @classmethod
+  def get_reusable(cls,
+    input_hash: str,
+    params: Any) -> Optional[CheckExecution]:
+    """Return the latest completed execution with the same inputs, if the date
+    range is closed (i.e. ended before today): GA data of previous days does
+    not change anymore, so neither would the result.
+    """
+    params_list = params if isinstance(params, list) else [params]
+    end_dates = [str(p.get('endDate') or '')[:10] for p in params_list]
+    if not end_dates or not all(end_dates) or (
+        max(end_dates) >= date.today().strftime('%Y-%m-%d')):
+      return None
+
+    # Compacted results do not hold their payload anymore (see `retention`).
+    return cls.objects.filter(input_hash=input_hash, status=Status.Done,
+      compacted=False).order_by('-id').first()
+
+  @classmethod
+  def get_expected_durations(cls,
+    check_names: Iterable[str],
+    history: int = 10) -> Dict[str, float]:
+    """Return the average duration of the last `history` executions of each
+    check (by check class name), for checks which have been executed already.
+    """
+    durations = {}
+    for name in check_names:
+      last = list(cls.objects.filter(check_ref__name=name,
+        duration__isnull=False).order_by('-id').values_list(
+          'duration', flat=True)[:history])
+      if last:
+        durations[name] = sum(last) / len(last)
+    return durations
+
+  def reuse(self, previous: CheckExecution) -> None:
+    """Copy the result of a previous execution (see `get_reusable`).
+    """
+    self.status = previous.status
+    self.success = previous.success
+    self.input_data_json = previous.input_data_json
+    self.reused = True
+    result = json.loads(previous.result_json) if previous.result_json else {}
+    result.pop('compacted', None)
+    if result.get('streamed'):
+      self.result_json = json.dumps(result, cls=DjangoJSONEncoder)
+      # Chunks are copied one at a time, as they are stored (see
+      # `store_payload`).
+      for chunk in previous.chunks.order_by('index').iterator(chunk_size=1):
+        ResultChunk.objects.create(check_execution=self, index=chunk.index,
+          payload_json=chunk.payload_json)
+    else:
+      self.store_result({**result, 'payload': previous.get_payload()})
+
+  def get_previous(self) -> Optional[CheckExecution]:
+    """Return the previous completed execution of the check on the same scope,
+    if its payload is still available.
+    """
+    return CheckExecution.objects.filter(check_ref_id=self.check_ref_id,
+      scope_hash=self.scope_hash, status=Status.Done, compacted=False,
+      id__lt=self.id).order_by('-id').first()
+
+  @staticmethod
+  def has_full_payload(result: Dict) -> bool:
+    """Return True if the payload of a (serialized) result lists all of its
+    problems, one per row, i.e. if it can be compared row by row with another
+    one: payloads may be capped (see `Problems`), aggregated (see
+    `AggregatedResult`) or streamed.
+    """
+    payload = result.get('payload')
+    return (isinstance(payload, list) and not result.get('streamed')
+            and not result.get('group_by')
+            and result.get('total_problems') in (None, len(payload)))
+
+  def store_result(self, result: Dict) -> None:
+    """Store a (non streamed) result, along with the problems added and
+    resolved since the previous execution of the check on the same scope.
+
+    The payload itself is then only stored as this delta, except every
+    `RESULT_SNAPSHOT_INTERVAL` executions, when it is stored in full so that
+    reconstructing payloads (see `get_payload`) stays bounded.
+
+    Payloads which cannot be compared (see `has_full_payload`) are stored in
+    full, and their delta is unavailable.
+    """
+    previous = self.get_previous()
+    previous_result = previous.get_result() if previous else {}
+    self.previous = previous
+    if previous and self.has_full_payload(result) and self.has_full_payload(
+        previous_result):
+      self.delta_json = json.dumps(delta.diff(previous_result['payload'],
+        result['payload']), cls=DjangoJSONEncoder)
+      self.delta_depth = (previous.delta_depth + 1) % (
+        settings.RESULT_SNAPSHOT_INTERVAL or 1)
+      if self.delta_depth:
+        if result.get('total_problems') is None:
+          result = {**result, 'total_problems': len(result['payload'])}
+        result = {**result, 'payload': []}
+
+    self.result_json = json.dumps(result, cls=DjangoJSONEncoder)
+
+  def get_payload(self) -> List[Dict]:
+    """Return the (non streamed) payload, applying deltas to the last full
+    payload if needed. Rows are then not in their original order.
+    """
+    chain = []
+    ce = self
+    while ce and ce.delta_depth:
+      chain.append(ce)
+      ce = ce.previous
+    payload = ce.result.get('payload', []) if ce and ce.result_json else []
+    for ce in reversed(chain):
+      payload = delta.patch(payload, json.loads(ce.delta_json))
+    return payload
+
+  @classmethod
+  def prefetch_previous(cls, executions: Iterable[CheckExecution]) -> None:
+    """Fetch the executions which the payloads of the given ones are stored as
+    deltas against (see `get_payload`), with one query per level of deltas
+    rather than one per execution and level.
+    """
+    fetched = {ce.id: ce for ce in executions}
+    pending = [ce for ce in fetched.values() if ce.delta_depth]
+    while pending:
+      fetched.update(cls.objects.in_bulk({ce.previous_id for ce in pending
+        if ce.previous_id not in fetched}))
+      for ce in pending:
+        ce.previous = fetched.get(ce.previous_id)
+      pending = [ce.previous for ce in pending
+                 if ce.previous and ce.previous.delta_depth
+                 and not cls.previous.is_cached(ce.previous)]
+
+  def get_delta(self) -> Dict:
+    """Return the problems added and resolved since the previous execution of
+    the check on the same scope (all problems are new if there is none).
+    """
+    if self.delta_json:
+      return {'previous': self.previous_id, 'available': True,
+              **json.loads(self.delta_json)}
+    result = self.get_result()
+    if self.previous_id or not self.has_full_payload(result):
+      return {'previous': self.previous_id, 'available': False, 'added': [],
+              'resolved': []}
+    return {'previous': None, 'available': True,
+            'added': result.get('payload', []), 'resolved': []}
+
+  def materialize(self) -> None:
+    """Store the payload in full, e.g. before the previous execution it
+    depends on is compacted or deleted.
+    """
+    if not self.delta_depth:
+      return
+    self.result_json = json.dumps({**self.result, 'payload': self.get_payload()},
+      cls=DjangoJSONEncoder)
+    self.delta_depth = 0
+    self.save(update_fields=['result_json', 'delta_depth'])
+
+  @classmethod
+  def materialize_dependents(cls, ids: List[int]) -> int:
+    """Store in full the payloads stored as deltas against the given
+    executions, except the given ones. Returns their number.
+    """
+    dependents = list(cls.objects.filter(previous_id__in=ids,
+      delta_depth__gt=0).exclude(id__in=ids))
+    for ce in dependents:
+      ce.materialize()
+    return len(dependents)
+
   @property
   def result(self) -> List[Any]:
     return json.loads(self.result_json) if self.result_json else []
 
+  def get_result(self, summary: bool = False) -> Dict:
+    """Return the result as a dictionnary, in summary form if asked (see
+    `AggregatedResult.summarize`).
+    """
+    result = json.loads(self.result_json) if self.result_json else {}
+
+    # Only the first chunk of streamed payloads is returned, remaining chunks
+    # can be fetched with `get_payload_chunk`.
+    if result.get('streamed') and result.get('chunks'):
+      result['payload'] = self.get_payload_chunk(index=0)
+    elif self.delta_depth:
+      result['payload'] = self.get_payload()
+
+    return AggregatedResult.summarize(result) if summary else result
+
+  def store_payload(self, rows: Iterable[Dict]) -> Tuple[int, int]:
+    """Encode result rows into `ResultChunk` objects as they come, so that at
+    most `RESULT_CHUNK_SIZE` rows are held in memory.
+
+    Returns the number of rows and the number of chunks stored.
+    """
+    encoder = DjangoJSONEncoder()
+    buffer = []
+    nbr_rows = 0
+    nbr_chunks = 0
+
+    for row in rows:
+      buffer.append(encoder.encode(row))
+      nbr_rows += 1
+      if len(buffer) == settings.RESULT_CHUNK_SIZE:
+        ResultChunk.objects.create(check_execution=self, index=nbr_chunks,
+          payload_json='[{}]'.format(','.join(buffer)))
+        nbr_chunks += 1
+        buffer = []
+
+    if buffer:
+      ResultChunk.objects.create(check_execution=self, index=nbr_chunks,
+        payload_json='[{}]'.format(','.join(buffer)))
+      nbr_chunks += 1
+
+    return nbr_rows, nbr_chunks
+
+  def get_payload_chunk(self, index: int) -> List[Dict]:
+    chunk = self.chunks.filter(index=index).first()
+    return json.loads(chunk.payload_json) if chunk else []
+
   @classmethod
-  def get_stats(cls) -> List:
-    query = CheckExecution.objects.filter(
-      created__gte=timezone.now()-timedelta(days=10)).annotate(
+  def get_stats_query(cls, since: datetime) -> models.QuerySet:
+    """Executions since the given time, annotated with their day (see
+    `get_stats`).
+    """
+    return cls.objects.filter(created__gte=since).annotate(
       day=Trunc('created', 'day', output_field=models.DateField()))
 
+  @classmethod
+  def get_stats(cls) -> List:
+    query = cls.get_stats_query(timezone.now() - timedelta(days=10))
+
     results = [['day', 'executions', 'successes', 'fails']]
     results = results + [[
       date(day.year, day.month, day.day),
@@ -345,4 +1497,238 @@ class CheckExecution(models.Model):
     ] for day in (
       timezone.now() - timedelta(days=10) + timedelta(n) for n in range(11))]
 
-    return results
\ No newline at end of file
+    return results
+
+
+class ResultChunk(models.Model):
+  """A chunk of a streamed result payload (see `CheckExecution.store_payload`).
+  """
+  check_execution = models.ForeignKey(CheckExecution, on_delete=models.CASCADE,
+    related_name='chunks')
+  index = models.IntegerField()
+  payload_json = models.TextField()
+
+  class Meta:
+    ordering = ('index',)
+    unique_together = ('check_execution', 'index')
+
+
+class WorkItem(models.Model):
+  """A unit of work of a suite execution: the execution of a check for a given
+  scope (see `Suite.plan`).
+
+  Work items are claimed by workers (see `dqm.worker`) for a limited time
+  (lease), which is extended as long as the worker is alive (heartbeat). Items
+  whose lease expired are claimed again by other workers.
+  """
+  suite_execution = models.ForeignKey(SuiteExecution, on_delete=models.CASCADE,
+    related_name='work_items')
+  check_ref = models.ForeignKey(Check, on_delete=models.CASCADE)
+  params_json = models.TextField(null=True, blank=True)
+  estate = models.BooleanField(default=False)
+  # Copied from the suite execution, so that claiming does not need any join.
+  priority = models.IntegerField(choices=Priority.choices,
+    default=Priority.Interactive)
+  status = models.IntegerField(choices=Status.choices, default=Status.Created)
+  check_execution = models.OneToOneField(CheckExecution,
+    on_delete=models.SET_NULL, null=True, blank=True)
+  lease_owner = models.CharField(max_length=255, null=True, blank=True)
+  lease_expires = models.DateTimeField(null=True, blank=True)
+  attempts = models.IntegerField(default=0)
+  # Items of a same priority are claimed by increasing rank (see `Suite.plan`).
+  rank = models.IntegerField(default=0)
+  depends_on = models.ManyToManyField('self', symmetrical=False,
+    related_name='dependents', blank=True)
+
+  created = models.DateTimeField(auto_now_add=True)
+  updated = models.DateTimeField(auto_now=True)
+
+  class Meta:
+    indexes = [models.Index(fields=['status', 'priority', 'lease_expires'])]
+
+  def __str__(self) -> str:
+    return '{} - {}'.format(self.check_ref, self.get_status_display())
+
+  @property
+  def params(self) -> Any:
+    return json.loads(self.params_json) if self.params_json else {}
+
+  @classmethod
+  def claim(cls,
+    owner: str,
+    suite_execution: SuiteExecution = None) -> Optional[WorkItem]:
+    """Claim the next available work item (optionally restricted to a given
+    suite execution), or return None if there is none.
+
+    Available items are those not claimed yet, and those whose lease expired,
+    provided the items they depend on are finished. Items of interactive
+    executions are claimed first.
+    """
+    now = timezone.now()
+    lease = {
+      'status': Status.Running,
+      'lease_owner': owner,
+      'lease_expires': now + timedelta(seconds=settings.WORKER_LEASE_SECONDS),
+    }
+    available = cls.objects.filter(
+      models.Q(status=Status.Created) |
+      models.Q(status=Status.Running, lease_expires__lt=now)).exclude(
+        depends_on__status__in=[Status.Created, Status.Running])
+    if suite_execution:
+      available = available.filter(suite_execution=suite_execution)
+    available = available.order_by('-priority', 'rank', 'id')
+
+    # Row-level locks let concurrent workers skip items being claimed (MySQL)...
+    if connection.features.has_select_for_update_skip_locked:
+      with transaction.atomic():
+        work_item = available.select_for_update(skip_locked=True).first()
+        if work_item:
+          cls.objects.filter(id=work_item.id).update(
+            attempts=models.F('attempts') + 1, **lease)
+          work_item.refresh_from_db()
+        return work_item
+
+    # ...otherwise (SQLite), items are claimed with a conditional update, which
+    # fails if another worker claimed the item in the meantime.
+    for work_item in available[:10]:
+      if available.filter(id=work_item.id).update(
+          attempts=models.F('attempts') + 1, **lease):
+        work_item.refresh_from_db()
+        return work_item
+
+    return None
+
+  def heartbeat(self, owner: str) -> bool:
+    """Extend the lease, and return False if it has been lost.
+    """
+    return bool(WorkItem.objects.filter(id=self.id, lease_owner=owner,
+      status=Status.Running).update(lease_expires=timezone.now() + timedelta(
+        seconds=settings.WORKER_LEASE_SECONDS)))
+
+  def overlaps(self, other: WorkItem) -> bool:
+    """Return True if scopes of both work items overlap, i.e. if one includes
+    the other (e.g. a GA view and its property).
+    """
+    if self.estate or other.estate:
+      return True
+    scope, other_scope = self.params.items(), other.params.items()
+    return scope <= other_scope or other_scope <= scope
+
+  def get_unmet_dependencies(self) -> List[WorkItem]:
+    """Return the items this item depends on which did not succeed as required
+    (see `check_bricks.Dependency`).
+    """
+    requirements = {d.check: d for d in self.check_ref.check_class.depends_on}
+    unmet = []
+    for i in self.depends_on.select_related('check_ref', 'check_execution'):
+      dependency = requirements.get(i.check_ref.name)
+      if not dependency or not dependency.required:
+        continue
+      if i.status != Status.Done or (dependency.require_success and not (
+          i.check_execution and i.check_execution.success)):
+        unmet.append(i)
+    return unmet
+
+  def release(self, **fields) -> bool:
+    """Update the item and release its lease, provided it still holds it, and
+    return False otherwise (e.g. lease expired and item claimed by another
+    worker, or execution cancelled).
+
+    Updates are conditional, as this instance may be stale.
+    """
+    updated = WorkItem.objects.filter(id=self.id, lease_owner=self.lease_owner,
+      status=Status.Running).update(lease_owner=None, lease_expires=None,
+        updated=timezone.now(), **fields)
+    if not updated:
+      logger.warning('Lease lost for work item {}'.format(self.id))
+      return False
+    for name, value in fields.items():
+      setattr(self, name, value)
+    self.lease_owner = None
+    self.lease_expires = None
+    return True
+
+  def skip(self) -> None:
+    if self.release(status=Status.Skipped):
+      self.suite_execution.update_after_check_execution()
+
+  def execute(self,
+    owner: str,
+    outputs: Dict[int, Dict] = None) -> Optional[CheckExecution]:
+    """Execute the check, sending heartbeats in the background meanwhile.
+
+    The check is skipped if the items it depends on did not succeed. It is
+    abandoned if it exceeds its timeout or the deadline of the suite execution,
+    or if the lease is lost (e.g. execution cancelled).
+
+    `outputs` holds the outputs of items executed so far, by item id: the
+    outputs of the items this item depends on are given as inputs to the
+    check, and its own outputs are added.
+    """
+    unmet = self.get_unmet_dependencies()
+    if unmet:
+      logger.info('Work item {} skipped, depending on: {}'.format(self.id,
+        ', '.join(str(i) for i in unmet)))
+      self.skip()
+      if outputs is not None:
+        self.release_inputs(outputs)
+      return None
+
+    inputs = {}
+    if outputs is not None:
+      for item_id in self.depends_on.values_list('id', flat=True):
+        inputs.update(outputs.get(item_id, {}))
+
+    stop = threading.Event()
+    timeout = self.check_ref.check_class.timeout or settings.CHECK_TIMEOUT
+    if self.suite_execution.deadline:
+      timeout = min(timeout, max((self.suite_execution.deadline -
+        timezone.now()).total_seconds(), 0))
+    deadline = Deadline(timeout=timeout)
+
+    def send_heartbeats():
+      while not stop.wait(settings.WORKER_HEARTBEAT_SECONDS):
+        if not self.heartbeat(owner=owner):
+          logger.warning('Lease lost for work item {}'.format(self.id))
+          deadline.cancelled.set()
+          break
+      connection.close()
+
+    threading.Thread(target=send_heartbeats, daemon=True).start()
+    try:
+      if self.estate:
+        ce = self.check_ref.execute(suite_execution=self.suite_execution,
+          extra_params_list=self.params, work_item=self, deadline=deadline,
+          inputs=inputs)
+      else:
+        ce = self.check_ref.execute(suite_execution=self.suite_execution,
+          extra_params=self.params, work_item=self, deadline=deadline,
+          inputs=inputs)
+    finally:
+      stop.set()
+
+    # Outputs are only kept if some items may need them.
+    if outputs is not None:
+      if ce.outputs and self.dependents.exists():
+        outputs[self.id] = ce.outputs
+      self.release_inputs(outputs)
+    return ce
+
+  def release_inputs(self, outputs: Dict[int, Dict]) -> None:
+    """Drop the outputs of the items this item depends on from `outputs`, once
+    every item depending on them is finished.
+    """
+    item_ids = set(self.depends_on.values_list('id', flat=True))
+    needed = WorkItem.depends_on.through.objects.filter(
+      to_workitem_id__in=item_ids).exclude(
+        from_workitem__status__in=FINISHED_STATUSES).values_list(
+          'to_workitem_id', flat=True)
+    for item_id in item_ids - set(needed):
+      outputs.pop(item_id, None)
+
+  def finish(self, check_execution: CheckExecution) -> bool:
+    """Attach the check execution to the item, and return False if the lease
+    was lost meanwhile (see `release`).
+    """
+    return self.release(check_execution=check_execution,
+      status=check_execution.status)
@@ -0,0 +1,215 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Retention policy of execution history.
+
+For each suite (see `Suite.get_retention_days`):
+- Check executions older than the "detail" retention are compacted: their
+  result is replaced by its summary, and their payload chunks are deleted.
+- Suite executions older than the "summary" retention are archived to
+  compressed files (one per suite, in `ARCHIVE_DIR`), then deleted.
+
+Rows are processed in batches of `RETENTION_BATCH_SIZE`, each in its own
+transaction, so that tables are never locked for long.
+"""
+
+from datetime import timedelta
+import gzip
+import json
+import logging
+import os
+from typing import Dict, List
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from dqm.check_bricks import AggregatedResult
+from dqm.models import (
+  FINISHED_STATUSES,
+  CheckExecution,
+  ResultChunk,
+  Suite,
+  SuiteExecution,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+def summarize_result(result: Dict) -> str:
+  """Summary of a check result, serialized: problems are counted, but only
+  aggregated ones are kept (without their examples).
+  """
+  if 'payload' in result:
+    if result.get('total_problems') is None and not result.get('streamed'):
+      result['total_problems'] = len(result['payload'])
+    result = AggregatedResult.summarize(result)
+    if not result.get('group_by'):
+      result['payload'] = []
+    result['chunks'] = 0
+  result['compacted'] = True
+  return json.dumps(result, cls=DjangoJSONEncoder)
+
+
+def compact_check_executions(suite: Suite) -> int:
+  """Compact check executions older than the detail retention of the suite.
+  Returns the number of compacted check executions.
+  """
+  days, _ = suite.get_retention_days()
+  if not days:
+    return 0
+
+  query = CheckExecution.objects.filter(check_ref__suite=suite, compacted=False,
+    created__lt=timezone.now() - timedelta(days=days),
+    status__in=FINISHED_STATUSES).order_by('id')
+  compacted = 0
+  while True:
+    batch = list(query[:settings.RETENTION_BATCH_SIZE])
+    if not batch:
+      return compacted
+    # Payloads stored as deltas against compacted executions are stored in
+    # full beforehand (see `CheckExecution.store_result`).
+    CheckExecution.materialize_dependents([ce.id for ce in batch])
+    for ce in batch:
+      ce.result_json = summarize_result(ce.get_result())
+    for ce in batch:
+      ce.compacted = True
+      ce.delta_depth = 0
+    with transaction.atomic():
+      ResultChunk.objects.filter(check_execution__in=batch).delete()
+      CheckExecution.objects.bulk_update(batch,
+        ['result_json', 'compacted', 'delta_depth'])
+    compacted += len(batch)
+
+
+def serialize_suite_execution(se: SuiteExecution) -> Dict:
+  return {
+    'id': se.id,
+    'suite': se.suite_id,
+    'status': se.get_status_display(),
+    'success': se.success,
+    'executed': se.executed,
+    'created': se.created,
+    'checkExecutions': [{
+      'id': ce.id,
+      'name': ce.check_ref.name,
+      'status': ce.get_status_display(),
+      'success': ce.success,
+      'inputData': json.loads(ce.input_data_json) if ce.input_data_json
+                   else {},
+      'result': json.loads(summarize_result(ce.get_result())),
+      'created': ce.created,
+    } for ce in se.check_executions.all()],
+  }
+
+
+def get_archive_path(suite: Suite) -> str:
+  return os.path.join(settings.ARCHIVE_DIR,
+    'suite-{}.jsonl.gz'.format(suite.id))
+
+
+def get_archive_state(suite: Suite) -> Dict[str, int]:
+  """Return the id of the last suite execution archived, and the size of the
+  archive at that point (see `archive_suite_executions`).
+  """
+  path = get_archive_path(suite)
+  try:
+    with open(path + '.state') as f:
+      return json.load(f)
+  except FileNotFoundError:
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    return {'last_id': 0, 'size': size}
+
+
+def set_archive_state(suite: Suite, state: Dict[str, int]) -> None:
+  path = get_archive_path(suite) + '.state'
+  with open(path + '.tmp', 'w') as f:
+    json.dump(state, f)
+  os.replace(path + '.tmp', path)
+
+
+def archive_suite_executions(suite: Suite) -> int:
+  """Archive, then delete, suite executions older than the summary retention
+  of the suite. Returns the number of archived suite executions.
+
+  Archives are gzipped JSON lines files, one suite execution per line,
+  appended to at each run.
+
+  Archiving is idempotent: the last archived suite execution is recorded
+  once a batch is written, so that executions archived by an interrupted run
+  are only deleted by the next one, and batches written but not recorded are
+  truncated from the archive.
+  """
+  _, days = suite.get_retention_days()
+  if not days:
+    return 0
+
+  query = SuiteExecution.objects.filter(suite=suite,
+    created__lt=timezone.now() - timedelta(days=days),
+    status__in=FINISHED_STATUSES).order_by('id').prefetch_related(
+      'check_executions__check_ref')
+  os.makedirs(settings.ARCHIVE_DIR, exist_ok=True)
+  path = get_archive_path(suite)
+  state = get_archive_state(suite)
+  if os.path.exists(path) and os.path.getsize(path) > state['size']:
+    os.truncate(path, state['size'])
+
+  archived = 0
+  while True:
+    batch = list(query[:settings.RETENTION_BATCH_SIZE])
+    if not batch:
+      return archived
+    # Each batch is written (as a gzip member) before rows are deleted.
+    pending = [se for se in batch if se.id > state['last_id']]
+    if pending:
+      with gzip.open(path, 'at') as f:
+        for se in pending:
+          f.write(json.dumps(serialize_suite_execution(se),
+            cls=DjangoJSONEncoder) + '\n')
+      state = {'last_id': pending[-1].id, 'size': os.path.getsize(path)}
+      set_archive_state(suite, state)
+    delete_suite_executions([se.id for se in batch])
+    archived += len(batch)
+
+
+def delete_suite_executions(ids: List[int]) -> None:
+  """Delete suite executions, their check executions and payload chunks
+  first, in batches.
+  """
+  ce_ids = list(CheckExecution.objects.filter(
+    suite_execution_id__in=ids).values_list('id', flat=True))
+  CheckExecution.materialize_dependents(ce_ids)
+  for i in range(0, len(ce_ids), settings.RETENTION_BATCH_SIZE):
+    batch = ce_ids[i:i + settings.RETENTION_BATCH_SIZE]
+    with transaction.atomic():
+      ResultChunk.objects.filter(check_execution_id__in=batch).delete()
+      CheckExecution.objects.filter(id__in=batch).delete()
+  SuiteExecution.objects.filter(id__in=ids).delete()
+
+
+def apply_retention() -> Dict[int, Dict[str, int]]:
+  """Apply the retention policy of every suite. Returns the number of
+  compacted check executions and archived suite executions, by suite id.
+  """
+  results = {}
+  for suite in Suite.objects.all():
+    results[suite.id] = {
+      'compacted': compact_check_executions(suite),
+      'archived': archive_suite_executions(suite),
+    }
+    if any(results[suite.id].values()):
+      logger.info('Retention of suite {}: {}'.format(suite.id,
+        results[suite.id]))
+  return results
@@ -0,0 +1,200 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Scheduler for suite executions.
+
+The scheduler is meant to run in its own process (see the `run_scheduler`
+management command), calling `Scheduler.tick` periodically. Each tick:
+
+0. Queues orphaned executions again, to be resumed (see `dqm.janitor`).
+
+1. Queues a batch `SuiteExecution` for each due schedule (see `Schedule`
+   model). Missed runs are coalesced: a schedule late by several periods, or
+   whose suite is still queued or running, is only run once.
+
+2. Dispatches queued executions, as long as the number of running executions
+   stays below the global and per GA account limits (see
+   `SCHEDULER_MAX_CONCURRENT_RUNS*` settings). Interactive executions come
+   first, then executions are picked by weighted fair queuing between GA
+   accounts (see `SCHEDULER_ACCOUNT_WEIGHTS` setting), so that a huge suite
+   does not starve the other accounts.
+
+Batch executions are preempted (at check boundaries) while interactive
+executions, e.g. started with the "Run" button, are in flight. They are then
+queued again, and resumed where they stopped once no interactive execution is
+in flight anymore.
+
+If `DISTRIBUTED_EXECUTION` setting is set, dispatched executions are only split
+into work items, executed by workers (see `dqm.worker`).
+"""
+
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import logging
+import traceback
+from typing import List
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from dqm.janitor import purge_deleted_suites, requeue_orphaned_executions
+from dqm.models import GaParams, Priority, Schedule, Status, SuiteExecution
+
+
+logger = logging.getLogger(__name__)
+
+
+class Scheduler:
+
+  def __init__(self,
+    max_runs: int = None,
+    max_runs_per_account: int = None) -> None:
+    self.max_runs = max_runs or settings.SCHEDULER_MAX_CONCURRENT_RUNS
+    self.max_runs_per_account = (max_runs_per_account or
+      settings.SCHEDULER_MAX_CONCURRENT_RUNS_PER_ACCOUNT)
+    self.executor = ThreadPoolExecutor(max_workers=self.max_runs)
+
+    # Weighted fair queuing state: virtual time of each GA account, and of the
+    # whole system, and (start, finish) tags of dispatched executions, which
+    # are kept if they are preempted and queued again.
+    self.virtual_times = defaultdict(float)
+    self.virtual_time = 0.0
+    self.tags = {}
+
+  def tick(self, now: datetime = None) -> List[SuiteExecution]:
+    """Queue due schedules, dispatch queued executions, and return the
+    dispatched `SuiteExecution` objects.
+    """
+    requeue_orphaned_executions()
+    purge_deleted_suites(max_batches=settings.PURGE_BATCHES_PER_TICK)
+    self.enqueue(now=now or timezone.now())
+    return self.dispatch()
+
+  def enqueue(self, now: datetime) -> List[SuiteExecution]:
+    pending_suites = set(SuiteExecution.objects.filter(
+      status__in=[Status.Created, Status.Running]).values_list(
+        'suite_id', flat=True))
+
+    queued = []
+    for schedule in Schedule.objects.filter(active=True,
+        next_run__lte=now).select_related('suite').order_by('next_run'):
+      if schedule.suite_id not in pending_suites:
+        queued.append(SuiteExecution.objects.create(suite=schedule.suite,
+          priority=Priority.Batch))
+        pending_suites.add(schedule.suite_id)
+        schedule.last_run = now
+      schedule.next_run = schedule.compute_next_run(after=now)
+      schedule.save()
+
+    return queued
+
+  def _cost(self, suite_execution: SuiteExecution) -> int:
+    """Rough cost of an execution, in number of (check, view) units.
+    """
+    suite = suite_execution.suite
+    try:
+      nbr_views = suite.ga_params.get_scope_items().count()
+    except GaParams.DoesNotExist:
+      nbr_views = 0
+    return max(suite.checks.filter(active=True).count() * max(nbr_views, 1), 1)
+
+  def dispatch(self) -> List[SuiteExecution]:
+    running = list(SuiteExecution.objects.filter(
+      status=Status.Running).select_related('suite'))
+    nbr_running = len(running)
+    running_per_account = Counter(
+      a for se in running for a in se.suite.account_ids)
+
+    # Start and finish (virtual) tags are computed in order of arrival: each
+    # execution of an account starts when the previous one finishes, and lasts
+    # its cost divided by the account weight.
+    # Executions are charged once, even if they are dispatched again after
+    # being preempted.
+    weights = settings.SCHEDULER_ACCOUNT_WEIGHTS
+    virtual_times = self.virtual_times.copy()
+    queued = list(SuiteExecution.objects.filter(
+      status=Status.Created).select_related('suite').order_by('created'))
+    active_ids = {se.id for se in running + queued}
+    self.tags = {k: v for k, v in self.tags.items() if k in active_ids}
+    queue = []
+    for se in queued:
+      accounts = se.suite.account_ids or {''}
+      if se.id in self.tags:
+        start_tag, finish_tag = self.tags[se.id]
+      else:
+        start_tag = max([self.virtual_time] + [virtual_times[a]
+                                              for a in accounts])
+        finish_tag = start_tag + self._cost(se) / min(
+          weights.get(a, 1) for a in accounts)
+        for a in accounts:
+          virtual_times[a] = finish_tag
+      queue.append((se, accounts, start_tag, finish_tag))
+
+    # Interactive executions first, then smallest finish tag first.
+    queue.sort(key=lambda item: (-item[0].priority, item[3]))
+
+    # Batch executions would be preempted right away (see `should_preempt`).
+    preempting = self.is_interactive_pending()
+
+    dispatched = []
+    for se, accounts, start_tag, finish_tag in queue:
+      if nbr_running >= self.max_runs:
+        break
+      if preempting and se.priority == Priority.Batch:
+        continue
+      if any(running_per_account[a] >= self.max_runs_per_account
+             for a in accounts if a):
+        continue
+
+      # Status is updated right away so that the execution is not dispatched
+      # twice.
+      se.status = Status.Running
+      se.save()
+      self.executor.submit(self._execute, se)
+
+      if se.id not in self.tags:
+        self.tags[se.id] = (start_tag, finish_tag)
+        for a in accounts:
+          self.virtual_times[a] = max(self.virtual_times[a], finish_tag)
+        self.virtual_time = max(self.virtual_time, start_tag)
+      nbr_running += 1
+      running_per_account.update(accounts)
+      dispatched.append(se)
+
+    return dispatched
+
+  def is_interactive_pending(self) -> bool:
+    return SuiteExecution.objects.filter(priority=Priority.Interactive,
+      status__in=[Status.Created, Status.Running]).exists()
+
+  def should_preempt(self, suite_execution: SuiteExecution) -> bool:
+    """Batch executions give way to interactive ones.
+    """
+    return (suite_execution.priority == Priority.Batch
+      and self.is_interactive_pending())
+
+  def _execute(self, suite_execution: SuiteExecution) -> None:
+    try:
+      suite_execution.suite.execute(suite_execution=suite_execution,
+        preempt=lambda: self.should_preempt(suite_execution),
+        distributed=settings.DISTRIBUTED_EXECUTION)
+    except Exception:
+      logger.error(traceback.format_exc())
+    finally:
+      # Each thread has its own database connection.
+      connection.close()
+
+  def shutdown(self, wait: bool = True) -> None:
+    self.executor.shutdown(wait=wait)
@@ -12,14 +12,60 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
+import gzip
+import json
+import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
 
+from apiclient.errors import HttpError
+
+from oauth2client import client
+
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from dqm import errors
+from dqm.api import views
 import dqm.check_bricks as cb
-from dqm.models import ApiCache, Check, CheckExecution, Status, Suite, SuiteExecution
+from dqm.checks.check_nbr_event_categories import CheckNbrEventCategories
+from dqm.checks.check_dummy import CheckDummy
+from dqm.checks.check_non_useful_parameters import CheckNonUsefulParameters
+from dqm.checks.check_pii import CheckPii
+from dqm.scheduler import Scheduler
+from dqm.worker import Worker
+from dqm.estimator import estimate
+from dqm.helpers import analytics
+from dqm.helpers.cron import CronExpression
+from dqm.helpers.service_accounts import (ServiceAccount, ServiceAccountPool,
+  current_account_id)
+from dqm.helpers.singleflight import SingleFlight
+from dqm.helpers.token_cache import TokenStore
+from dqm.helpers.timeout import Deadline
+from dqm.janitor import (get_purge_steps, purge_deleted_suites,
+  requeue_orphaned_executions)
+from dqm.retention import apply_retention, get_archive_path
+from dqm.models import (
+  ApiCache,
+  Check,
+  CheckExecution,
+  GaAccount,
+  GaParams,
+  GaProperty,
+  GaView,
+  Priority,
+  ResultChunk,
+  Schedule,
+  ScopeItem,
+  Status,
+  Suite,
+  SuiteExecution,
+  WorkItem,
+)
 
 class TestParameter(TestCase):
 
@@ -245,6 +291,1279 @@ class TestSuite(TestCase):
     self.assertEqual(se.success, True)
 
 
+class TestEstateMode(TestCase):
+
+  @mock.patch('dqm.helpers.analytics.get_row_counts')
+  def test_run_estate(self, get_counts):
+    get_counts.return_value = {'1': 10, '2': 3}
+    result = CheckNbrEventCategories().run_estate(params_list=[
+      {'viewId': '1', 'accountId': 'a', 'startDate': '2020-01-01',
+       'endDate': '2020-01-31'},
+      {'viewId': '2', 'accountId': 'b', 'startDate': '2020-01-01',
+       'endDate': '2020-01-31'},
+    ])
+    # Counts for both views are fetched in a single call.
+    get_counts.assert_called_once_with(view_ids=['1', '2'],
+      start_date=date(2020, 1, 1), end_date=date(2020, 1, 31),
+      dimensions=['ga:eventCategory'], metrics=['ga:totalEvents'],
+      account_ids={'1': 'a', '2': 'b'})
+    self.assertEqual(result.success, False)
+    # Every view is listed, failing ones are counted as problems.
+    self.assertEqual([(r['viewId'], r['nbr_event_categories'], r['passed'])
+      for r in result.payload], [('1', 10, True), ('2', 3, False)])
+    self.assertEqual(result.total_problems, 1)
+
+  @mock.patch('dqm.helpers.analytics.get_row_counts')
+  def test_suite_execute_estate_mode(self, get_counts):
+    get_counts.return_value = {'1': 10, '2': 10, '3': 10}
+    suite = Suite.objects.create()
+    GaParams.objects.create(suite=suite, scope_json=json.dumps([
+      {'accountId': 'a', 'webPropertyId': 'p', 'viewId': v}
+      for v in ('1', '2', '3')]))
+    Check.objects.create(suite=suite, name='CheckNbrEventCategories')
+
+    se = suite.execute()
+
+    # The whole scope is evaluated by a single check execution.
+    self.assertEqual(get_counts.call_count, 1)
+    self.assertEqual(se.check_executions.count(), 1)
+    self.assertEqual(se.success, True)
+
+
+class TestScope(TestCase):
+
+  def setUp(self):
+    self.suite = Suite.objects.create()
+    # Legacy scopes are moved to scope items on first access.
+    self.ga_params = GaParams.objects.create(suite=self.suite,
+      scope_json=json.dumps([
+        {'viewId': v, 'webPropertyId': p, 'accountId': 'a'}
+        for v, p in (('1', 'p1'), ('2', 'p1'), ('3', 'p2'))]))
+
+  def test_scope_levels(self):
+    self.assertEqual(self.ga_params.views, ['1', '2', '3'])
+    self.assertEqual(ScopeItem.objects.count(), 3)
+    self.assertEqual(self.ga_params.get_scope(ga_level='property'), [
+      {'webPropertyId': 'p1', 'accountId': 'a'},
+      {'webPropertyId': 'p2', 'accountId': 'a'}])
+    self.assertEqual(self.ga_params.get_scope(ga_level='account'),
+      [{'accountId': 'a'}])
+
+    self.ga_params.set_scope([
+      {'viewId': '4', 'webPropertyId': 'p3', 'accountId': 'b'}])
+    self.assertEqual(GaParams.objects.get(pk=self.ga_params.pk).scope, [
+      {'viewId': '4', 'webPropertyId': 'p3', 'accountId': 'b'}])
+    self.assertEqual(self.suite.account_ids, {'b'})
+
+  def test_reverse_lookup(self):
+    other = Suite.objects.create()
+    GaParams.objects.create(suite=other).set_scope([
+      {'viewId': '3', 'webPropertyId': 'p2', 'accountId': 'a'}])
+
+    self.assertEqual(set(Suite.covering(view_id='2')), {self.suite})
+    self.assertEqual(set(Suite.covering(property_id='p2')),
+      {self.suite, other})
+    response = self.client.get('/api/suites/', {'viewId': '3'}).json()
+    self.assertEqual({s['id'] for s in response['suites']},
+      {self.suite.id, other.id})
+
+
+class TestRowCount(TestCase):
+
+  @mock.patch('dqm.helpers.analytics.get_service')
+  def test_cardinality_only_request(self, get_service):
+    batch_get = get_service.return_value.reports.return_value.batchGet
+    batch_get.return_value.execute.return_value = {
+      'reports': [{'data': {'rowCount': 42, 'rows': [{}]}}]}
+
+    result = CheckNbrEventCategories().run(params={
+      'viewId': '1', 'startDate': '2020-01-01', 'endDate': '2020-01-31'})
+
+    # A single row is requested, the count is read from `rowCount`.
+    body = batch_get.call_args[1]['body']
+    self.assertEqual(body['reportRequests'][0]['pageSize'], 1)
+    self.assertEqual(result.success, True)
+
+  @mock.patch('dqm.helpers.analytics.batch_get')
+  def test_fetch_rows(self, batch_get):
+    batch_get.return_value = {'reports': [{'data': {'rows': [
+      {'dimensions': ['video'], 'metrics': [{'values': ['12']}]}]}}]}
+    report = cb.ReportRequest(dimensions=['ga:eventCategory'],
+      metrics=['ga:totalEvents'])
+    rows = CheckNbrEventCategories().fetch(report, params={'viewId': '1',
+      'startDate': date(2020, 1, 1), 'endDate': date(2020, 1, 31)})
+    self.assertEqual(rows, [
+      {'ga:eventCategory': 'video', 'ga:totalEvents': '12'}])
+    self.assertNotIn('pageSize', batch_get.call_args[0][0]['reportRequests'][0])
+
+
+class TestSingleFlight(TestCase):
+
+  def fan_out(self, func, nbr_threads=5):
+    results = []
+    errors = []
+
+    def target():
+      try:
+        results.append(func())
+      except Exception as e:
+        errors.append(e)
+
+    threads = [threading.Thread(target=target) for i in range(nbr_threads)]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    return results, errors
+
+  @mock.patch('dqm.helpers.analytics.get_service')
+  def test_identical_requests_coalesced(self, get_service):
+    in_flight = threading.Event()
+    release = threading.Event()
+
+    def execute():
+      in_flight.set()
+      release.wait(5)
+      return {'reports': [{'data': {'rowCount': 42}}]}
+
+    batch_get = get_service.return_value.reports.return_value.batchGet
+    batch_get.return_value.execute.side_effect = execute
+    threading.Timer(0.2, release.set).start()
+    results, errors = self.fan_out(lambda: analytics.get_row_count(
+      view_id='1', start_date=date(2020, 1, 1), end_date=date(2020, 1, 31),
+      dimensions=['ga:eventCategory'], metrics=['ga:totalEvents']))
+
+    self.assertEqual(results, [42] * 5)
+    self.assertEqual(batch_get.return_value.execute.call_count, 1)
+
+  def test_shared_response_is_frozen(self):
+    with mock.patch('dqm.helpers.analytics.get_service') as get_service:
+      batch_get = get_service.return_value.reports.return_value.batchGet
+      batch_get.return_value.execute.return_value = {'reports': [{}]}
+      response = analytics.batch_get({'reportRequests': []})
+    with self.assertRaises(TypeError):
+      response['reports'] = None
+
+  def test_errors_propagated_per_key(self):
+    flight = SingleFlight()
+    release = threading.Event()
+    threading.Timer(0.2, release.set).start()
+
+    def fail():
+      release.wait(5)
+      raise RuntimeError('quota exceeded')
+
+    results, errors = self.fan_out(lambda: flight.do('a', fail))
+    self.assertEqual(results, [])
+    self.assertEqual(len(errors), 5)
+    # Other keys, and later calls, are not affected.
+    self.assertEqual(flight.do('a', lambda: 1), 1)
+
+
+class TestServiceAccountPool(TestCase):
+
+  def setUp(self):
+    self.pool = ServiceAccountPool([
+      ServiceAccount('key-1.json', account_ids=['1']),
+      ServiceAccount('key-2.json', account_ids=['2']),
+      ServiceAccount('key-3.json'),
+      ServiceAccount('key-4.json'),
+    ])
+    self.sa1, self.sa2, self.sa3, self.sa4 = self.pool.service_accounts
+
+  def test_routing(self):
+    self.assertEqual(self.pool.acquire('1'), self.sa1)
+    self.assertEqual(self.pool.acquire('2'), self.sa2)
+    # Round-robin over unrestricted service accounts otherwise.
+    self.assertEqual([self.pool.acquire('5') for i in range(4)],
+      [self.sa3, self.sa4, self.sa3, self.sa4])
+    self.assertIn(self.pool.acquire(), [self.sa3, self.sa4])
+
+  def test_quota_exceeded(self):
+    error = HttpError(mock.Mock(status=429), b'rateLimitExceeded')
+    with self.assertRaises(HttpError):
+      with self.pool.use('5') as service_account:
+        raise error
+    self.assertFalse(service_account.healthy)
+    self.assertEqual(service_account.errors, 1)
+    other = self.sa4 if service_account == self.sa3 else self.sa3
+    self.assertEqual([self.pool.acquire('5') for i in range(2)], [other] * 2)
+
+  @mock.patch('django.conf.settings.GA_QUOTA_REQUESTS_PER_DAY', 2)
+  def test_daily_quota(self):
+    self.assertEqual([self.pool.acquire('1') for i in range(3)],
+      [self.sa1] * 3)
+    self.assertFalse(self.sa1.healthy)
+    self.assertEqual(self.sa1.to_dict()['requests'], 3)
+
+  def test_check_account_routing(self):
+    suite = Suite.objects.create()
+    check = Check.objects.create(suite=suite, name='CheckDummy')
+    se = SuiteExecution.objects.create(suite=suite)
+    account_ids = []
+    with mock.patch.object(CheckDummy, 'run',
+      side_effect=lambda params: account_ids.append(current_account_id.get())):
+      check.execute(suite_execution=se, extra_params={'accountId': '1'})
+    self.assertEqual(account_ids, ['1'])
+    self.assertIsNone(current_account_id.get())
+
+  @mock.patch('dqm.helpers.analytics.get_row_count')
+  def test_row_counts_account_routing(self, get_row_count):
+    get_row_count.side_effect = lambda view_id, **kwargs: (
+      current_account_id.get())
+    # Views of several accounts are queried in parallel, each one with its own
+    # account.
+    counts = analytics.get_row_counts(view_ids=['v1', 'v2', 'v3'],
+      start_date=date(2020, 1, 1), end_date=date(2020, 1, 31),
+      dimensions=[], metrics=[], account_ids={'v1': '1', 'v2': '2'})
+    self.assertEqual(counts, {'v1': '1', 'v2': '2', 'v3': None})
+    self.assertIsNone(current_account_id.get())
+
+
+class TestTokenCache(TestCase):
+
+  def setUp(self):
+    directory = tempfile.TemporaryDirectory()
+    self.addCleanup(directory.cleanup)
+    self.directory = directory.name
+
+  def credentials(self, access_token=None, expires_in=3600):
+    credentials = client.OAuth2Credentials(access_token=access_token,
+      client_id=None, client_secret=None, refresh_token=None,
+      token_expiry=datetime.utcnow() + timedelta(seconds=expires_in),
+      token_uri=None, user_agent=None)
+    TokenStore(credentials, key='key.json', directory=self.directory)
+    return credentials
+
+  def test_token_shared(self):
+    self.credentials(access_token='token-1').store.put(
+      self.credentials(access_token='token-1'))
+    other = self.credentials()
+    with mock.patch.object(other, '_do_refresh_request') as refresh:
+      other.get_access_token(http=mock.Mock())
+    refresh.assert_not_called()
+    self.assertEqual(other.access_token, 'token-1')
+
+  def test_expired_token_refreshed(self):
+    expired = self.credentials(access_token='token-1', expires_in=-60)
+    expired.store.put(expired)
+    other = self.credentials()
+    with mock.patch.object(other, '_do_refresh_request') as refresh:
+      other.get_access_token(http=mock.Mock())
+    refresh.assert_called_once()
+
+  @mock.patch('oauth2client.client.OAuth2Credentials.refresh')
+  def test_refresh_ahead(self, refresh):
+    service_account = ServiceAccount('key.json')
+    service_account._credentials = self.credentials(access_token='token-1',
+      expires_in=600)
+    service_account.refresh_ahead()
+    refresh.assert_not_called()
+    service_account._credentials.token_expiry = datetime.utcnow()
+    service_account.refresh_ahead()
+    while service_account._refreshing.is_set():
+      time.sleep(0.01)
+    refresh.assert_called_once()
+
+
+class TestProblems(TestCase):
+
+  def test_max_problems(self):
+    problems = cb.Problems(max_problems=3)
+    for row in problems.scan(range(100)):
+      problems.add(row)
+    result = problems.result()
+    # Only 3 problems are recorded, but all of them are counted.
+    self.assertEqual(len(result.payload), 3)
+    self.assertEqual(result.total_problems, 100)
+    self.assertEqual(result.estimated, False)
+    self.assertEqual(result.success, False)
+
+  def test_fail_fast(self):
+    problems = cb.Problems(fail_fast=True)
+    scanned = []
+    for row in problems.scan(range(100)):
+      scanned.append(row)
+      problems.add(row)
+    # Scanning stops after the first problem, the total is extrapolated.
+    self.assertEqual(scanned, [0])
+    self.assertEqual(problems.result().total_problems, 100)
+    self.assertEqual(problems.result().estimated, True)
+
+  def test_fail_fast_unknown_length(self):
+    problems = cb.Problems(max_problems=2, fail_fast=True)
+    for row in problems.scan(i for i in range(100)):
+      problems.add(row)
+    # Rows cannot be counted: the total is not extrapolated, only a minimum.
+    result = problems.result()
+    self.assertEqual(result.total_problems, 2)
+    self.assertEqual(result.estimated, False)
+    self.assertEqual(result.total_is_lower_bound, True)
+
+  def test_no_problem(self):
+    problems = cb.Problems(max_problems=3, fail_fast=True)
+    for row in problems.scan(range(100)):
+      pass
+    self.assertEqual(problems.result().success, True)
+    self.assertEqual(problems.result().total_problems, 0)
+
+  @mock.patch('dqm.helpers.analytics.get_url_parameters')
+  def test_check_pii_max_problems(self, get_url_parameters):
+    get_url_parameters.return_value = [
+      {'url': '/?name={}'.format(i), 'params': {'name': [i]}}
+      for i in range(50)]
+    result = CheckPii().run(params={
+      'viewId': '1', 'startDate': '2020-01-01', 'endDate': '2020-01-31',
+      'max_problems': 10})
+    self.assertEqual(len(result.payload), 10)
+    self.assertEqual(result.total_problems, 50)
+
+
+class TestAggregatedProblems(TestCase):
+
+  def test_heavy_hitters_bounded(self):
+    hh = cb.HeavyHitters(capacity=10)
+    for i in range(1000):
+      hh.add('frequent' if i % 2 else 'rare-{}'.format(i))
+    self.assertEqual(len(hh.counters), 10)
+    self.assertEqual(hh.top(1)[0]['key'], 'frequent')
+
+  def test_aggregate(self):
+    problems = cb.AggregatedProblems(group_by='param', hits_field='hits',
+      top_k=2)
+    for i in range(10):
+      problems.add({'url': '/{}'.format(i), 'param': 'email' if i < 7
+        else 'name', 'hits': 1})
+    result = problems.result()
+    self.assertIsInstance(result, cb.AggregatedResult)
+    self.assertEqual(result.total_problems, 10)
+    self.assertEqual([(g['group'], g['count'], g['hits'])
+      for g in result.payload], [('email', 7, 7), ('name', 3, 3)])
+    self.assertEqual(len(result.payload[0]['examples']), 2)
+
+  @mock.patch('dqm.helpers.analytics.get_url_parameters')
+  def test_check_pii_aggregate(self, get_url_parameters):
+    get_url_parameters.return_value = [
+      {'url': '/?name={}'.format(i), 'params': {'name': [i]}}
+      for i in range(50)]
+    result = CheckPii().run(params={
+      'viewId': '1', 'startDate': '2020-01-01', 'endDate': '2020-01-31',
+      'aggregate': True})
+    self.assertEqual(result.group_by, 'param')
+    self.assertEqual(len(result.payload), 1)
+    self.assertEqual(result.payload[0]['count'], 50)
+
+  def test_summarize(self):
+    result = {'group_by': 'param', 'payload': [
+      {'group': 'name', 'count': 1, 'examples': [{'url': '/'}]}]}
+    self.assertEqual(cb.AggregatedResult.summarize(result)['payload'],
+      [{'group': 'name', 'count': 1}])
+
+
+class TestStreamedResult(TestCase):
+
+  class CheckStreamed(cb.Check):
+    title = 'Streamed'
+    description = 'Yield result rows'
+    result_fields = [
+      cb.ResultField(name='row', data_type=cb.DataType.INT),
+    ]
+
+    def run(self, params):
+      for i in range(params.get('nbr_rows', 0)):
+        yield {'row': i}
+
+  def execute(self, nbr_rows):
+    suite = Suite.objects.create()
+    check = Check.objects.create(suite=suite, name='CheckStreamed')
+    se = SuiteExecution.objects.create(suite=suite, executed=timezone.now())
+    with mock.patch.object(Check, 'check_class', new_callable=mock.PropertyMock,
+        return_value=self.CheckStreamed):
+      return check.execute(suite_execution=se,
+        extra_params={'nbr_rows': nbr_rows})
+
+  @mock.patch('django.conf.settings.RESULT_CHUNK_SIZE', 10)
+  def test_streamed_rows(self):
+    ce = self.execute(nbr_rows=25)
+    self.assertEqual(ce.status, Status.Done)
+    self.assertEqual(ce.success, False)
+    self.assertEqual(ResultChunk.objects.filter(check_execution=ce).count(), 3)
+    result = ce.get_result()
+    self.assertEqual(result['total_problems'], 25)
+    self.assertEqual(result['chunks'], 3)
+    # Only the first chunk is inlined in the result.
+    self.assertEqual(result['payload'], [{'row': i} for i in range(10)])
+    self.assertEqual(ce.get_payload_chunk(index=2), [
+      {'row': i} for i in range(20, 25)])
+    url = '/api/checkexecutions/{}/payload'.format(ce.id)
+    self.assertEqual(len(self.client.get(url, {'chunk': 1}).json()['payload']),
+      10)
+    self.assertEqual(self.client.get(url, {'chunk': 'a'}).status_code, 400)
+
+  @mock.patch('django.conf.settings.RESULT_CHUNK_SIZE', 10)
+  def test_streamed_reused(self):
+    previous = self.execute(nbr_rows=25)
+    ce = CheckExecution.objects.create(check_ref=previous.check_ref)
+    ce.reuse(previous)
+    self.assertEqual(ce.get_result(), previous.get_result())
+    self.assertEqual(ce.get_payload_chunk(index=2), [
+      {'row': i} for i in range(20, 25)])
+
+  def test_streamed_no_rows(self):
+    ce = self.execute(nbr_rows=0)
+    self.assertEqual(ce.success, True)
+    self.assertEqual(ce.get_result()['payload'], [])
+
+
+class TestCronExpression(TestCase):
+
+  def test_next_after(self):
+    cron = CronExpression('30 2 * * 1-5')
+    # 2020-01-03 is a friday, next run is on monday.
+    self.assertEqual(cron.next_after(datetime(2020, 1, 3, 3, 0)),
+      datetime(2020, 1, 6, 2, 30))
+
+  def test_bad_expression(self):
+    with self.assertRaises(errors.BadCronExpressionError):
+      CronExpression('61 * * * *')
+
+
+class TestScheduler(TestCase):
+
+  def create_suite(self, account_id):
+    suite = Suite.objects.create()
+    GaParams.objects.create(suite=suite, scope_json=json.dumps([
+      {'accountId': account_id, 'webPropertyId': 'p', 'viewId': 'v'}]))
+    Schedule.objects.create(suite=suite, interval=3600, jitter=0,
+      next_run=timezone.now() - timedelta(days=1))
+    return suite
+
+  def tick(self, scheduler):
+    # Executions are not actually started.
+    with mock.patch.object(scheduler, 'executor'):
+      return scheduler.tick()
+
+  def test_missed_runs_coalesced(self):
+    suite = self.create_suite(account_id='a')
+    started = self.tick(Scheduler(max_runs=10, max_runs_per_account=10))
+    self.assertEqual(len(started), 1)
+    # Next run is computed from now, 24 missed runs are not replayed.
+    schedule = suite.schedules.get()
+    self.assertGreater(schedule.next_run, timezone.now())
+
+  def test_update_schedules(self):
+    suite = self.create_suite(account_id='a')
+    url = '/api/suites/{}'.format(suite.id)
+    for schedules in ([{}], [{'cron': 'bad'}], [{'cron': '0 3 * * *',
+        'interval': 3600}], [{'cron': '0 0 31 2 *'}], ['bad']):
+      response = self.client.put(url, json.dumps({'schedules': schedules}),
+        content_type='application/json')
+      self.assertEqual(response.status_code, 400)
+    # Schedules are left untouched if any is invalid.
+    self.assertEqual(suite.schedules.get().interval, 3600)
+    self.client.put(url, json.dumps({'schedules': [{'cron': '0 3 * * *'}]}),
+      content_type='application/json')
+    self.assertEqual(suite.schedules.get().cron, '0 3 * * *')
+
+  def test_concurrency_limits(self):
+    self.create_suite(account_id='a')
+    self.create_suite(account_id='a')
+    self.create_suite(account_id='b')
+    self.create_suite(account_id='c')
+    scheduler = Scheduler(max_runs=2, max_runs_per_account=1)
+    started = self.tick(scheduler)
+    self.assertEqual(len(started), 2)
+    self.assertEqual(len({se.suite.account_ids.pop() for se in started}), 2)
+    # Limits are reached, nothing else can start until executions are done.
+    self.assertEqual(self.tick(scheduler), [])
+    SuiteExecution.objects.filter(status=Status.Running).update(
+      status=Status.Done)
+    self.assertEqual(len(self.tick(scheduler)), 2)
+
+  def test_interactive_first(self):
+    self.create_suite(account_id='a')
+    scheduler = Scheduler(max_runs=1, max_runs_per_account=1)
+    scheduler.enqueue(now=timezone.now())
+    interactive_suite = Suite.objects.create()
+    SuiteExecution.objects.create(suite=interactive_suite,
+      priority=Priority.Interactive)
+    started = self.tick(scheduler)
+    self.assertEqual([se.suite for se in started], [interactive_suite])
+
+  @mock.patch('django.conf.settings.SCHEDULER_ACCOUNT_WEIGHTS', {'b': 2})
+  def test_weighted_fair_queuing(self):
+    scheduler = Scheduler(max_runs=1, max_runs_per_account=1)
+    dispatched = []
+    for account_id in ('a', 'a', 'a', 'b', 'b', 'b'):
+      suite = Suite.objects.create()
+      GaParams.objects.create(suite=suite, scope_json=json.dumps([
+        {'accountId': account_id, 'webPropertyId': 'p', 'viewId': 'v'}]))
+      SuiteExecution.objects.create(suite=suite, priority=Priority.Batch)
+    for i in range(6):
+      dispatched += [se.suite.account_ids.pop() for se in self.tick(scheduler)]
+      SuiteExecution.objects.filter(status=Status.Running).update(
+        status=Status.Done)
+    # Account "b" has twice the weight of account "a".
+    self.assertEqual(dispatched[:3].count('b'), 2)
+
+  def test_preempted_not_dispatched(self):
+    self.create_suite(account_id='a')
+    scheduler = Scheduler(max_runs=2, max_runs_per_account=2)
+    [se] = self.tick(scheduler)
+    virtual_time = scheduler.virtual_times['a']
+    # The execution is preempted by an interactive one, and queued again.
+    SuiteExecution.objects.filter(id=se.id).update(status=Status.Created)
+    interactive = SuiteExecution.objects.create(suite=Suite.objects.create(),
+      priority=Priority.Interactive)
+    self.assertEqual(self.tick(scheduler), [interactive])
+    self.assertEqual(self.tick(scheduler), [])
+    SuiteExecution.objects.filter(id=interactive.id).update(
+      status=Status.Done)
+    self.assertEqual(self.tick(scheduler), [se])
+    # The execution is only charged once.
+    self.assertEqual(scheduler.virtual_times['a'], virtual_time)
+
+  def test_preemption(self):
+    suite = Suite.objects.create()
+    Check.objects.create(suite=suite, name='CheckDummy')
+    Check.objects.create(suite=suite, name='CheckDummy')
+    se = SuiteExecution.objects.create(suite=suite, priority=Priority.Batch)
+    # An interactive execution is in flight after the first check.
+    preempt = mock.Mock(side_effect=[False, True])
+    suite.execute(suite_execution=se, preempt=preempt)
+    self.assertEqual(se.status, Status.Created)
+    self.assertEqual(se.check_executions.count(), 1)
+    # The execution is resumed where it stopped.
+    suite.execute(suite_execution=se)
+    self.assertEqual(se.check_executions.count(), 2)
+    self.assertEqual(se.status, Status.Done)
+
+
+class TestWorker(TestCase):
+
+  def create_suite_execution(self, nbr_views):
+    suite = Suite.objects.create()
+    GaParams.objects.create(suite=suite, scope_json=json.dumps([
+      {'accountId': 'a', 'webPropertyId': 'p', 'viewId': str(v)}
+      for v in range(nbr_views)]))
+    Check.objects.create(suite=suite, name='CheckDummy')
+    Check.objects.create(suite=suite, name='CheckPii')
+    return suite.execute(distributed=True)
+
+  def test_plan(self):
+    se = self.create_suite_execution(nbr_views=3)
+    # 1 work item for the dummy check, 1 per view for the GA check.
+    self.assertEqual(se.work_items.count(), 4)
+    self.assertEqual(se.status, Status.Running)
+    self.assertEqual(se.check_executions.count(), 0)
+
+  def test_claim(self):
+    self.create_suite_execution(nbr_views=1)
+    item_1 = WorkItem.claim(owner='worker-1')
+    item_2 = WorkItem.claim(owner='worker-2')
+    self.assertNotEqual(item_1, item_2)
+    self.assertEqual(item_1.lease_owner, 'worker-1')
+    self.assertIsNone(WorkItem.claim(owner='worker-3'))
+
+  def test_expired_lease_reclaimed(self):
+    self.create_suite_execution(nbr_views=0)
+    item = WorkItem.claim(owner='worker-1')
+    self.assertIsNone(WorkItem.claim(owner='worker-2'))
+    WorkItem.objects.filter(id=item.id).update(
+      lease_expires=timezone.now() - timedelta(seconds=1))
+    self.assertFalse(item.heartbeat(owner='worker-2'))
+    item = WorkItem.claim(owner='worker-2')
+    self.assertEqual(item.lease_owner, 'worker-2')
+    self.assertEqual(item.attempts, 2)
+    self.assertFalse(item.heartbeat(owner='worker-1'))
+
+  def test_lost_lease_not_finished(self):
+    se = self.create_suite_execution(nbr_views=0)
+    stale_item = WorkItem.claim(owner='worker-1')
+    WorkItem.objects.filter(id=stale_item.id).update(
+      lease_expires=timezone.now() - timedelta(seconds=1))
+    item = WorkItem.claim(owner='worker-2')
+    # The first worker finishes late: its result is not attached...
+    ce = stale_item.check_ref.execute(suite_execution=se, work_item=stale_item)
+    ce.refresh_from_db()
+    self.assertIsNone(ce.suite_execution)
+    self.assertEqual(se.check_executions.count(), 0)
+    # ...and the lease of the second worker is kept.
+    item.refresh_from_db()
+    self.assertEqual(item.status, Status.Running)
+    self.assertEqual(item.lease_owner, 'worker-2')
+    self.assertIsNone(item.check_execution)
+
+  @mock.patch('dqm.helpers.analytics.get_url_parameters')
+  def test_finalized_by_last_item(self, get_url_parameters):
+    get_url_parameters.return_value = []
+    se = self.create_suite_execution(nbr_views=2)
+    worker = Worker(name='worker')
+    for i in range(2):
+      worker.run_once()
+      se.refresh_from_db()
+      self.assertEqual(se.status, Status.Running)
+    worker.run(burst=True)
+    se.refresh_from_db()
+    self.assertEqual(se.status, Status.Done)
+    self.assertEqual(se.success, True)
+    self.assertEqual(se.check_executions.count(), 3)
+
+
+@mock.patch('dqm.helpers.analytics.get_url_parameters')
+class TestDependencies(TestCase):
+
+  def setUp(self):
+    self.suite = Suite.objects.create()
+    GaParams.objects.create(suite=self.suite, scope_json=json.dumps([
+      {'accountId': 'a', 'webPropertyId': 'p', 'viewId': str(v)}
+      for v in range(2)]))
+    Check.objects.create(suite=self.suite, name='CheckNonUsefulParameters')
+    Check.objects.create(suite=self.suite, name='CheckPii')
+
+  def test_outputs_reused(self, get_url_parameters):
+    get_url_parameters.return_value = [{'url': '/?fbclid=1',
+                                        'params': {'fbclid': ['1']}}]
+    se = self.suite.execute()
+    self.assertEqual(se.status, Status.Done)
+    # URL parameters are fetched once per view, by `CheckPii`.
+    self.assertEqual(get_url_parameters.call_count, 2)
+    for item in se.work_items.filter(
+        check_ref__name='CheckNonUsefulParameters'):
+      self.assertEqual([i.params for i in item.depends_on.all()],
+        [item.params])
+      self.assertEqual(item.check_execution.result['total_problems'], 1)
+
+  def test_outputs_released(self, get_url_parameters):
+    get_url_parameters.return_value = [{'url': '/?fbclid=1',
+                                        'params': {'fbclid': ['1']}}]
+    se = self.suite.execute(distributed=True)
+    outputs = {}
+    nbr_outputs = []
+    while True:
+      item = WorkItem.claim(owner='worker', suite_execution=se)
+      if not item:
+        break
+      item.execute(owner='worker', outputs=outputs)
+      nbr_outputs.append(len(outputs))
+    # Outputs are dropped once the items depending on them are done.
+    self.assertEqual(nbr_outputs, [1, 0, 1, 0])
+    self.assertEqual(outputs, {})
+
+  def test_failed_dependency_skipped(self, get_url_parameters):
+    def fetch(view_id, start_date, end_date):
+      if view_id == '0':
+        raise RuntimeError()
+      return []
+    get_url_parameters.side_effect = fetch
+    with mock.patch.object(CheckNonUsefulParameters, 'depends_on',
+        [cb.Dependency(check='CheckPii')]):
+      se = self.suite.execute()
+    self.assertEqual(se.status, Status.Done)
+    self.assertEqual(se.success, False)
+    skipped = se.work_items.get(status=Status.Skipped)
+    self.assertEqual(skipped.check_ref.name, 'CheckNonUsefulParameters')
+    self.assertEqual(skipped.params['viewId'], '0')
+    self.assertEqual(se.check_executions.count(), 3)
+
+  def test_cycle(self, get_url_parameters):
+    with mock.patch.object(CheckPii, 'depends_on',
+        [cb.Dependency(check='CheckNonUsefulParameters')]):
+      with self.assertRaises(errors.DependencyCycleError):
+        self.suite.execute()
+
+
+@mock.patch('dqm.helpers.analytics.get_url_parameters')
+class TestReuse(TestCase):
+
+  def setUp(self):
+    self.suite = Suite.objects.create()
+    self.ga_params = GaParams.objects.create(suite=self.suite,
+      scope_json=json.dumps([
+        {'accountId': 'a', 'webPropertyId': 'p', 'viewId': '1'}]),
+      start_date=date(2020, 1, 1))
+    # End date is set to today on creation.
+    self.ga_params.end_date = date(2020, 1, 31)
+    self.ga_params.save()
+    self.check = Check.objects.create(suite=self.suite, name='CheckPii')
+
+  def test_reused(self, get_url_parameters):
+    get_url_parameters.return_value = [{'url': '/?name=1',
+                                        'params': {'name': ['1']}}]
+    first = self.suite.execute().check_executions.get()
+    ce = self.suite.execute().check_executions.get()
+    self.assertEqual(get_url_parameters.call_count, 1)
+    self.assertTrue(ce.reused)
+    self.assertEqual(ce.input_hash, first.input_hash)
+    self.assertEqual(ce.get_result(), first.get_result())
+    self.assertEqual(ce.success, False)
+
+  def test_compacted_not_reused(self, get_url_parameters):
+    get_url_parameters.return_value = [{'url': '/?name=1',
+                                        'params': {'name': ['1']}}]
+    self.suite.execute()
+    CheckExecution.objects.update(compacted=True)
+    ce = self.suite.execute().check_executions.get()
+    self.assertEqual(get_url_parameters.call_count, 2)
+    self.assertFalse(ce.reused)
+    self.assertEqual(len(ce.get_result()['payload']), 1)
+
+  def test_inputs_changed(self, get_url_parameters):
+    get_url_parameters.return_value = []
+    self.suite.execute()
+    self.check.params_json = json.dumps({'blackList': ['email']})
+    self.check.save()
+    self.suite.execute()
+    with mock.patch.object(CheckPii, 'version', 2):
+      self.suite.execute()
+    self.assertEqual(get_url_parameters.call_count, 3)
+
+  def test_open_range_or_forced(self, get_url_parameters):
+    get_url_parameters.return_value = []
+    self.suite.execute()
+    self.suite.execute(force=True)
+    self.ga_params.end_date = date.today()
+    self.ga_params.save()
+    self.suite.execute()
+    self.suite.execute()
+    self.assertEqual(get_url_parameters.call_count, 4)
+
+
+@mock.patch('dqm.helpers.analytics.get_url_parameters')
+class TestResultDelta(TestCase):
+
+  def setUp(self):
+    self.suite = Suite.objects.create()
+    GaParams.objects.create(suite=self.suite).set_scope([
+      {'accountId': 'a', 'webPropertyId': 'p', 'viewId': '1'}])
+    Check.objects.create(suite=self.suite, name='CheckPii')
+
+  def execute(self, get_url_parameters, names):
+    get_url_parameters.return_value = [{'url': '/?name={}'.format(n),
+      'params': {'name': [n]}} for n in names]
+    return self.suite.execute().check_executions.get()
+
+  @mock.patch('django.conf.settings.RESULT_SNAPSHOT_INTERVAL', 3)
+  def test_delta(self, get_url_parameters):
+    first = self.execute(get_url_parameters, ['1', '2'])
+    self.assertEqual(first.get_delta()['previous'], None)
+    self.assertEqual(len(first.get_delta()['added']), 2)
+
+    executions = [self.execute(get_url_parameters, names)
+                  for names in (['2', '3'], ['3'], ['3', '4'])]
+    self.assertEqual([ce.delta_depth for ce in executions], [1, 2, 0])
+    # Only the delta is stored, unless a snapshot is due.
+    self.assertEqual(executions[1].result['payload'], [])
+    self.assertEqual(executions[1].result['total_problems'], 1)
+
+    response = self.client.get('/api/checkexecutions/{}/delta'.format(
+      executions[0].id)).json()
+    self.assertEqual(response['previous'], first.id)
+    self.assertEqual([r['url'] for r in response['added']], ['/?name=3'])
+    self.assertEqual([r['url'] for r in response['resolved']], ['/?name=1'])
+    self.assertEqual([r['url'] for r in executions[1].get_result()['payload']],
+      ['/?name=3'])
+
+  def test_capped_not_compared(self, get_url_parameters):
+    self.execute(get_url_parameters, ['1', '2'])
+    with mock.patch.object(CheckPii, 'run', return_value=cb.Result(
+        success=False, payload=[{'url': '/?name=2'}], total_problems=2)):
+      capped = self.suite.execute().check_executions.get()
+    ce = self.execute(get_url_parameters, ['2', '3'])
+    # Problems beyond the cap would be reported as resolved, then new again.
+    for ce in (capped, ce):
+      self.assertEqual(ce.delta_depth, 0)
+      self.assertFalse(ce.get_delta()['available'])
+    self.assertEqual(len(capped.get_result()['payload']), 1)
+
+  @mock.patch('django.conf.settings.RESULT_SNAPSHOT_INTERVAL', 10)
+  def test_previous_prefetched(self, get_url_parameters):
+    for names in (['1'], ['1', '2'], ['2'], ['2', '3'], ['3']):
+      self.execute(get_url_parameters, names)
+    executions = list(CheckExecution.objects.order_by('id'))
+    # One query per level of deltas, without further ones to rebuild payloads.
+    with self.assertNumQueries(3):
+      CheckExecution.prefetch_previous(executions[-2:])
+      payloads = [ce.get_result()['payload'] for ce in executions[-2:]]
+    self.assertEqual([[r['url'] for r in p] for p in payloads],
+      [['/?name=2', '/?name=3'], ['/?name=3']])
+
+  def test_previous_deleted(self, get_url_parameters):
+    first = self.execute(get_url_parameters, ['1', '2'])
+    second = self.execute(get_url_parameters, ['2', '3'])
+    CheckExecution.materialize_dependents([first.id])
+    first.delete()
+    second.refresh_from_db()
+    self.assertEqual(second.delta_depth, 0)
+    self.assertEqual(len(second.get_result()['payload']), 2)
+
+
+@mock.patch('dqm.helpers.analytics.get_url_parameters')
+class TestFailFast(TestCase):
+
+  def setUp(self):
+    self.suite = Suite.objects.create(fail_fast=True)
+    GaParams.objects.create(suite=self.suite, scope_json=json.dumps([
+      {'accountId': 'a', 'webPropertyId': 'p', 'viewId': '1'}]))
+    self.pii = Check.objects.create(suite=self.suite, name='CheckPii')
+    self.dummy = Check.objects.create(suite=self.suite, name='CheckDummy')
+    # `CheckPii` has been slower than `CheckDummy` so far.
+    CheckExecution.objects.create(check_ref=self.pii, duration=10)
+    CheckExecution.objects.create(check_ref=self.dummy, duration=0.1)
+
+  def test_expected_durations(self, get_url_parameters):
+    CheckExecution.objects.create(check_ref=self.pii, duration=20)
+    self.assertEqual(CheckExecution.get_expected_durations(
+      check_names=['CheckPii', 'CheckDummy', 'CheckTrafficOrigin']),
+      {'CheckPii': 15, 'CheckDummy': 0.1})
+
+  def test_stops_at_first_failure(self, get_url_parameters):
+    with mock.patch.object(CheckDummy, 'run',
+        return_value=cb.Result(success=False, payload=[{}])):
+      se = self.suite.execute()
+    self.assertEqual(se.status, Status.Done)
+    self.assertEqual(se.success, False)
+    # The cheapest check was executed first, the other one was cancelled.
+    get_url_parameters.assert_not_called()
+    self.assertEqual(se.work_items.get(check_ref=self.pii).status,
+      Status.Cancelled)
+
+  def test_disabled(self, get_url_parameters):
+    get_url_parameters.return_value = []
+    with mock.patch.object(CheckDummy, 'run',
+        return_value=cb.Result(success=False, payload=[{}])):
+      se = self.suite.execute(fail_fast=False)
+    self.assertEqual(se.success, False)
+    get_url_parameters.assert_called_once()
+
+
+class TestEstimator(TestCase):
+
+  def setUp(self):
+    self.suite = Suite.objects.create()
+    GaParams.objects.create(suite=self.suite, scope_json=json.dumps([
+      {'accountId': 'a', 'webPropertyId': 'p', 'viewId': str(v)}
+      for v in range(2)]))
+    pii = Check.objects.create(suite=self.suite, name='CheckPii')
+    Check.objects.create(suite=self.suite, name='CheckNonUsefulParameters')
+    Check.objects.create(suite=self.suite, name='CheckNbrEventCategories')
+    CheckExecution.objects.create(check_ref=pii, duration=2)
+
+  def test_estimate(self):
+    result = estimate(self.suite)
+    self.assertEqual(result['workItems'], 5)
+    # Both checks of URL parameters rely on the same report.
+    self.assertEqual(result['apiCalls'], 4)
+    self.assertEqual(result['apiCallsPerView'], {'0': 2, '1': 2})
+    self.assertFalse(result['quotaExceeded'])
+    self.assertIsNone(result['rows'])
+    self.assertEqual(result['duration'], 4)
+    self.assertEqual(result['checksWithoutHistory'],
+      ['CheckNbrEventCategories', 'CheckNonUsefulParameters'])
+    # Nothing has been executed.
+    self.assertFalse(self.suite.executions.exists())
+
+  @mock.patch('dqm.helpers.analytics.get_row_counts')
+  def test_count_rows(self, get_row_counts):
+    get_row_counts.return_value = {'0': 100, '1': 50}
+    response = self.client.get('/api/suites/{}/estimate?rows=1'.format(
+      self.suite.id))
+    # 150 URLs, and 1 row per event categories count.
+    self.assertEqual(response.json()['estimate']['rows'], 152)
+    get_row_counts.assert_called_once()
+
+
+class TestRetention(TestCase):
+
+  def setUp(self):
+    directory = tempfile.TemporaryDirectory()
+    self.addCleanup(directory.cleanup)
+    patcher = mock.patch.multiple('django.conf.settings',
+      ARCHIVE_DIR=directory.name, RETENTION_BATCH_SIZE=2)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+    self.suite = Suite.objects.create(detail_retention_days=10,
+      summary_retention_days=100)
+    check = Check.objects.create(suite=self.suite, name='CheckDummy')
+    for days in (1, 20, 20, 200, 200, 200):
+      se = SuiteExecution.objects.create(suite=self.suite, status=Status.Done)
+      ce = CheckExecution.objects.create(suite_execution=se, check_ref=check,
+        status=Status.Done, success=False, result_json=json.dumps(
+          {'success': False, 'payload': [{'a': 1}, {'a': 2}]}))
+      ResultChunk.objects.create(check_execution=ce, index=0,
+        payload_json='[]')
+      created = timezone.now() - timedelta(days=days)
+      SuiteExecution.objects.filter(pk=se.pk).update(created=created)
+      CheckExecution.objects.filter(pk=ce.pk).update(created=created)
+
+  def test_apply_retention(self):
+    self.assertEqual(apply_retention(),
+      {self.suite.id: {'compacted': 5, 'archived': 3}})
+    self.assertEqual(SuiteExecution.objects.count(), 3)
+    self.assertEqual(ResultChunk.objects.count(), 1)
+
+    recent, old = CheckExecution.objects.order_by('-created')[:2]
+    self.assertEqual(len(recent.get_result()['payload']), 2)
+    self.assertEqual(old.get_result()['payload'], [])
+    self.assertEqual(old.get_result()['total_problems'], 2)
+
+    with gzip.open(get_archive_path(self.suite), 'rt') as f:
+      archived = [json.loads(line) for line in f]
+    self.assertEqual(len(archived), 3)
+    self.assertEqual(archived[0]['checkExecutions'][0]['result'][
+      'total_problems'], 2)
+
+    # Nothing left to do.
+    self.assertEqual(apply_retention(),
+      {self.suite.id: {'compacted': 0, 'archived': 0}})
+
+  def test_archive_interrupted(self):
+    path = get_archive_path(self.suite)
+    with mock.patch('dqm.retention.delete_suite_executions',
+        side_effect=RuntimeError()):
+      with self.assertRaises(RuntimeError):
+        apply_retention()
+    # A batch written but not recorded (e.g. process killed meanwhile).
+    with gzip.open(path, 'at') as f:
+      f.write('{}\n')
+    apply_retention()
+    with gzip.open(path, 'rt') as f:
+      archived = [json.loads(line) for line in f]
+    self.assertEqual(len({se['id'] for se in archived}), 3)
+    self.assertEqual(len(archived), 3)
+
+  def test_keep_forever(self):
+    self.suite.detail_retention_days = 0
+    self.suite.summary_retention_days = 0
+    self.suite.save()
+    self.assertEqual(apply_retention(),
+      {self.suite.id: {'compacted': 0, 'archived': 0}})
+
+
+class TestSuiteDeletion(TestCase):
+
+  def create_suite(self):
+    suite = Suite.objects.create()
+    GaParams.objects.create(suite=suite).set_scope([
+      {'viewId': '1', 'webPropertyId': 'p', 'accountId': 'a'}])
+    Check.objects.create(suite=suite, name='CheckDummy')
+    Check.objects.create(suite=suite, name='CheckDummy')
+    Schedule.objects.create(suite=suite, interval=3600)
+    suite.execute()
+    return suite
+
+  def test_delete_suite(self):
+    suite = self.create_suite()
+    other = self.create_suite()
+    # Executions reference previous ones (see `CheckExecution.store_result`).
+    suite.execute()
+    self.assertTrue(CheckExecution.objects.filter(check_ref__suite=suite,
+      previous__isnull=False).exists())
+    self.client.delete('/api/suites/{}'.format(suite.id))
+
+    response = self.client.get('/api/suites/').json()
+    self.assertEqual([s['id'] for s in response['suites']], [other.id])
+    self.assertEqual(self.client.get(
+      '/api/suites/{}'.format(suite.id)).status_code, 404)
+    self.assertFalse(Schedule.objects.get(suite_id=suite.id).active)
+
+    with mock.patch('django.conf.settings.PURGE_BATCH_SIZE', 1):
+      # The purge is bounded, and goes on at the next call.
+      self.assertEqual(purge_deleted_suites(max_batches=3), 3)
+      purge_deleted_suites()
+    self.assertFalse(Suite.all_objects.filter(pk=suite.id).exists())
+    self.assertFalse(CheckExecution.objects.filter(
+      check_ref__suite_id=suite.id).exists())
+    self.assertEqual(other.executions.get().check_executions.count(), 2)
+    self.assertEqual(ScopeItem.objects.count(), 1)
+
+  def test_purge_count(self):
+    suites = [self.create_suite(), self.create_suite()]
+    self.create_suite()
+    counts = []
+    for suite in suites:
+      suite.soft_delete()
+      counts.append(sum(queryset.count() for queryset, values
+        in get_purge_steps(suite.id) if not values))
+    with self.assertLogs('dqm.janitor', level='INFO') as logs:
+      self.assertEqual(purge_deleted_suites(), sum(counts))
+    # Rows are logged per suite.
+    self.assertEqual(logs.output, [
+      'INFO:dqm.janitor:Purged {} rows of deleted suite {}'.format(count,
+        suite.id) for count, suite in zip(counts, suites)])
+    self.assertEqual(purge_deleted_suites(), 0)
+
+  def test_running_executions_cancelled(self):
+    suite = Suite.objects.create()
+    se = SuiteExecution.objects.create(suite=suite, status=Status.Running)
+    suite.soft_delete()
+    se.refresh_from_db()
+    self.assertEqual(se.status, Status.Cancelled)
+
+
+class TestResume(TestCase):
+
+  def setUp(self):
+    self.suite = Suite.objects.create()
+    for i in range(3):
+      Check.objects.create(suite=self.suite, name='CheckDummy')
+
+  def crash(self, nbr_items_done):
+    """Simulate a crash after some work items have been executed.
+    """
+    se = self.suite.execute(distributed=True)
+    for i in range(nbr_items_done):
+      WorkItem.claim(owner='dead').execute(owner='dead')
+    WorkItem.claim(owner='dead')
+    WorkItem.objects.filter(status=Status.Running).update(
+      lease_expires=timezone.now() - timedelta(seconds=1))
+    SuiteExecution.objects.filter(id=se.id).update(
+      updated=timezone.now() - timedelta(days=1))
+    return SuiteExecution.objects.get(id=se.id)
+
+  def test_resume(self):
+    se = self.crash(nbr_items_done=1)
+    with mock.patch.object(Check, 'execute', autospec=True,
+        side_effect=Check.execute) as execute:
+      se = se.resume()
+    # Only the 2 missing checks are executed.
+    self.assertEqual(execute.call_count, 2)
+    self.assertEqual(se.status, Status.Done)
+    self.assertEqual(se.success, True)
+
+  def test_resume_failed(self):
+    se = self.suite.execute()
+    item = se.work_items.first()
+    item.status = Status.Failed
+    item.save()
+    with mock.patch.object(Check, 'execute', autospec=True,
+        side_effect=Check.execute) as execute:
+      se.resume()
+    self.assertEqual(execute.call_count, 1)
+
+  def test_janitor(self):
+    se = self.crash(nbr_items_done=2)
+    # A live execution (of another suite) is left untouched.
+    live_suite = Suite.objects.create()
+    Check.objects.create(suite=live_suite, name='CheckDummy')
+    live_se = live_suite.execute(distributed=True)
+    self.assertEqual(list(SuiteExecution.get_orphaned()), [se])
+
+    self.assertEqual(requeue_orphaned_executions(), [se])
+    se.refresh_from_db()
+    self.assertEqual(se.status, Status.Created)
+    self.assertEqual(se.work_items.filter(status=Status.Created).count(), 1)
+    live_se.refresh_from_db()
+    self.assertEqual(live_se.status, Status.Running)
+
+  def test_janitor_claimable_items(self):
+    # Items left to claim are picked up by workers, not by the janitor.
+    se = self.crash(nbr_items_done=1)
+    self.assertEqual(se.work_items.filter(status=Status.Created).count(), 1)
+    self.assertEqual(list(SuiteExecution.get_orphaned()), [])
+
+    # Executions without any work item are, though.
+    empty_se = SuiteExecution.objects.create(suite=self.suite,
+      status=Status.Running)
+    SuiteExecution.objects.filter(id=empty_se.id).update(
+      updated=timezone.now() - timedelta(days=1))
+    self.assertEqual(list(SuiteExecution.get_orphaned()), [empty_se])
+
+
+class TestCoalescedRuns(TestCase):
+
+  def setUp(self):
+    self.suite = Suite.objects.create()
+    Check.objects.create(suite=self.suite, name='CheckDummy')
+
+  def test_coalesced(self):
+    se = self.suite.execute(distributed=True)
+    response = self.client.post('/api/suites/{}/run'.format(self.suite.id))
+    self.assertEqual(response.json()['result']['id'], se.id)
+    self.assertEqual(self.suite.executions.count(), 1)
+
+    # Once the execution is over, a new one can start.
+    Worker().run(burst=True)
+    self.assertNotEqual(self.suite.execute(distributed=True), se)
+
+  def test_scheduled(self):
+    se = SuiteExecution.objects.create(suite=self.suite,
+      priority=Priority.Batch)
+    self.suite.execute(suite_execution=se, distributed=True)
+    self.assertEqual(se.run_lock, self.suite.id)
+    response = self.client.post('/api/suites/{}/run'.format(self.suite.id))
+    self.assertEqual(response.json()['result']['id'], se.id)
+
+    # Scheduled executions are coalesced into running ones as well.
+    other_se = SuiteExecution.objects.create(suite=self.suite,
+      priority=Priority.Batch)
+    self.assertEqual(self.suite.execute(suite_execution=other_se), se)
+    other_se.refresh_from_db()
+    self.assertEqual(other_se.status, Status.Cancelled)
+
+  def test_stale_lock(self):
+    se = self.suite.execute(distributed=True)
+    # Bulk updates bypass the release of the lock.
+    SuiteExecution.objects.filter(id=se.id).update(status=Status.Cancelled)
+    new_se = self.suite.execute(distributed=True)
+    self.assertNotEqual(new_se, se)
+    self.assertEqual(new_se.run_lock, self.suite.id)
+
+  def test_disabled(self):
+    self.suite.coalesce_runs = False
+    self.suite.save()
+    self.suite.execute(distributed=True)
+    self.suite.execute(distributed=True)
+    self.assertEqual(self.suite.executions.count(), 2)
+
+
+class TestUpdateSuite(TestCase):
+
+  def setUp(self):
+    self.suite = Suite.objects.create()
+    GaParams.objects.create(suite=self.suite)
+
+  def update(self, payload):
+    return self.client.put('/api/suites/{}'.format(self.suite.id),
+      json.dumps(payload), content_type='application/json')
+
+  def test_timeout(self):
+    self.assertEqual(self.update({'timeout': 60}).status_code, 200)
+    for timeout in ('abc', -1):
+      response = self.update({'timeout': timeout})
+      self.assertEqual(response.status_code, 400)
+      self.assertIn('timeout', response.json()['errors'])
+    self.suite.refresh_from_db()
+    self.assertEqual(self.suite.timeout, 60)
+
+  def test_fail_fast(self):
+    self.assertEqual(self.update({'failFast': True}).status_code, 200)
+    response = self.update({'failFast': 'yes'})
+    self.assertEqual(response.status_code, 400)
+    self.assertIn('fail_fast', response.json()['errors'])
+    self.suite.refresh_from_db()
+    self.assertTrue(self.suite.fail_fast)
+
+  def test_retention(self):
+    self.assertEqual(self.update({'detailRetentionDays': 7,
+      'summaryRetentionDays': 30}).status_code, 200)
+    for payload in ({'detailRetentionDays': -3}, {'summaryRetentionDays': 3},
+        {'detailRetentionDays': 0}, {'detailRetentionDays': 'abc'}):
+      response = self.update(payload)
+      self.assertEqual(response.status_code, 400)
+    self.suite.refresh_from_db()
+    self.assertEqual(self.suite.get_retention_days(), (7, 30))
+
+
+class TestTimeout(TestCase):
+
+  def setUp(self):
+    self.suite = Suite.objects.create()
+    Check.objects.create(suite=self.suite, name='CheckDummy')
+    Check.objects.create(suite=self.suite, name='CheckDummy')
+    # Checks hang until the end of the test.
+    self.release = threading.Event()
+    patcher = mock.patch.object(CheckDummy, 'run',
+      side_effect=lambda params: self.release.wait(10))
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    self.addCleanup(self.release.set)
+
+  def test_check_timeout(self):
+    with mock.patch.object(CheckDummy, 'timeout', 0.1):
+      se = self.suite.execute()
+    self.assertEqual(se.status, Status.Done)
+    self.assertEqual(se.success, False)
+    self.assertEqual([ce.status for ce in se.check_executions.all()],
+      [Status.TimedOut, Status.TimedOut])
+
+  def test_suite_deadline(self):
+    self.suite.timeout = 1
+    self.suite.save()
+    se = self.suite.execute()
+    self.assertEqual(se.status, Status.TimedOut)
+    # The second check is not even started.
+    self.assertEqual(se.check_executions.count(), 1)
+    self.assertEqual(se.work_items.filter(status=Status.TimedOut).count(), 2)
+
+  def test_cancel(self):
+    se = self.suite.execute(distributed=True)
+    self.client.post('/api/suites/{}/executions/{}/cancel'.format(
+      self.suite.id, se.id))
+    se.refresh_from_db()
+    self.assertEqual(se.status, Status.Cancelled)
+    self.assertIsNone(WorkItem.claim(owner='worker'))
+
+  def test_deadline_cancelled(self):
+    deadline = Deadline(timeout=10)
+    deadline.cancelled.set()
+    with self.assertRaises(errors.CheckCancelledError):
+      deadline.call(lambda: self.release.wait(10))
+    with self.assertRaises(errors.CheckTimeoutError):
+      list(Deadline(timeout=0.1).iterate(iter(self.release.wait, True)))
+
+
+def ga_account(account_id, views=('1', '2')):
+  """An account tree as returned by `analytics.get_accounts`."""
+  property_id = 'UA-{}-1'.format(account_id)
+  return {'id': account_id, 'name': 'Account {}'.format(account_id),
+    'webProperties': [{'id': property_id, 'name': 'Property',
+      'accountId': account_id, 'websiteUrl': 'https://example.com',
+      'views': [{'id': '{}{}'.format(account_id, v), 'name': 'View {}'.format(v),
+        'accountId': account_id, 'webPropertyId': property_id,
+        'websiteUrl': 'https://example.com', 'type': 'WEB',
+        'eCommerceTracking': False, 'botFilteringEnabled': True}
+        for v in views]}]}
+
+
+@unittest.skipUnless(connection.vendor in ('sqlite', 'mysql'),
+  'Query plans are only checked on SQLite and MySQL.')
+class TestQueryPlans(TestCase):
+  """Hot queries on execution history use the indexes meant for them.
+  """
+
+  def setUp(self):
+    self.suite = Suite.objects.create()
+    GaParams.objects.create(suite=self.suite, scope_json='')
+    check = Check.objects.create(suite=self.suite, name='CheckDummy')
+    for i in range(10):
+      se = SuiteExecution.objects.create(suite=self.suite,
+        executed=timezone.now(), success=bool(i % 2))
+      CheckExecution.objects.create(suite_execution=se, check_ref=check,
+        success=bool(i % 2))
+
+  def assertUsesIndex(self, queryset, index_name):
+    self.assertIn(index_name, queryset.explain())
+
+  def assertViewUsesIndex(self, url, table, index_name):
+    """Queries on `table` issued by the API view at `url` use the index."""
+    with CaptureQueriesContext(connection) as context:
+      self.assertEqual(self.client.get(url).status_code, 200)
+    source = 'FROM {} '.format(connection.ops.quote_name(table))
+    queries = [q['sql'] for q in context.captured_queries
+               if source in q['sql']]
+    self.assertTrue(queries)
+    with connection.cursor() as cursor:
+      for sql in queries:
+        cursor.execute('{} {}'.format(connection.ops.explain_query_prefix(),
+          sql))
+        self.assertIn(index_name, str(cursor.fetchall()), sql)
+
+  def test_suite_history(self):
+    self.assertViewUsesIndex('/api/suites/{}'.format(self.suite.id),
+      'dqm_suiteexecution', 'suiteexec_suite_created')
+    self.assertViewUsesIndex('/api/suites/', 'dqm_suiteexecution',
+      'suiteexec_suite_created')
+
+  def test_stats(self):
+    since = timezone.now() - timedelta(days=10)
+    self.assertUsesIndex(SuiteExecution.get_stats_query(since),
+      'suiteexec_executed_success')
+    self.assertUsesIndex(CheckExecution.get_stats_query(since),
+      'checkexec_created_success')
+
+
 class TestApiCache(TestCase):
 
   def test_load(self):
@@ -253,9 +1572,112 @@ class TestApiCache(TestCase):
     self.assertEqual(api_cache.id, 1)
 
   def test_update(self):
-    ApiCache.load().update(ga_accounts_json="[{}]")
+    ApiCache.update_ga_accounts([ga_account('1')])
     self.assertEqual(ApiCache.objects.count(), 1)
-    self.assertEqual(ApiCache.load().ga_accounts, [{}])
+    accounts = ApiCache.load().ga_accounts
+    self.assertEqual([a['id'] for a in accounts], ['1'])
+    view = accounts[0]['webProperties'][0]['views'][0]
+    self.assertEqual(view['webPropertyId'], 'UA-1-1')
+    self.assertEqual(view['excludeQueryParameters'], False)
+
+  @mock.patch('dqm.api.views.threading.Thread')
+  def test_stale_while_revalidate(self, thread):
+    ApiCache.update_ga_accounts([ga_account('1')])
+    response = self.client.get('/api/cache').json()
+    self.assertEqual(len(response['cache']['gaAccounts']), 1)
+    self.assertLess(response['cache']['gaAccountsAge'], 60)
+    thread.assert_not_called()
+
+    ApiCache.objects.update(
+      ga_accounts_updated=timezone.now() - timedelta(days=1))
+    for i in range(2):
+      response = self.client.get('/api/cache').json()
+      self.assertEqual(len(response['cache']['gaAccounts']), 1)
+    # Only one refresh is started.
+    thread.assert_called_once()
+    thread.return_value.start.assert_called_once()
+
+    started = thread.call_args[1]['args'][0]
+    with mock.patch('dqm.helpers.analytics.get_accounts', return_value=[]):
+      views.refresh_ga_accounts(started)
+    cache = ApiCache.load()
+    self.assertEqual(cache.ga_accounts, [])
+    self.assertFalse(cache.ga_accounts_stale)
+    self.assertIsNone(cache.ga_accounts_refreshing)
+
+  def test_failed_refresh(self):
+    ApiCache.update_ga_accounts([ga_account('1')])
+    started = ApiCache.start_ga_accounts_refresh()
+    with mock.patch('dqm.helpers.analytics.get_accounts',
+      side_effect=RuntimeError):
+      views.refresh_ga_accounts(started)
+    self.assertEqual(len(ApiCache.load().ga_accounts), 1)
+    self.assertTrue(ApiCache.start_ga_accounts_refresh())
+
+  @mock.patch('dqm.helpers.analytics.get_accounts')
+  def test_fetch_while_refreshing(self, get_accounts):
+    get_accounts.return_value = [ga_account('1'), ga_account('2')]
+    ApiCache.update_ga_accounts([ga_account('1')])
+    started = ApiCache.start_ga_accounts_refresh()
+    # The running refresh is not duplicated, nor marked as over.
+    response = self.client.get('/api/gaaccounts').json()
+    self.assertEqual(len(response['gaAccounts']), 1)
+    get_accounts.assert_not_called()
+    self.assertEqual(ApiCache.load().ga_accounts_refreshing, started)
+
+    views.refresh_ga_accounts(started)
+    self.assertIsNone(ApiCache.load().ga_accounts_refreshing)
+    response = self.client.get('/api/gaaccounts').json()
+    self.assertEqual(len(response['gaAccounts']), 2)
+    get_accounts.assert_called()
+
+
+class TestGaAccounts(TestCase):
+
+  def test_diff_sync(self):
+    self.assertEqual(GaAccount.sync([ga_account('1'), ga_account('2')]), 8)
+    self.assertEqual(GaAccount.sync([ga_account('1'), ga_account('2')]), 0)
+
+    accounts = [ga_account('1', views=['1', '3']), ga_account('2')]
+    accounts[1]['webProperties'][0]['views'][0]['name'] = 'Renamed'
+    # One view created, one updated, one deleted.
+    self.assertEqual(GaAccount.sync(accounts), 3)
+    self.assertEqual(GaView.objects.get(pk='21').name, 'Renamed')
+    self.assertEqual(
+      list(GaProperty.objects.get(pk='UA-1-1').views.values_list('id',
+        flat=True).order_by('id')), ['11', '13'])
+
+    # Account 1 deleted (with its property and views), view 21 renamed back.
+    self.assertEqual(GaAccount.sync([ga_account('2')]), 5)
+    self.assertEqual(GaView.objects.filter(account_id='1').count(), 0)
+
+  @mock.patch('dqm.helpers.analytics.get_account_tree')
+  @mock.patch('dqm.helpers.analytics.get_service')
+  @mock.patch('dqm.helpers.analytics.get_pool')
+  def test_several_service_accounts(self, get_pool, get_service,
+    get_account_tree):
+    other_property = ga_account('1', views=['4'])['webProperties'][0]
+    other_property['id'] = 'UA-1-2'
+    for view in other_property['views']:
+      view['webPropertyId'] = 'UA-1-2'
+    shared = ga_account('1', views=['2', '3'])
+    shared['webProperties'].append(other_property)
+    trees = {
+      'key-1.json': [ga_account('1', views=['1', '2'])],
+      'key-2.json': [shared, ga_account('2')],
+    }
+    get_pool.return_value.service_accounts = list(trees)
+    get_service.side_effect = lambda *args, service_account: service_account
+    get_account_tree.side_effect = trees.get
+
+    # Properties and views granted to either service account are merged.
+    accounts = analytics.get_accounts()
+    self.assertEqual([a['id'] for a in accounts], ['1', '2'])
+    self.assertEqual(
+      {p['id']: [v['id'] for v in p['views']]
+        for p in accounts[0]['webProperties']},
+      {'UA-1-1': ['11', '12', '13'], 'UA-1-2': ['14']})
+    self.assertEqual(GaAccount.sync(accounts), 11)
 
 
 if __name__ == '__main__':
@@ -29,11 +29,21 @@ urlpatterns = [
       path('', views.suites),
       path('<int:suite_id>', views.suite),
       path('<int:suite_id>/run', views.run_suite),
+      path('<int:suite_id>/estimate', views.estimate_suite),
+      path('<int:suite_id>/executions/<int:suite_execution_id>/resume',
+        views.resume_suite_execution),
+      path('<int:suite_id>/executions/<int:suite_execution_id>/cancel',
+        views.cancel_suite_execution),
       path('<int:suite_id>/checks', views.create_check),
       path('<int:suite_id>/checks/<int:check_id>', views.check),
       path('stats', views.stats_suites_executions),
     ])),
 
+    path('checkexecutions/<int:check_execution_id>/payload',
+      views.check_execution_payload),
+    path('checkexecutions/<int:check_execution_id>/delta',
+      views.check_execution_delta),
+
     path('checks/', include([
       path('', views.checks_list),
       path('stats', views.stats_checks_executions),
@@ -0,0 +1,65 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Workers executing the work items of suite executions (see `WorkItem`
+model).
+
+Any number of workers, on any number of nodes, can share the same database (see
+the `run_worker` management command). Each work item is claimed by a single
+worker at a time, for `WORKER_LEASE_SECONDS`. The lease is renewed every
+`WORKER_HEARTBEAT_SECONDS` while the item is executed: if a worker dies, its
+items are claimed again by other workers once their lease expired.
+
+The suite execution is finalized by the worker completing its last work item.
+"""
+
+import logging
+import os
+import socket
+import time
+import traceback
+from typing import Optional
+
+from django.conf import settings
+from dqm.models import WorkItem
+
+
+logger = logging.getLogger(__name__)
+
+
+class Worker:
+
+  def __init__(self, name: str = None) -> None:
+    self.name = name or '{}-{}'.format(socket.gethostname(), os.getpid())
+
+  def run_once(self) -> Optional[WorkItem]:
+    """Claim and execute a single work item, if any is available.
+    """
+    work_item = WorkItem.claim(owner=self.name)
+    if work_item:
+      try:
+        work_item.execute(owner=self.name)
+      except Exception:
+        logger.error(traceback.format_exc())
+    return work_item
+
+  def run(self, burst: bool = False) -> None:
+    """Execute work items forever, or until there is none left if `burst` is
+    set.
+    """
+    while True:
+      if not self.run_once():
+        if burst:
+          break
+        time.sleep(settings.WORKER_POLL_SECONDS)
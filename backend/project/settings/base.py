@@ -15,7 +15,9 @@
 """Base configuration for the DQM project.
 """
 
+import json
 import os
+import tempfile
 
 import pymysql
 
@@ -27,6 +29,69 @@ DQM_CLOUDSQL_CONNECTION_NAME = os.getenv('DQM_CLOUDSQL_CONNECTION_NAME')
 DQM_SQLITE_FILE_PATH = os.getenv('DQM_SQLITE_FILE_PATH', 'db')
 SECRET_KEY = os.getenv('DQM_SECRET_KEY', 'unsecuredsecretkey')
 SERVICE_ACCOUNT_FILE = os.getenv('DQM_SERVICE_ACCOUNT_FILE_PATH', 'key.json')
+# Pool of service accounts to spread GA quota on, e.g.
+# '[{"file": "key-1.json", "accounts": ["123456"]}, {"file": "key-2.json"}]'
+# (see `dqm.helpers.service_accounts`). Defaults to SERVICE_ACCOUNT_FILE.
+SERVICE_ACCOUNTS = json.loads(os.getenv('DQM_SERVICE_ACCOUNTS', '[]'))
+# Consecutive errors after which a service account is put aside.
+SERVICE_ACCOUNT_MAX_ERRORS = int(os.getenv('DQM_SERVICE_ACCOUNT_MAX_ERRORS', 3))
+# Access tokens shared by the processes of a node (see `dqm.helpers.token_cache`)
+# and refreshed this many seconds before they expire.
+TOKEN_CACHE_DIR = os.getenv('DQM_TOKEN_CACHE_DIR',
+  os.path.join(tempfile.gettempdir(), 'dqm-tokens'))
+TOKEN_REFRESH_MARGIN_SECONDS = int(
+  os.getenv('DQM_TOKEN_REFRESH_MARGIN_SECONDS', 300))
+GA_MAX_PARALLEL_REQUESTS = int(os.getenv('DQM_GA_MAX_PARALLEL_REQUESTS', 10))
+# GA Reporting API quotas (see `dqm.estimator`).
+GA_QUOTA_REQUESTS_PER_DAY = int(
+  os.getenv('DQM_GA_QUOTA_REQUESTS_PER_DAY', 50000))
+GA_QUOTA_REQUESTS_PER_VIEW_PER_DAY = int(
+  os.getenv('DQM_GA_QUOTA_REQUESTS_PER_VIEW_PER_DAY', 10000))
+# Time a service account is put aside after exceeding GA quota, in seconds.
+GA_QUOTA_BACKOFF_SECONDS = int(os.getenv('DQM_GA_QUOTA_BACKOFF_SECONDS', 60))
+# Age after which cached GA accounts are refreshed in the background, in
+# seconds (see `ApiCache`).
+API_CACHE_TTL_SECONDS = int(os.getenv('DQM_API_CACHE_TTL_SECONDS', 3600))
+RESULT_CHUNK_SIZE = int(os.getenv('DQM_RESULT_CHUNK_SIZE', 1000))
+# Results are stored as deltas against the previous execution, and in full
+# every this many executions (see `CheckExecution.store_result`).
+RESULT_SNAPSHOT_INTERVAL = int(os.getenv('DQM_RESULT_SNAPSHOT_INTERVAL', 10))
+# Maximum number of checks of a suite executed in parallel, when executed
+# locally and not on SQLite (see `Suite.execute`).
+SUITE_MAX_PARALLEL_CHECKS = int(os.getenv('DQM_SUITE_MAX_PARALLEL_CHECKS', 4))
+# Default maximum execution time of a check, in seconds.
+CHECK_TIMEOUT = int(os.getenv('DQM_CHECK_TIMEOUT', 600))
+
+# Workers (see `dqm.worker`)
+WORKER_LEASE_SECONDS = int(os.getenv('DQM_WORKER_LEASE_SECONDS', 300))
+WORKER_HEARTBEAT_SECONDS = int(os.getenv('DQM_WORKER_HEARTBEAT_SECONDS', 60))
+WORKER_POLL_SECONDS = int(os.getenv('DQM_WORKER_POLL_SECONDS', 5))
+DISTRIBUTED_EXECUTION = os.getenv('DQM_DISTRIBUTED_EXECUTION', '') == '1'
+
+# Running executions not updated for this long, and without any leased work
+# item, are considered orphaned (see `dqm.janitor`).
+JANITOR_ORPHAN_SECONDS = int(os.getenv('DQM_JANITOR_ORPHAN_SECONDS', 600))
+# Deleted suites are purged by batches of this many rows, and at most this
+# many batches per scheduler tick.
+PURGE_BATCH_SIZE = int(os.getenv('DQM_PURGE_BATCH_SIZE', 1000))
+PURGE_BATCHES_PER_TICK = int(os.getenv('DQM_PURGE_BATCHES_PER_TICK', 50))
+
+# Retention of executions, in days, 0 meaning forever (see `dqm.retention`).
+RETENTION_DETAIL_DAYS = int(os.getenv('DQM_RETENTION_DETAIL_DAYS', 0))
+RETENTION_SUMMARY_DAYS = int(os.getenv('DQM_RETENTION_SUMMARY_DAYS', 0))
+RETENTION_BATCH_SIZE = int(os.getenv('DQM_RETENTION_BATCH_SIZE', 500))
+ARCHIVE_DIR = os.getenv('DQM_ARCHIVE_DIR', 'archives')
+
+# Scheduler (see `dqm.scheduler`)
+SCHEDULER_TICK = int(os.getenv('DQM_SCHEDULER_TICK', 30))
+SCHEDULER_MAX_CONCURRENT_RUNS = int(
+  os.getenv('DQM_SCHEDULER_MAX_CONCURRENT_RUNS', 4))
+SCHEDULER_MAX_CONCURRENT_RUNS_PER_ACCOUNT = int(
+  os.getenv('DQM_SCHEDULER_MAX_CONCURRENT_RUNS_PER_ACCOUNT', 1))
+# JSON object of GA account ids and their weights (defaults to 1), e.g.
+# '{"123456": 2}'
+SCHEDULER_ACCOUNT_WEIGHTS = json.loads(
+  os.getenv('DQM_SCHEDULER_ACCOUNT_WEIGHTS', '{}'))
 
 DEBUG = False
 
@@ -25,7 +25,10 @@ export enum Status {
   Created = 0,
   Running = 1,
   Done = 2,
-  Failed = 3
+  Failed = 3,
+  TimedOut = 4,
+  Cancelled = 5,
+  Skipped = 6
 }
 
 export interface AppSettings {
@@ -113,7 +116,11 @@ export interface SuiteCreationData {
 
 export interface CheckExecutionResult {
   success: boolean;
-  payload: Map<string, any>; // À confirmer
+  payload: Array<any>;
+  total_problems?: number;
+  estimated?: boolean;
+  total_is_lower_bound?: boolean;
+  group_by?: string;
 }
 
 export interface CheckExecution {
@@ -122,6 +129,7 @@ export interface CheckExecution {
   title: string; // À virer (mettre une référence à CheckMetadata)
   status: Status;
   success: boolean;
+  reused: boolean;
   inputData: Map<string, any>;
   result: CheckExecutionResult;
 }